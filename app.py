@@ -1,25 +1,80 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
 import json
 import os
 from datetime import datetime
 import csv
 import io
-from healthcare_entity_extractor import HealthcareEntityExtractor
-from healthcare_event_extractor import HealthcareEventExtractor
+import time
+from contextlib import nullcontext
+from healthcare_rules import RuleSet, rule_set_loader
+from healthcare_batch import RESULT_FIELDS, extract_document, select_fields, run_batch, default_workers
+from healthcare_chunking import CHUNK_SIZE, iter_waves
+from healthcare_cache import ResultCache
+from healthcare_incremental import IncrementalExtractor, DocumentStateStore, apply_edits, changed_region
+from healthcare_jobs import JobStore, JobQueue, JobQueueFull
+from healthcare_index import DocumentIndex
+from healthcare_dates import parse_date
+from healthcare_export import EXPORT_FORMATS, export_documents, iter_export
+from healthcare_results import dump_batch
+from healthcare_metrics import registry as metrics_registry, stage, collect_timings, observe_request
 
 app = Flask(__name__)
 CORS(app)
 
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config['BATCH_WORKERS'] = default_workers()
+app.config['MAX_BATCH_DOCUMENTS'] = 1000
+# Documents longer than this are extracted window by window (same results, flat memory)
+app.config['CHUNK_SIZE'] = CHUNK_SIZE
+# What a request may name in 'fields' to get only part of a response
+RESPONSE_FIELDS = RESULT_FIELDS + ('processed_text',)
 
-entity_extractors = {
-    'healthcare': HealthcareEntityExtractor()
-}
-event_extractors = {
-    'healthcare': HealthcareEventExtractor()
+# Compiled rules per domain. Each loader swaps in a new rule set when its file changes,
+# while requests already running finish on the one they started with.
+rule_loaders = {
+    'healthcare': rule_set_loader()
 }
 
+def get_rules(domain: str) -> RuleSet:
+    return rule_loaders.get(domain, rule_loaders['healthcare']).current()
+
+# Results of /api/extract, keyed on the request and the version of the rules file so a
+# rule change never serves stale results. Set RESULT_CACHE_DB to keep them across restarts
+# (at most RESULT_CACHE_DB_SIZE results on disk).
+result_cache = ResultCache(
+    max_entries=int(os.environ.get('RESULT_CACHE_SIZE', 1024)),
+    db_path=os.environ.get('RESULT_CACHE_DB'),
+    max_disk_entries=int(os.environ.get('RESULT_CACHE_DB_SIZE', 100000))
+)
+
+# Per-document extraction state for /api/extract/incremental, kept in this process only
+document_states = DocumentStateStore(max_entries=int(os.environ.get('INCREMENTAL_DOCUMENTS', 256)))
+
+# Background extraction jobs. Their state is kept in SQLite so a status poll can be
+# answered by any worker process; each process runs the jobs it accepted.
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_QUEUE_SIZE'] = int(os.environ.get('JOB_QUEUE_SIZE', 64))
+app.config['JOB_STORE_DB'] = os.environ.get('JOB_STORE_DB', os.path.join(app.instance_path, 'jobs.db'))
+os.makedirs(os.path.dirname(os.path.abspath(app.config['JOB_STORE_DB'])), exist_ok=True)
+job_queue = JobQueue(JobStore(app.config['JOB_STORE_DB']), app.config['JOB_WORKERS'], app.config['JOB_QUEUE_SIZE'])
+
+# Corpus-wide search over indexed results (/api/index, /api/search, /api/timeline)
+app.config['SEARCH_INDEX_DB'] = os.environ.get('SEARCH_INDEX_DB', os.path.join(app.instance_path, 'index.db'))
+document_index = DocumentIndex(app.config['SEARCH_INDEX_DB'])
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    # Streaming responses are timed up to their first byte
+    started = g.get('request_started')
+    if started is not None and request.endpoint:
+        observe_request(request.endpoint, time.perf_counter() - started, g.get('document_chars'))
+    return response
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -35,29 +90,184 @@ def extract_entities_and_events():
 
         if not text.strip():
             return jsonify({'error': 'No text provided'}), 400
+        try:
+            fields = _response_fields(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        result_fields = _result_fields(fields)
 
-        extractor = entity_extractors.get(domain, entity_extractors['healthcare'])
-        event_extractor_obj = event_extractors.get(domain, event_extractors['healthcare'])
-        entities = extractor.extract_entities(text, selected_entities)
-        entities = extractor.filter_entities_by_confidence(entities, min_confidence)
-        events = event_extractor_obj.extract_events(text, entities)
-        entity_stats = extractor.get_entity_statistics(entities)
-        event_stats = event_extractor_obj.get_event_statistics(events)
-        response = {
-            'entities': entities,
-            'events': events,
-            'statistics': {
-                'entities': entity_stats,
-                'events': event_stats,
-                'total_entities': len(entities),
-                'total_events': len(events)
-            },
-            'processed_text': text
-        }
-        return jsonify(response)
+        rules = get_rules(domain)
+        extractor, event_extractor_obj = rules.extractors
+        g.document_chars = len(text)
+        # With timings set, the response carries a per-stage breakdown in milliseconds
+        want_timings = _is_enabled(data.get('timings', request.args.get('timings')))
+        with (collect_timings() if want_timings else nullcontext()) as timings:
+            with stage('cache_lookup'):
+                full_key = ResultCache.make_key(text, selected_entities, min_confidence, domain, rules.version)
+                cache_key = full_key if result_fields is None else \
+                    ResultCache.make_key(text, selected_entities, min_confidence, domain, rules.version,
+                                         result_fields)
+                response = result_cache.get(cache_key)
+                if response is None and cache_key != full_key:
+                    # A full result already stored answers a lighter request too
+                    response = result_cache.get(full_key)
+                    if response is not None:
+                        response = select_fields(response, result_fields)
+                        cache_key = full_key
+            if response is None:
+                response = extract_document(extractor, event_extractor_obj, text, selected_entities, min_confidence,
+                                            app.config['CHUNK_SIZE'], fields=result_fields)
+                result_cache.put(cache_key, response)
+        if fields is None or 'processed_text' in fields:
+            response['processed_text'] = text
+        response['result_id'] = cache_key
+        if want_timings:
+            timings['total'] = round((time.perf_counter() - g.request_started) * 1000, 3)
+            response['timings'] = timings
+        with stage('serialization'):
+            return jsonify(response)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/extract/incremental', methods=['POST'])
+def extract_incremental():
+    # Without result_id the text is extracted in full and its state kept. With the
+    # result_id of an earlier response plus either edits ([{start, end, text}] against
+    # that response's text) or the whole new text, only the region the change can
+    # affect is extracted again. An unknown result_id gets a 404: send the full text.
+    try:
+        data = request.get_json()
+        result_id = data.get('result_id')
+        domain = data.get('domain', 'healthcare')
+        rules = get_rules(domain)
+        incremental = IncrementalExtractor(*rules.extractors, app.config['CHUNK_SIZE'])
+
+        state = None
+        if result_id:
+            state = document_states.get(result_id)
+            if state is None:
+                return jsonify({'error': 'Result not found or expired; send the full text'}), 404
+        selected_entities = data.get('entity_types', state.selected_types if state else [])
+        min_confidence = data.get('min_confidence', state.min_confidence if state else 0.5)
+
+        if state is not None and 'edits' in data:
+            try:
+                text, start, old_end, new_end = apply_edits(state.text, data['edits'])
+            except (ValueError, KeyError, TypeError) as e:
+                return jsonify({'error': f'Invalid edits: {e}'}), 400
+        elif 'text' in data:
+            text = data['text']
+            if state is not None:
+                start, old_end, new_end = changed_region(state.text, text)
+        else:
+            return jsonify({'error': 'No text or edits provided'}), 400
+        if not text.strip():
+            return jsonify({'error': 'No text provided'}), 400
+        g.document_chars = len(text)
+
+        if state is not None and state.matches(selected_entities, min_confidence, rules.version):
+            state = incremental.update(state, text, start, old_end, new_end)
+        else:
+            state = incremental.extract(text, selected_entities, min_confidence, rules.version)
+        response = incremental.result(state)
+        result_id = ResultCache.make_key(text, selected_entities, min_confidence, domain, rules.version)
+        document_states.put(result_id, state)
+        result_cache.put(result_id, response)
+        response['processed_text'] = text
+        response['result_id'] = result_id
+        with stage('serialization'):
+            return jsonify(response)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/extract/batch', methods=['POST'])
+def extract_batch():
+    try:
+        data = request.get_json()
+        documents = data.get('documents', data.get('texts', []))
+        selected_entities = data.get('entity_types', [])
+        min_confidence = data.get('min_confidence', 0.5)
+        domain = data.get('domain', 'healthcare')
+        try:
+            workers = int(data.get('workers', app.config['BATCH_WORKERS']))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'workers must be an integer'}), 400
+
+        if not isinstance(documents, list) or not documents:
+            return jsonify({'error': 'No documents provided'}), 400
+        try:
+            result_fields = _result_fields(_response_fields(data))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        g.document_chars = sum(len(doc.get('text', '') if isinstance(doc, dict) else str(doc)) for doc in documents)
+        if len(documents) > app.config['MAX_BATCH_DOCUMENTS']:
+            return jsonify({'error': f"At most {app.config['MAX_BATCH_DOCUMENTS']} documents per batch"}), 400
+
+        rules = get_rules(domain)
+        extractor, event_extractor_obj = rules.extractors
+
+        ids, texts, payloads = _batch_payloads(documents, selected_entities, min_confidence, result_fields)
+        for payload in payloads:
+            payload['compact'] = True
+        extracted = run_batch('document', payloads, rules.config_path, min(workers, app.config['BATCH_WORKERS']),
+                              (extractor, event_extractor_obj))
+        # Results stay compact until each is serialized in turn
+        return Response(dump_batch(_batch_response(ids, texts, extracted), texts, app.json.dumps),
+                        mimetype=app.json.mimetype)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _batch_payloads(documents, selected_entities, min_confidence, fields=None):
+    # Documents may be plain strings or {'id': ..., 'text': ...} objects
+    ids = [doc.get('id') if isinstance(doc, dict) else None for doc in documents]
+    texts = [doc.get('text', '') if isinstance(doc, dict) else doc for doc in documents]
+    payloads = [
+        {'text': text, 'selected_types': selected_entities, 'min_confidence': min_confidence,
+         'chunk_size': app.config['CHUNK_SIZE'], 'fields': fields}
+        for text in texts if isinstance(text, str) and text.strip()
+    ]
+    return ids, texts, payloads
+
+def _response_fields(data):
+    # The fields a caller asked for, as a list or a comma-separated string (in the
+    # body or the query string); None means all of RESPONSE_FIELDS
+    value = data.get('fields', request.args.get('fields'))
+    if value is None or value == '':
+        return None
+    if isinstance(value, str):
+        value = value.split(',')
+    fields = {str(field).strip() for field in value} - {''}
+    unknown = fields.difference(RESPONSE_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}; "
+                         f"available: {', '.join(RESPONSE_FIELDS)}")
+    return fields
+
+def _result_fields(fields):
+    # The extract_document fields behind a response; None when all are needed
+    if fields is None or fields.issuperset(RESULT_FIELDS):
+        return None
+    return [field for field in RESULT_FIELDS if field in fields]
+
+def _batch_response(ids, texts, extracted):
+    # extracted holds one result per non-empty text, in order
+    extracted = iter(extracted)
+    results = []
+    for index, (doc_id, text) in enumerate(zip(ids, texts)):
+        if isinstance(text, str) and text.strip():
+            result = next(extracted)
+        else:
+            result = {'error': 'No text provided'}
+        result['index'] = index
+        if doc_id is not None:
+            result['id'] = doc_id
+        results.append(result)
+    return {
+        'results': results,
+        'total_documents': len(results),
+        'failed_documents': sum(1 for result in results if 'error' in result)
+    }
+
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     try:
@@ -68,122 +278,370 @@ def upload_file():
             return jsonify({'error': 'No file selected'}), 400
         if not file.filename.endswith(('.txt', '.csv')):
             return jsonify({'error': 'Only .txt and .csv files are supported'}), 400
-        content = file.read().decode('utf-8')
         selected_entities = request.form.getlist('entity_types')
         min_confidence = float(request.form.get('min_confidence', 0.5))
         domain = request.form.get('domain', 'healthcare')
-        extractor = entity_extractors.get(domain, entity_extractors['healthcare'])
-        event_extractor_obj = event_extractors.get(domain, event_extractors['healthcare'])
-        entities = extractor.extract_entities(content, selected_entities)
-        entities = extractor.filter_entities_by_confidence(entities, min_confidence)
-        events = event_extractor_obj.extract_events(content, entities)
-        entity_stats = extractor.get_entity_statistics(entities)
-        event_stats = event_extractor_obj.get_event_statistics(events)
-        response = {
-            'entities': entities,
-            'events': events,
-            'statistics': {
-                'entities': entity_stats,
-                'events': event_stats,
-                'total_entities': len(entities),
-                'total_events': len(events)
-            },
-            'processed_text': content,
-            'filename': file.filename
-        }
+        rules = get_rules(domain)
+        extractor, event_extractor_obj = rules.extractors
+        if _is_enabled(request.values.get('stream')):
+            return _stream_upload(file, extractor, event_extractor_obj, selected_entities, min_confidence)
+        content = file.read().decode('utf-8')
+        g.document_chars = len(content)
+        response = extract_document(extractor, event_extractor_obj, content, selected_entities, min_confidence,
+                                    app.config['CHUNK_SIZE'])
+        response['processed_text'] = content
+        response['filename'] = file.filename
         return jsonify(response)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/export/<format_type>', methods=['POST'])
-def export_results(format_type):
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
     try:
-        data = request.get_json()
-        entities = data.get('entities', [])
-        events = data.get('events', [])
-        
-        if format_type == 'json':
-            export_data = {
-                'entities': entities,
-                'events': events,
-                'exported_at': datetime.now().isoformat()
+        # Same inputs as /api/extract (text), /api/extract/batch (documents) or /api/upload (file)
+        if 'file' in request.files:
+            file = request.files['file']
+            if not file.filename.endswith(('.txt', '.csv')):
+                return jsonify({'error': 'Only .txt and .csv files are supported'}), 400
+            data = {
+                'text': file.read().decode('utf-8'),
+                'entity_types': request.form.getlist('entity_types'),
+                'min_confidence': float(request.form.get('min_confidence', 0.5)),
+                'domain': request.form.get('domain', 'healthcare')
             }
-            
-            output = io.StringIO()
-            json.dump(export_data, output, indent=2)
-            output.seek(0)
-            
-            return send_file(
-                io.BytesIO(output.getvalue().encode()),
-                mimetype='application/json',
-                as_attachment=True,
-                download_name=f'healthcare_extraction_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-            )
-        
-        elif format_type == 'csv':
-            output = io.StringIO()
-            writer = csv.writer(output)
-            
-            writer.writerow(['Type', 'Category', 'Text', 'Start', 'End', 'Confidence', 'Attributes'])
-            
-            for entity in entities:
-                writer.writerow([
-                    'Entity',
-                    entity.get('type', ''),
-                    entity.get('text', ''),
-                    entity.get('start', ''),
-                    entity.get('end', ''),
-                    entity.get('confidence', ''),
-                    ''
-                ])
-            
-            for event in events:
-                writer.writerow([
-                    'Event',
-                    event.get('type', ''),
-                    event.get('trigger', ''),
-                    event.get('start', ''),
-                    event.get('end', ''),
-                    event.get('confidence', ''),
-                    json.dumps(event.get('attributes', {}))
-                ])
-            
-            output.seek(0)
-            
-            return send_file(
-                io.BytesIO(output.getvalue().encode()),
-                mimetype='text/csv',
-                as_attachment=True,
-                download_name=f'healthcare_extraction_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv'
-            )
-        
         else:
+            data = request.get_json() or {}
+        selected_entities = data.get('entity_types', [])
+        min_confidence = data.get('min_confidence', 0.5)
+        rules = get_rules(data.get('domain', 'healthcare'))
+
+        if 'documents' in data:
+            documents = data['documents']
+            if not isinstance(documents, list) or not documents:
+                return jsonify({'error': 'No documents provided'}), 400
+            if len(documents) > app.config['MAX_BATCH_DOCUMENTS']:
+                return jsonify({'error': f"At most {app.config['MAX_BATCH_DOCUMENTS']} documents per batch"}), 400
+            ids, texts, payloads = _batch_payloads(documents, selected_entities, min_confidence)
+            for payload in payloads:
+                payload['compact'] = True
+            workers = app.config['BATCH_WORKERS']
+
+            # Job work runs in the worker pool, never on the job thread inside the web process
+            def run(progress):
+                extracted = []
+                for wave in iter_waves(payloads, max(1, workers) * 4):
+                    extracted.extend(run_batch('document', wave, rules.config_path, workers, offload=True))
+                    progress(len(extracted))
+                # Stored pre-serialized, so the results are never all dicts at once
+                return ''.join(dump_batch(_batch_response(ids, texts, extracted), texts))
+            total = len(payloads)
+        else:
+            text = data.get('text', '')
+            if not text.strip():
+                return jsonify({'error': 'No text provided'}), 400
+            _, _, payloads = _batch_payloads([text], selected_entities, min_confidence)
+
+            def run(progress):
+                result = run_batch('document', payloads, rules.config_path, app.config['BATCH_WORKERS'],
+                                   offload=True)[0]
+                if 'error' in result:
+                    raise RuntimeError(result['error'])
+                progress(1)
+                return result
+            total = 1
+
+        job_id = job_queue.submit(run, total)
+        response = jsonify({'job_id': job_id, 'status': 'queued', 'status_url': f'/api/jobs/{job_id}'})
+        response.status_code = 202
+        response.headers['Location'] = f'/api/jobs/{job_id}'
+        return response
+    except JobQueueFull as e:
+        response = jsonify({'error': str(e)})
+        response.status_code = 429
+        response.headers['Retry-After'] = '5'
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>')
+def get_job(job_id):
+    # include_result=0 polls status and progress without transferring the result
+    job = job_queue.store.get(job_id, request.args.get('include_result', '1') != '0')
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@app.route('/api/index', methods=['POST'])
+def index_documents():
+    # Adds results to the search index: documents to extract ([{id, text, date}], date
+    # being when the note was written, for relative dates), or a stored result named by
+    # result_id (with an id and optional date) or job_id. Re-indexing an id replaces it.
+    try:
+        data = request.get_json() or {}
+        if 'documents' in data:
+            documents = data['documents']
+            if not isinstance(documents, list) or not documents:
+                return jsonify({'error': 'No documents provided'}), 400
+            if len(documents) > app.config['MAX_BATCH_DOCUMENTS']:
+                return jsonify({'error': f"At most {app.config['MAX_BATCH_DOCUMENTS']} documents per batch"}), 400
+            if not all(isinstance(doc, dict) and doc.get('id') is not None for doc in documents):
+                return jsonify({'error': 'Every document needs an id'}), 400
+            references = [_query_date(doc.get('date')) for doc in documents]
+            rules = get_rules(data.get('domain', 'healthcare'))
+            ids, texts, payloads = _batch_payloads(documents, data.get('entity_types', []),
+                                                   data.get('min_confidence', 0.5))
+            g.document_chars = sum(len(payload['text']) for payload in payloads)
+            extracted = _batch_response(ids, texts, run_batch('document', payloads, rules.config_path,
+                                                              app.config['BATCH_WORKERS'], rules.extractors))
+            entries = [(str(doc_id), result, reference)
+                       for doc_id, result, reference in zip(ids, extracted['results'], references)
+                       if 'error' not in result]
+        elif data.get('result_id'):
+            if data.get('id') is None:
+                return jsonify({'error': 'An id is needed to index a result'}), 400
+            result = result_cache.get(data['result_id'])
+            if result is None:
+                return jsonify({'error': 'Result not found or expired'}), 404
+            entries = [(str(data['id']), result, _query_date(data.get('date')))]
+        elif data.get('job_id'):
+            job = job_queue.store.get(data['job_id'])
+            if job is None:
+                return jsonify({'error': 'Job not found'}), 404
+            if job['status'] != 'done':
+                return jsonify({'error': f"Job is {job['status']}"}), 409
+            result = job['result']
+            if 'results' in result:
+                entries = [(str(document.get('id', f"{data['job_id']}:{document['index']}")), document, None)
+                           for document in result['results'] if 'error' not in document]
+            else:
+                entries = [(str(data.get('id', data['job_id'])), result, _query_date(data.get('date')))]
+        else:
+            return jsonify({'error': 'No documents, result_id or job_id provided'}), 400
+
+        indexed = document_index.add_many(entries)
+        return jsonify({'indexed': indexed, 'index': document_index.stats()})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/search')
+def search_index():
+    # e.g. ?entity_type=MEDICATION&entity=warfarin&event_type=DISCHARGE&near=200
+    #      &date_from=2024-03-01&date_to=2024-03-31
+    try:
+        args = request.args
+        near = args.get('near', type=int)
+        result = document_index.search(
+            entity_type=args.get('entity_type'), entity=args.get('entity'), event_type=args.get('event_type'),
+            date_from=_query_date(args.get('date_from')), date_to=_query_date(args.get('date_to')),
+            near=near, after=args.get('after', 0, type=int), limit=min(args.get('limit', 50, type=int), 1000))
+        return jsonify(result)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/timeline')
+def get_timeline():
+    # Dated events in calendar order, for one document or across the index
+    try:
+        args = request.args
+        events = document_index.timeline(
+            document=args.get('document'), event_type=args.get('event_type'),
+            entity_type=args.get('entity_type'), entity=args.get('entity'),
+            date_from=_query_date(args.get('date_from')), date_to=_query_date(args.get('date_to')),
+            offset=args.get('offset', 0, type=int), limit=min(args.get('limit', 200, type=int), 5000))
+        return jsonify({'events': events, 'count': len(events)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _query_date(value):
+    if value is None or value == '':
+        return None
+    parsed = parse_date(str(value))
+    if parsed is None:
+        raise ValueError(f'Not a date: {value}')
+    return parsed
+
+def _is_enabled(value) -> bool:
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+def iter_upload_records(stream, filename, csv_column=None):
+    # Yields (line_number, text) one record at a time: a line of a .txt file, or a
+    # row of a .csv file (a single column of it when csv_column names a header)
+    reader = io.TextIOWrapper(stream, encoding='utf-8', newline='')
+    try:
+        if filename.endswith('.csv'):
+            rows = csv.reader(reader)
+            column_index = None
+            if csv_column:
+                header = next(rows, [])
+                if csv_column not in header:
+                    raise ValueError(f'Column not found: {csv_column}')
+                column_index = header.index(csv_column)
+            for row in rows:
+                if column_index is not None:
+                    text = row[column_index] if column_index < len(row) else ''
+                else:
+                    text = ', '.join(row)
+                if text.strip():
+                    yield rows.line_num, text
+        else:
+            for line_number, line in enumerate(reader, 1):
+                if line.strip():
+                    yield line_number, line.rstrip('\r\n')
+    finally:
+        reader.detach()
+
+def _stream_upload(file, extractor, event_extractor_obj, selected_entities, min_confidence):
+    include_text = _is_enabled(request.values.get('include_text'))
+    csv_column = request.values.get('csv_column')
+    filename = file.filename
+    # The request closes its uploaded files once the view returns, so the generator
+    # takes ownership of the spooled upload and closes it itself
+    upload = file.stream
+    file.stream = io.BytesIO()
+
+    def generate():
+        records = failed = total_entities = total_events = 0
+        try:
+            for line_number, text in iter_upload_records(upload, filename, csv_column):
+                try:
+                    result = extract_document(extractor, event_extractor_obj, text,
+                                              selected_entities, min_confidence, app.config['CHUNK_SIZE'])
+                    total_entities += result['statistics']['total_entities']
+                    total_events += result['statistics']['total_events']
+                    if include_text:
+                        result['processed_text'] = text
+                except Exception as e:
+                    result = {'error': str(e)}
+                    failed += 1
+                result['record'] = records
+                result['line'] = line_number
+                records += 1
+                yield json.dumps(result) + '\n'
+        except Exception as e:
+            yield json.dumps({'error': str(e)}) + '\n'
+        finally:
+            upload.close()
+        yield json.dumps({'summary': {
+            'filename': filename,
+            'records': records,
+            'failed_records': failed,
+            'total_entities': total_entities,
+            'total_events': total_events
+        }}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/export/<format_type>', methods=['GET', 'POST'])
+def export_results(format_type):
+    try:
+        if format_type not in EXPORT_FORMATS:
             return jsonify({'error': 'Unsupported export format'}), 400
-    
+        data = request.get_json(silent=True) or {}
+        # Results can be named by the result_id of /api/extract or a finished job's id
+        # instead of being posted back
+        result_id = data.get('result_id', request.args.get('result_id'))
+        job_id = data.get('job_id', request.args.get('job_id'))
+        if result_id:
+            result = result_cache.get(result_id)
+            if result is None:
+                return jsonify({'error': 'Result not found or expired'}), 404
+        elif job_id:
+            job = job_queue.store.get(job_id)
+            if job is None:
+                return jsonify({'error': 'Job not found'}), 404
+            if job['status'] != 'done':
+                return jsonify({'error': f"Job is {job['status']}"}), 409
+            result = job['result']
+        else:
+            result = {'entities': data.get('entities', []), 'events': data.get('events', [])}
+
+        mimetype, extension = EXPORT_FORMATS[format_type]
+        try:
+            chunks = iter_export(format_type, export_documents(result))
+        except ImportError:
+            return jsonify({'error': f'{format_type} export requires pyarrow to be installed'}), 501
+        filename = f'healthcare_extraction_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extension}'
+        return Response(stream_with_context(chunks), mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/health')
+def health():
+    # Liveness: the process is up and answering
+    return jsonify({'status': 'ok', 'pid': os.getpid()})
+
+@app.route('/api/ready')
+def ready():
+    # Readiness: every domain has a compiled rule set to serve from. A rules file that
+    # failed to reload is reported but does not fail the check, as the previous rules
+    # are still in service.
+    try:
+        rules = {domain: loader.current() for domain, loader in rule_loaders.items()}
+    except Exception as e:
+        return jsonify({'status': 'unavailable', 'error': str(e)}), 503
+    return jsonify({
+        'status': 'ready',
+        'pid': os.getpid(),
+        'rules': {
+            domain: {'version': rule_set.version, 'last_error': rule_loaders[domain].last_error}
+            for domain, rule_set in rules.items()
+        }
+    })
+
+@app.route('/api/metrics')
+def get_metrics():
+    # Prometheus text exposition; each process reports its own counters
+    cache_stats = result_cache.stats()
+    cache_lines = []
+    for name in ('hits', 'disk_hits', 'misses', 'evictions'):
+        cache_lines.append(f'# TYPE result_cache_{name}_total counter')
+        cache_lines.append(f'result_cache_{name}_total {cache_stats[name]}')
+    cache_lines.append('# TYPE result_cache_entries gauge')
+    cache_lines.append(f"result_cache_entries {cache_stats['entries']}")
+    segment_stats = _segment_cache_stats()
+    for name in ('hits', 'misses', 'evictions'):
+        cache_lines.append(f'# TYPE segment_cache_{name}_total counter')
+        cache_lines.extend(f'segment_cache_{name}_total{{domain="{domain}"}} {stats[name]}'
+                           for domain, stats in segment_stats.items())
+    return Response(metrics_registry.render(cache_lines), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache')
+def get_cache_stats():
+    stats = result_cache.stats()
+    stats['segments'] = _segment_cache_stats()
+    return jsonify(stats)
+
+def _segment_cache_stats():
+    # Per domain, for rule sets that have a segment cache (SEGMENT_CACHE_ENTRIES)
+    rule_sets = {domain: loader.current() for domain, loader in rule_loaders.items()}
+    return {domain: rule_set.segment_cache.stats()
+            for domain, rule_set in rule_sets.items() if rule_set.segment_cache is not None}
+
 # New endpoint to get available domains
 @app.route('/api/domains')
 def get_domains():
-    with open('config/extraction_rules.json', 'r') as f:
-        config = json.load(f)
-    domains = []
-    for key in config.keys():
-        if key.endswith('_entities'):
-            domains.append(key.replace('_entities', ''))
-    return jsonify({'domains': domains})
+    return jsonify({'domains': get_rules('healthcare').domains})
 
 # Updated endpoint to get entity types for a domain
 @app.route('/api/entity-types')
 def get_entity_types():
     domain = request.args.get('domain', 'healthcare')
-    with open('config/extraction_rules.json', 'r') as f:
-        config = json.load(f)
-    key = f"{domain}_entities"
-    entity_types = list(config.get(key, {}).keys())
-    return jsonify({'entity_types': entity_types})
+    return jsonify({'entity_types': get_rules(domain).entity_types(domain)})
+
+@app.route('/api/rules')
+def get_rules_status():
+    domain = request.args.get('domain', 'healthcare')
+    loader = rule_loaders.get(domain, rule_loaders['healthcare'])
+    loader.current()
+    return jsonify(loader.status())
 
 @app.route('/api/sample-data')
 def get_sample_data():
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Equivalence checks for the extraction fast paths
+
+Chunked extraction, incremental re-extraction of edited documents and the segment
+cache promise exactly the results of extracting a document in one pass. This runs
+them against one-pass extraction over synthetic notes and the sample data (for
+incremental re-extraction, after every one of a series of random edits; for the
+segment cache, on templated notes that share most of their lines) and exits with
+status 1 on any difference. Event timelines are checked to come out in calendar
+order, with every event dated the same from its context as from the document.
+
+Usage: python3 benchmarks/check_equivalence.py [--notes 20] [--seed 0]
+       python3 benchmarks/check_equivalence.py --only incremental --edits 50
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+from typing import List, Dict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from benchmarks.corpus_generator import generate_corpus
+from healthcare_batch import extract_document
+from healthcare_incremental import IncrementalExtractor, apply_edits, changed_region
+from healthcare_rules import rule_set_loader
+from healthcare_segments import SegmentCache
+from healthcare_entity_extractor import HealthcareEntityExtractor
+from healthcare_event_extractor import HealthcareEventExtractor
+from healthcare_dates import event_date
+
+SAMPLE_DATA = os.path.join('data', 'sample_healthcare_data.txt')
+# Selections decide which type wins ties between equal spans, so each is checked
+SELECTIONS = [None, ['MEDICATION'], ['PATIENT', 'DISEASE']]
+# Small chunks put many chunk edges inside every note
+CHUNK_SIZES = [700, 2048]
+# Inserted by random edits besides words of the notes: they split, join or
+# extend tokens, dosages and sentences
+EDIT_SNIPPETS = ['\n', ' ', '.', 'mg', '10 mg', 'x']
+EDIT_LENGTHS = [0, 1, 5, 30, 300]
+
+
+def build_notes(count: int, seed: int) -> List[str]:
+    notes = generate_corpus(count, 6000, seed=seed)
+    with open(SAMPLE_DATA, 'r', encoding='utf-8') as f:
+        notes.append(f.read())
+    return notes
+
+
+def same(a, b) -> bool:
+    return json.dumps(a) == json.dumps(b)
+
+
+def check_chunked(notes: List[str], rng: random.Random, options: argparse.Namespace) -> int:
+    entity_extractor, event_extractor = rule_set_loader().current().extractors
+    mismatches = 0
+    for number, text in enumerate(notes):
+        for selected_types in SELECTIONS:
+            full = extract_document(entity_extractor, event_extractor, text, selected_types)
+            for chunk_size in CHUNK_SIZES:
+                chunked = extract_document(entity_extractor, event_extractor, text, selected_types,
+                                           chunk_size=chunk_size)
+                if not same(chunked, full):
+                    mismatches += 1
+                    print(f'  chunked: note {number}, types {selected_types}, chunk size {chunk_size}')
+    return mismatches
+
+
+def random_edit(rng: random.Random, text: str, words: List[str]) -> Dict:
+    start = rng.randint(0, len(text))
+    end = min(len(text), start + rng.choice(EDIT_LENGTHS))
+    if rng.random() < 0.8:
+        inserted = ' '.join(rng.choice(words) for _ in range(rng.choice([0, 1, 3, 10])))
+    else:
+        inserted = rng.choice(EDIT_SNIPPETS)
+    return {'start': start, 'end': end, 'text': inserted}
+
+
+def check_incremental(notes: List[str], rng: random.Random, options: argparse.Namespace) -> int:
+    entity_extractor, event_extractor = rule_set_loader().current().extractors
+    words = ' '.join(notes).split()
+    mismatches = 0
+    for chunk_size in CHUNK_SIZES:
+        incremental = IncrementalExtractor(entity_extractor, event_extractor, chunk_size)
+        for number, text in enumerate(notes):
+            state = incremental.extract(text, None, 0.5, 'check')
+            for step in range(options.edits):
+                edit = random_edit(rng, state.text, words)
+                # Both ways the API takes an edit: as ranges, or as the whole new text
+                if rng.random() < 0.5:
+                    new_text, start, old_end, new_end = apply_edits(state.text, [edit])
+                else:
+                    new_text = state.text[:edit['start']] + edit['text'] + state.text[edit['end']:]
+                    start, old_end, new_end = changed_region(state.text, new_text)
+                if not new_text.strip():
+                    continue
+                state = incremental.update(state, new_text, start, old_end, new_end)
+                full = extract_document(entity_extractor, event_extractor, new_text, chunk_size=chunk_size)
+                if not same(incremental.result(state), full):
+                    mismatches += 1
+                    print(f'  incremental: note {number}, edit {step}, chunk size {chunk_size}')
+                    state = incremental.extract(new_text, None, 0.5, 'check')
+    return mismatches
+
+
+def templated_notes(notes: List[str], rng: random.Random, count: int) -> List[str]:
+    # Notes built from a shared pool of sentences, one per line, each with one line
+    # of its own, as notes generated from templates are
+    sentences = [sentence.strip() + '.' for text in notes for sentence in text.split('. ') if sentence.strip()]
+    pool = rng.sample(sentences, min(len(sentences), 60))
+    templated = []
+    for number in range(count):
+        lines = rng.sample(pool, min(len(pool), 12))
+        lines.insert(rng.randrange(len(lines) + 1),
+                     f'Patient {number} was given {rng.randint(1, 900)} mg of aspirin on '
+                     f'{rng.randint(1, 12)}/{rng.randint(1, 28)}/2024.')
+        templated.append('\n'.join(lines))
+    return templated
+
+
+def check_segments(notes: List[str], rng: random.Random, options: argparse.Namespace) -> int:
+    entity_extractor, event_extractor = rule_set_loader().current().extractors
+    cache = SegmentCache()
+    cached_entities = HealthcareEntityExtractor(segment_cache=cache)
+    cached_events = HealthcareEventExtractor(segment_cache=cache)
+    documents = notes + templated_notes(notes, rng, 2 * len(notes))
+    mismatches = 0
+    # The second pass is answered mostly from the cache
+    for _ in range(2):
+        for number, text in enumerate(documents):
+            for selected_types in SELECTIONS:
+                for chunk_size in [None] + CHUNK_SIZES[:1]:
+                    full = extract_document(entity_extractor, event_extractor, text, selected_types,
+                                            chunk_size=chunk_size)
+                    cached = extract_document(cached_entities, cached_events, text, selected_types,
+                                              chunk_size=chunk_size)
+                    if not same(cached, full):
+                        mismatches += 1
+                        print(f'  segments: document {number}, types {selected_types}, chunk size {chunk_size}')
+            # Events detected without given entities extract them through the cache too
+            if not same(cached_events.extract_events(text), event_extractor.extract_events(text)):
+                mismatches += 1
+                print(f'  segments: document {number}, events without entities')
+    stats = cache.stats()
+    print(f"  segments: {stats['hits']:,} cache hits, hit rate {stats['hit_rate']}")
+    return mismatches
+
+
+def check_timeline(notes: List[str], rng: random.Random, options: argparse.Namespace) -> int:
+    entity_extractor, event_extractor = rule_set_loader().current().extractors
+    mismatches = 0
+    for number, text in enumerate(notes):
+        entities = entity_extractor.filter_entities_by_confidence(entity_extractor.extract_entities(text))
+        events = event_extractor.extract_events(text, entities)
+        for event in events:
+            if event_date(event) != event_date(event, text=text):
+                mismatches += 1
+                print(f"  timeline: note {number}, event at {event['start']} dated differently from its context")
+        for source in (None, text):
+            dates = [event_date(entry['event'], text=source) for entry in event_extractor.get_event_timeline(events, source)]
+            known = [dated[0] for dated in dates if dated]
+            if known != sorted(known) or dates[len(known):] != [None] * (len(dates) - len(known)):
+                mismatches += 1
+                print(f'  timeline: note {number} out of calendar order')
+    return mismatches
+
+
+CHECKS = {
+    'chunked': check_chunked,
+    'incremental': check_incremental,
+    'segments': check_segments,
+    'timeline': check_timeline
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the extraction fast paths against one-pass extraction')
+    parser.add_argument('--notes', type=int, default=20, help='synthetic notes per check')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='+', choices=sorted(CHECKS), help='run only these checks')
+    parser.add_argument('--edits', type=int, default=8, help='random edits per note for the incremental check')
+    args = parser.parse_args()
+
+    notes = build_notes(args.notes, args.seed)
+    failed = 0
+    for name, check in CHECKS.items():
+        if args.only and name not in args.only:
+            continue
+        mismatches = check(notes, random.Random(args.seed), args)
+        print(f"{'✓' if not mismatches else '✗'} {name}: {mismatches} mismatch(es)")
+        failed += mismatches > 0
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Synthetic clinical note generator for benchmarks
+
+Builds notes of a requested size and entity density from the vocabulary in
+config/extraction_rules.json, so scaling runs follow the rules as they change.
+
+Usage: python3 benchmarks/corpus_generator.py --notes 100 --size 5000 --output notes.ndjson
+"""
+
+import re
+import sys
+import json
+import random
+import argparse
+from typing import List, Dict
+
+FILLER_WORDS = [
+    'the', 'was', 'and', 'with', 'on', 'for', 'of', 'to', 'after', 'noted', 'stable',
+    'history', 'follow-up', 'visit', 'reviewed', 'plan', 'continue', 'monitor', 'today'
+]
+DATES = ['March 15, 2024', '12/03/2021', '5 April 2023', 'yesterday', 'last week', 'next month']
+TIMES = ['10:30 am', '4:15 PM', 'morning', 'evening']
+LOCATIONS = ['General Hospital', 'Mercy Medical Center', 'cardiology clinic', 'emergency room', 'ICU']
+DOSAGES = ['81mg', '500 mg', '25mg', '10 ml', '2 tablets', '1 capsule', 'twice daily', 'once daily']
+
+
+def load_vocabulary(config_path: str = 'config/extraction_rules.json') -> Dict[str, List[str]]:
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+
+    # Only dictionary terms can be dropped into text verbatim; regex patterns are
+    # represented by the dosage samples above
+    terms = [
+        pattern.replace('\\', '')
+        for entity_config in config['healthcare_entities'].values()
+        for pattern in entity_config['patterns']
+        if not re.search(r'\\d|\\w|\+|\*|\[|\]|\(|\)|\{|\}|\^|\$|\?', pattern)
+    ]
+    context_words = [
+        word for entity_config in config['healthcare_entities'].values()
+        for word in entity_config.get('context_words', [])
+    ]
+    triggers = [
+        trigger for event_config in config['healthcare_events'].values()
+        for trigger in event_config['triggers']
+    ]
+    return {'terms': terms, 'context_words': context_words, 'triggers': triggers}
+
+
+def generate_note(rng: random.Random, vocabulary: Dict[str, List[str]], size: int,
+                  density: float = 0.2) -> str:
+    # density is the share of words drawn from the extraction vocabulary
+    sentences = []
+    length = 0
+    while length < size:
+        words = []
+        for _ in range(rng.randint(8, 20)):
+            roll = rng.random()
+            if roll < density:
+                words.append(rng.choice(vocabulary['terms'] + DOSAGES))
+            elif roll < density * 1.5:
+                words.append(rng.choice(vocabulary['context_words'] + vocabulary['triggers']))
+            elif roll < density * 1.5 + 0.05:
+                words.append(rng.choice(DATES + TIMES + LOCATIONS))
+            else:
+                words.append(rng.choice(FILLER_WORDS))
+        sentence = ' '.join(words)
+        sentences.append(sentence[0].upper() + sentence[1:] + '.')
+        length += len(sentences[-1]) + 1
+    return ' '.join(sentences)[:size]
+
+
+def generate_corpus(notes: int, size: int, density: float = 0.2, seed: int = 42,
+                    config_path: str = 'config/extraction_rules.json') -> List[str]:
+    rng = random.Random(seed)
+    vocabulary = load_vocabulary(config_path)
+    return [generate_note(rng, vocabulary, size, density) for _ in range(notes)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic clinical notes')
+    parser.add_argument('--notes', type=int, default=10, help='number of notes')
+    parser.add_argument('--size', type=int, default=5000, help='characters per note')
+    parser.add_argument('--density', type=float, default=0.2, help='share of vocabulary words')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--config', default='config/extraction_rules.json')
+    parser.add_argument('--output', help='NDJSON file to write (default: stdout)')
+    args = parser.parse_args()
+
+    notes = generate_corpus(args.notes, args.size, args.density, args.seed, args.config)
+    output = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for i, text in enumerate(notes):
+            output.write(json.dumps({'id': f'note-{i}', 'text': text}) + '\n')
+    finally:
+        if args.output:
+            output.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
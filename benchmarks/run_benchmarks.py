@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the healthcare extraction pipeline
+
+Times the tokenizer, both extractors and the Flask endpoints over synthetic notes
+of increasing size, reports throughput, p50/p99 latency and peak memory, and
+compares the results against a stored baseline. Entity extraction can be timed with
+several entity backends side by side, one note at a time and in batches.
+
+Usage: python3 benchmarks/run_benchmarks.py [--sizes 1000 10000] [--update-baseline]
+       python3 benchmarks/run_benchmarks.py --backends rules spacy --only entity_extractor
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+from typing import List, Dict, Callable
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+from benchmarks.corpus_generator import generate_corpus
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_BASELINE = os.path.join(ROOT, 'benchmarks', 'baseline.json')
+DEFAULT_OUTPUT = os.path.join(ROOT, 'benchmarks', 'results.json')
+# Benchmarks that take the list of notes instead of a single note
+BATCH_BENCHMARKS = set()
+# p99 is only compared once a benchmark has this many samples; with fewer it is
+# little more than the slowest run
+MIN_P99_RUNS = 50
+
+
+def calibrate(rounds: int = 5) -> float:
+    # Milliseconds a fixed pure-Python workload takes on this machine (best of rounds),
+    # so a baseline recorded elsewhere can be scaled to this machine's speed
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        total = 0
+        for i in range(300000):
+            total += len(str(i * 7))
+        timings.append(time.perf_counter() - started)
+    return round(min(timings) * 1000, 3)
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(name: str, size: int, func: Callable[[str], object], notes: List[str], repeats: int) -> Dict:
+    batch = name in BATCH_BENCHMARKS
+    func(notes[:1] if batch else notes[0])  # warm-up
+
+    timings = []
+    for _ in range(repeats):
+        if batch:
+            # One call over all notes; each note is counted at its share of the call
+            started = time.perf_counter()
+            func(notes)
+            elapsed = time.perf_counter() - started
+            timings.extend([elapsed / len(notes)] * len(notes))
+            continue
+        for text in notes:
+            started = time.perf_counter()
+            func(text)
+            timings.append(time.perf_counter() - started)
+
+    # Memory is measured on a separate run because tracing slows everything down
+    tracemalloc.start()
+    func(notes[:1] if batch else notes[0])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    total = sum(timings)
+    return {
+        'benchmark': name,
+        'size': size,
+        'runs': len(timings),
+        'chars_per_second': round(size * len(timings) / total) if total else 0,
+        'docs_per_second': round(len(timings) / total, 2) if total else 0,
+        'p50_ms': round(percentile(timings, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 3),
+        'peak_memory_kb': round(peak / 1024, 1)
+    }
+
+
+def build_benchmarks(backends: List[str]) -> Dict[str, Callable[[str], object]]:
+    from healthcare_tokenizer import HealthcareTokenizer
+    from healthcare_entity_extractor import HealthcareEntityExtractor
+    from healthcare_event_extractor import HealthcareEventExtractor
+    import app as flask_app
+    from healthcare_cache import ResultCache
+
+    tokenizer = HealthcareTokenizer()
+    entity_extractor = HealthcareEntityExtractor()
+    event_extractor = HealthcareEventExtractor()
+    entity_types = list(entity_extractor.entity_types.keys())
+    # Every request must do the full work, so the result cache never keeps anything
+    flask_app.result_cache = ResultCache(max_entries=0)
+    client = flask_app.app.test_client()
+
+    entities_for = {}
+
+    def extract_events(text):
+        if text not in entities_for:
+            entities_for.clear()
+            entities_for[text] = entity_extractor.extract_entities(text)
+        return event_extractor.extract_events(text, entities_for[text])
+
+    def post_extract(text):
+        response = client.post('/api/extract', json={'text': text, 'entity_types': entity_types})
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return response.get_data()
+
+    def post_upload(text):
+        response = client.post('/api/upload', data={
+            'file': (io.BytesIO(text.encode('utf-8')), 'note.txt'),
+            'entity_types': entity_types
+        }, content_type='multipart/form-data')
+        assert response.status_code == 200, response.get_data(as_text=True)
+        return response.get_data()
+
+    benchmarks = {
+        'tokenizer.custom_tokenize': tokenizer.custom_tokenize,
+        'entity_extractor.extract_entities': entity_extractor.extract_entities,
+        'event_extractor.extract_events': extract_events,
+        'api.extract': post_extract,
+        'api.upload': post_upload
+    }
+    # The default backend keeps the plain names, so existing baselines still apply
+    for backend in backends:
+        extractor = entity_extractor if backend == 'rules' else HealthcareEntityExtractor(backend=backend)
+        suffix = '' if backend == 'rules' else f'[{backend}]'
+        if suffix:
+            benchmarks[f'entity_extractor.extract_entities{suffix}'] = extractor.extract_entities
+        batch_name = f'entity_extractor.extract_batch{suffix}'
+        benchmarks[batch_name] = extractor.extract_batch
+        BATCH_BENCHMARKS.add(batch_name)
+    return benchmarks
+
+
+def compare(results: List[Dict], baseline: List[Dict], tolerance: float, scale: float = 1.0) -> List[str]:
+    # Baseline latencies are multiplied by scale, this machine's calibration time over
+    # the baseline's
+    previous = {(entry['benchmark'], entry['size']): entry for entry in baseline}
+    regressions = []
+    for entry in results:
+        before = previous.get((entry['benchmark'], entry['size']))
+        if before is None:
+            continue
+        metrics = ['p50_ms']
+        if min(entry['runs'], before['runs']) >= MIN_P99_RUNS:
+            metrics.append('p99_ms')
+        for metric in metrics:
+            expected = before[metric] * scale
+            if expected and entry[metric] > expected * tolerance:
+                regressions.append(
+                    f"{entry['benchmark']} @ {entry['size']} chars: {metric} "
+                    f"{entry[metric]} ms vs baseline {round(expected, 3)} ms"
+                )
+    return regressions
+
+
+def print_table(results: List[Dict]):
+    header = f"{'benchmark':<44}{'size':>9}{'chars/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'peak KB':>10}"
+    print(header)
+    print('-' * len(header))
+    for entry in results:
+        print(f"{entry['benchmark']:<44}{entry['size']:>9}{entry['chars_per_second']:>12}"
+              f"{entry['p50_ms']:>10}{entry['p99_ms']:>10}{entry['peak_memory_kb']:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the extraction pipeline')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='note sizes in characters')
+    parser.add_argument('--notes', type=int, default=5, help='distinct notes per size')
+    parser.add_argument('--repeats', type=int, default=3, help='passes over the notes per size')
+    parser.add_argument('--density', type=float, default=0.2, help='share of vocabulary words')
+    parser.add_argument('--only', nargs='+', help='run only benchmarks whose names start with these')
+    parser.add_argument('--backends', nargs='+', default=['rules'],
+                        help='entity backends to time entity extraction with (e.g. rules spacy)')
+    parser.add_argument('--output', default=DEFAULT_OUTPUT)
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='fail when a latency exceeds baseline x tolerance')
+    parser.add_argument('--update-baseline', action='store_true', help='store these results as the baseline')
+    args = parser.parse_args()
+
+    benchmarks = build_benchmarks(args.backends)
+    if args.only:
+        benchmarks = {name: func for name, func in benchmarks.items()
+                      if any(name.startswith(prefix) for prefix in args.only)}
+
+    calibration_ms = calibrate()
+    results = []
+    for size in args.sizes:
+        notes = generate_corpus(args.notes, size, args.density, seed=size)
+        for name, func in benchmarks.items():
+            results.append(measure(name, size, func, notes, args.repeats))
+
+    print_table(results)
+    with open(args.output, 'w') as f:
+        json.dump({'results': results, 'calibration_ms': calibration_ms,
+                   'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S')}, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({'results': results, 'calibration_ms': calibration_ms}, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline found; run with --update-baseline to create one')
+        return 0
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    # Baselines recorded without a calibration run are compared as they are
+    scale = calibration_ms / baseline['calibration_ms'] if baseline.get('calibration_ms') else 1.0
+    print(f"Calibration: {calibration_ms} ms here vs {baseline.get('calibration_ms', '-')} ms for the baseline")
+    regressions = compare(results, baseline['results'], args.tolerance, scale)
+    if regressions:
+        print(f"\n✗ {len(regressions)} regression(s) beyond {args.tolerance}x baseline:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        return 1
+    print(f"\n✓ No regressions beyond {args.tolerance}x baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
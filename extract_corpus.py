@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Offline bulk extraction for the healthcare extraction pipeline
+
+Runs the entity and event extractors over a corpus on several worker processes and
+writes one JSON line per note to sharded NDJSON files. Progress is checkpointed after
+every wave of notes, so rerunning the same command after an interruption resumes
+where the last run stopped.
+
+Large NDJSON files, and text files split with --delimiter, are read through a memory
+map and a saved record index: workers get byte ranges and decode only their own notes.
+
+Usage: python3 extract_corpus.py notes/ --output results/ --workers 8
+       python3 extract_corpus.py "notes/**/*.txt" --output results/
+       python3 extract_corpus.py notes.ndjson --output results/ --entity-types MEDICATION DISEASE
+       python3 extract_corpus.py notes.csv --text-field note_text --id-field note_id --output results/
+       python3 extract_corpus.py dump.txt --delimiter '\n\n' --offsets file --output results/
+       python3 extract_corpus.py notes.ndjson --segment-cache 200000 --output results/
+"""
+
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import codecs
+import argparse
+from itertools import islice
+from typing import List, Dict, Iterator, Optional
+
+from healthcare_batch import run_batch, default_workers, terminate_pools
+from healthcare_backends import ENTITY_BACKENDS
+from healthcare_chunking import CHUNK_SIZE, iter_waves
+from healthcare_corpus import corpus_reader
+from healthcare_rules import DEFAULT_CONFIG_PATH, rule_set_loader
+
+CHECKPOINT_FILE = '_checkpoint.json'
+MANIFEST_FILE = '_manifest.json'
+
+
+def shard_name(shard: int) -> str:
+    return f'part-{shard:05d}.ndjson'
+
+
+def list_input_files(source: str) -> List[str]:
+    if os.path.isdir(source):
+        paths = glob.glob(os.path.join(source, '**', '*.txt'), recursive=True)
+    else:
+        paths = glob.glob(source, recursive=True)
+    # Sorted, so every run sees the notes in the same order and a resume can skip by count
+    return sorted(path for path in paths if os.path.isfile(path))
+
+
+def is_csv_file(source: str) -> bool:
+    return os.path.isfile(source) and source.endswith('.csv')
+
+
+def iter_records(source: str, skip: int = 0, text_field: str = 'text',
+                 id_field: str = 'id') -> Iterator[Dict]:
+    # A record payload for every note after the first skip notes. Notes in separate
+    # files are only named here and read by the worker, so one unreadable file is
+    # reported as an error line instead of ending the run. Single NDJSON files never
+    # come here: they are always read through the corpus index.
+    if not is_csv_file(source):
+        for path in islice(list_input_files(source), skip, None):
+            yield {'id': path, 'file': path}
+        return
+
+    with open(source, 'r', encoding='utf-8', newline='') as f:
+        rows = csv.DictReader(f)
+        if text_field not in (rows.fieldnames or []):
+            raise ValueError(f'Column not found: {text_field}')
+        for number, row in islice(enumerate(rows, 1), skip, None):
+            yield {'id': row.get(id_field) or str(number), 'text': row[text_field] or ''}
+
+
+def is_indexed(source: str, delimiter: Optional[bytes]) -> bool:
+    # Single NDJSON files, and text files with a record delimiter, are read by byte range
+    return os.path.isfile(source) and (source.endswith(('.ndjson', '.jsonl')) or
+                                       (delimiter is not None and not source.endswith('.csv')))
+
+
+def count_records(source: str) -> int:
+    if not is_csv_file(source):
+        return len(list_input_files(source))
+    with open(source, 'r', encoding='utf-8', newline='') as f:
+        return sum(1 for _ in csv.DictReader(f))
+
+
+class Checkpoint:
+    # Records how many notes are safely on disk and how far the open shard reaches.
+    # Written atomically after every wave; anything past it is redone on resume.
+    def __init__(self, output_dir: str, job: Dict):
+        self.path = os.path.join(output_dir, CHECKPOINT_FILE)
+        self.job = job
+        self.records = 0
+        self.errors = 0
+        # Input read so far, in bytes of the source files whatever the input type
+        self.input_bytes = 0
+        self.shard = 0
+        self.shard_records = 0
+        self.shard_bytes = 0
+        self.elapsed = 0.0
+
+    def load(self) -> bool:
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, 'r') as f:
+            state = json.load(f)
+        if state['job'] != self.job:
+            raise ValueError(f'{self.path} belongs to a run with different input or options; '
+                             f'use another --output directory or pass --restart')
+        for key in ('records', 'errors', 'input_bytes', 'shard', 'shard_records', 'shard_bytes', 'elapsed'):
+            # Checkpoints written before a counter existed start it from zero
+            setattr(self, key, state.get(key, getattr(self, key)))
+        return True
+
+    def save(self):
+        state = {
+            'job': self.job,
+            'records': self.records,
+            'errors': self.errors,
+            'input_bytes': self.input_bytes,
+            'shard': self.shard,
+            'shard_records': self.shard_records,
+            'shard_bytes': self.shard_bytes,
+            'elapsed': self.elapsed
+        }
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+
+class ShardWriter:
+    def __init__(self, output_dir: str, checkpoint: Checkpoint, shard_size: int):
+        self.output_dir = output_dir
+        self.checkpoint = checkpoint
+        self.shard_size = shard_size
+        self.file = None
+        self._open(truncate_to=checkpoint.shard_bytes)
+
+    def _open(self, truncate_to: int = 0):
+        path = os.path.join(self.output_dir, shard_name(self.checkpoint.shard))
+        # Lines written after the last checkpoint are dropped and written again
+        self.file = open(path, 'ab')
+        self.file.truncate(truncate_to)
+        self.file.seek(truncate_to)
+
+    def write(self, line: str):
+        if self.checkpoint.shard_records >= self.shard_size:
+            self.file.close()
+            self.checkpoint.shard += 1
+            self.checkpoint.shard_records = 0
+            self.checkpoint.shard_bytes = 0
+            self._open()
+        data = (line + '\n').encode('utf-8')
+        self.file.write(data)
+        self.checkpoint.shard_records += 1
+        self.checkpoint.shard_bytes += len(data)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def format_rate(count: float, seconds: float) -> str:
+    return f'{count / seconds:,.1f}' if seconds else '-'
+
+
+def report_progress(checkpoint: Checkpoint, total: int, elapsed: float, started_records: int, started_bytes: int,
+                    run_seconds: float):
+    done = checkpoint.records
+    docs_rate = format_rate(done - started_records, run_seconds)
+    mb_rate = format_rate((checkpoint.input_bytes - started_bytes) / 1e6, run_seconds)
+    line = f'{done:,}/{total:,} notes' if total else f'{done:,} notes'
+    if total and done < total and run_seconds and done > started_records:
+        remaining = (total - done) / ((done - started_records) / run_seconds)
+        line += f'  |  ETA {time.strftime("%H:%M:%S", time.gmtime(remaining))}'
+    print(f'{line}  |  {docs_rate} notes/s  |  {mb_rate} MB/s  |  {checkpoint.errors:,} errors  |  '
+          f'{time.strftime("%H:%M:%S", time.gmtime(elapsed))} elapsed', file=sys.stderr, flush=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Extract entities and events from a corpus of notes')
+    parser.add_argument('input', help='directory of .txt notes, glob pattern, or .ndjson/.jsonl/.csv file')
+    parser.add_argument('--output', required=True, help='directory for NDJSON shards and the checkpoint')
+    parser.add_argument('--workers', type=int, default=default_workers(), help='worker processes')
+    parser.add_argument('--shard-size', type=int, default=10000, help='notes per output shard')
+    parser.add_argument('--wave-size', type=int, default=0,
+                        help='notes per checkpoint (default: 16 per worker)')
+    parser.add_argument('--entity-types', nargs='+', help='entity types to extract (default: all)')
+    parser.add_argument('--min-confidence', type=float, default=0.5)
+    parser.add_argument('--config', default=DEFAULT_CONFIG_PATH, help='extraction rules file')
+    parser.add_argument('--text-field', default='text', help='text field of NDJSON records or CSV column')
+    parser.add_argument('--id-field', default='id', help='id field of NDJSON records or CSV column')
+    parser.add_argument('--include-text', action='store_true', help='copy each note into its result line')
+    parser.add_argument('--delimiter', help='split a single text file into notes at this string (e.g. "\\n\\n")')
+    parser.add_argument('--offsets', choices=['record', 'file'], default='record',
+                        help='report entity and event offsets within the note or as byte offsets in the file '
+                             '(text files with --delimiter only)')
+    parser.add_argument('--progress-interval', type=float, default=5.0, help='seconds between progress lines')
+    parser.add_argument('--restart', action='store_true', help='ignore an existing checkpoint and start over')
+    parser.add_argument('--segment-cache', type=int, default=0, metavar='ENTRIES',
+                        help='reuse results of sentences/lines repeated across notes, e.g. from templates, '
+                             'caching up to ENTRIES segments per worker (default: off)')
+    parser.add_argument('--backend', choices=sorted(ENTITY_BACKENDS),
+                        help='entity backend (default: ENTITY_BACKEND or rules); spacy is configured '
+                             'with the SPACY_* variables')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    workers = max(1, args.workers)
+    os.makedirs(args.output, exist_ok=True)
+    if args.segment_cache > 0:
+        # Seen by the rules loaded below and by every worker process
+        os.environ['SEGMENT_CACHE_ENTRIES'] = str(args.segment_cache)
+    if args.backend:
+        os.environ['ENTITY_BACKEND'] = args.backend
+    # Sizes the worker pool
+    os.environ['EXTRACTION_WORKERS'] = str(workers)
+
+    rule_set = rule_set_loader(args.config).current()
+    selected_types = args.entity_types or list(rule_set.entity_extractor.entity_types.keys())
+    job = {
+        'input': os.path.abspath(args.input),
+        'entity_types': selected_types,
+        'min_confidence': args.min_confidence,
+        'rules_version': rule_set.version,
+        'text_field': args.text_field,
+        'id_field': args.id_field,
+        'include_text': args.include_text,
+        'shard_size': args.shard_size,
+        'delimiter': args.delimiter,
+        'offsets': args.offsets
+    }
+
+    checkpoint = Checkpoint(args.output, job)
+    if args.restart:
+        for name in os.listdir(args.output):
+            if name.startswith('part-') or name in (CHECKPOINT_FILE, MANIFEST_FILE):
+                os.remove(os.path.join(args.output, name))
+    else:
+        try:
+            resumed = checkpoint.load()
+        except ValueError as e:
+            print(f'Error: {e}', file=sys.stderr)
+            return 1
+        if resumed:
+            print(f'Resuming after {checkpoint.records:,} notes (shard {shard_name(checkpoint.shard)})',
+                  file=sys.stderr)
+
+    delimiter = codecs.decode(args.delimiter, 'unicode_escape').encode('utf-8') if args.delimiter else None
+    if is_indexed(args.input, delimiter):
+        reader = corpus_reader(args.input, delimiter or b'\n', args.text_field, args.id_field)
+    elif args.offsets == 'file':
+        print('Error: --offsets file needs a single text file split with --delimiter', file=sys.stderr)
+        return 1
+    else:
+        reader = None
+    if args.offsets == 'file' and reader.is_ndjson:
+        print('Error: --offsets file is not available for NDJSON input', file=sys.stderr)
+        return 1
+
+    total = len(reader) if reader is not None else count_records(args.input)
+    if checkpoint.records >= total and os.path.exists(os.path.join(args.output, MANIFEST_FILE)):
+        print(f'Nothing to do: all {total:,} notes already extracted', file=sys.stderr)
+        return 0
+
+    writer = ShardWriter(args.output, checkpoint, args.shard_size)
+    if reader is not None:
+        # Only byte ranges go to the workers; the fallback id is the record number
+        records = ({
+            'id': str(number + 1),
+            'path': reader.path,
+            'delimiter': reader.delimiter,
+            'text_field': args.text_field,
+            'id_field': args.id_field,
+            'offset': offset,
+            'length': length,
+            'file_offsets': args.offsets == 'file'
+        } for number, offset, length in reader.ranges(checkpoint.records))
+    else:
+        records = iter_records(args.input, checkpoint.records, args.text_field, args.id_field)
+    wave_size = args.wave_size or workers * 16
+    started = time.perf_counter()
+    started_records, started_bytes, previous_elapsed = checkpoint.records, checkpoint.input_bytes, checkpoint.elapsed
+    last_report = now = started
+
+    try:
+        for wave in iter_waves(records, wave_size):
+            payloads = [dict(
+                record,
+                selected_types=selected_types,
+                min_confidence=args.min_confidence,
+                chunk_size=CHUNK_SIZE,
+                include_text=args.include_text
+            ) for record in wave]
+            for payload, result in zip(payloads, run_batch('record', payloads, args.config, workers)):
+                if 'error' in result:
+                    checkpoint.errors += 1
+                    writer.write(json.dumps({'id': payload['id'], 'error': result['error']}))
+                else:
+                    writer.write(result['record'])
+                checkpoint.records += 1
+                checkpoint.input_bytes += result.get('input_bytes', 0)
+
+            writer.sync()
+            now = time.perf_counter()
+            checkpoint.elapsed = previous_elapsed + now - started
+            checkpoint.save()
+            if now - last_report >= args.progress_interval:
+                report_progress(checkpoint, total, checkpoint.elapsed, started_records, started_bytes, now - started)
+                last_report = now
+    except KeyboardInterrupt:
+        terminate_pools()
+        print(f'\nInterrupted after {checkpoint.records:,} notes; run the same command again to resume',
+              file=sys.stderr)
+        return 130
+    finally:
+        writer.close()
+
+    if last_report < now:
+        report_progress(checkpoint, total, checkpoint.elapsed, started_records, started_bytes, now - started)
+    manifest = {
+        'job': job,
+        'records': checkpoint.records,
+        'errors': checkpoint.errors,
+        'input_bytes': checkpoint.input_bytes,
+        'shards': [shard_name(shard) for shard in range(checkpoint.shard + 1)],
+        'elapsed_seconds': round(checkpoint.elapsed, 3),
+        'completed_at': time.strftime('%Y-%m-%dT%H:%M:%S')
+    }
+    with open(os.path.join(args.output, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f'✓ {checkpoint.records:,} notes written to {len(manifest["shards"])} shard(s) in {args.output} '
+          f'({checkpoint.errors:,} errors)', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+import os
+from abc import ABC, abstractmethod
+from typing import List, Dict, Tuple, Optional
+
+# spaCy backend settings. SPACY_MODEL is a locally installed pipeline (package name or
+# path); without one a blank English pipeline with an EntityRuler built from the rule
+# file is used. SPACY_LABELS maps model labels to entity types, e.g.
+# "CHEMICAL:MEDICATION,DISEASE:DISEASE"; labels named like an entity type map to it.
+SPACY_MODEL = os.environ.get('SPACY_MODEL') or None
+SPACY_BATCH_SIZE = int(os.environ.get('SPACY_BATCH_SIZE', 64))
+SPACY_N_PROCESS = int(os.environ.get('SPACY_N_PROCESS', 1))
+SPACY_LABELS = dict(
+    pair.split(':', 1) for pair in os.environ.get('SPACY_LABELS', '').split(',') if ':' in pair
+)
+# Pipeline components entity recognition can need; every other component is disabled
+SPACY_COMPONENTS = ('tok2vec', 'transformer', 'ner', 'entity_ruler')
+
+
+class EntityBackend(ABC):
+    # Finds the entity candidates of a text, before overlap removal and confidence
+    # filtering, as dicts with the extractor's keys (text, start, end, type,
+    # confidence, pattern_matched). Backends that set batched process a list of texts
+    # faster together than one at a time.
+    name = 'base'
+    batched = False
+
+    @abstractmethod
+    def collect(self, text: str, selected_types: List[str] = None) -> List[Dict]:
+        pass
+
+    def collect_batch(self, texts: List[str], selected_types: List[str] = None) -> List[List[Dict]]:
+        return [self.collect(text, selected_types) for text in texts]
+
+
+class RuleBackend(EntityBackend):
+    # The regex and dictionary rules of the rule file
+    name = 'rules'
+
+    def __init__(self, extractor):
+        self.extractor = extractor
+
+    def collect(self, text: str, selected_types: List[str] = None) -> List[Dict]:
+        return self.extractor._collect_candidates(text, selected_types)
+
+
+def ruler_patterns(matcher) -> List[Dict]:
+    # EntityRuler patterns for the rule file's dictionary terms and single-token regexes;
+    # the pattern id keeps the rule that matched, as pattern_matched does
+    patterns = []
+    for entries in matcher.literal_terms.values():
+        for entity_type, _, pattern in entries:
+            patterns.append({'label': entity_type, 'pattern': pattern, 'id': pattern})
+    for entity_type, _, pattern, _ in matcher.token_patterns:
+        patterns.append({'label': entity_type, 'pattern': [{'TEXT': {'REGEX': f'(?i)^(?:{pattern})$'}}],
+                         'id': pattern})
+    return patterns
+
+
+class SpacyBackend(EntityBackend):
+    # Entities from a spaCy pipeline, run over batches with nlp.pipe. Rule-file regexes
+    # that span several tokens, and dosages, are still found by the rule code, and every
+    # candidate is scored by the rule file's context words, so confidence filtering
+    # means the same with either backend.
+    batched = True
+
+    def __init__(self, extractor, model: Optional[str] = SPACY_MODEL, batch_size: int = SPACY_BATCH_SIZE,
+                 n_process: int = SPACY_N_PROCESS, labels: Dict[str, str] = None):
+        import spacy
+
+        self.extractor = extractor
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.labels = SPACY_LABELS if labels is None else labels
+        if model:
+            nlp = spacy.load(model)
+            nlp.select_pipes(enable=[name for name in nlp.pipe_names if name in SPACY_COMPONENTS])
+        else:
+            nlp = spacy.blank('en')
+            ruler = nlp.add_pipe('entity_ruler', config={'phrase_matcher_attr': 'LOWER'})
+            ruler.add_patterns(ruler_patterns(extractor.matcher))
+        self.nlp = nlp
+        self.name = f"spacy:{model or 'blank'}"
+
+    def collect(self, text: str, selected_types: List[str] = None) -> List[Dict]:
+        return self.collect_batch([text], selected_types)[0]
+
+    def collect_batch(self, texts: List[str], selected_types: List[str] = None) -> List[List[Dict]]:
+        if selected_types is None:
+            selected_types = list(self.extractor.entity_types.keys())
+        type_ranks = {}
+        for entity_type in selected_types:
+            type_ranks.setdefault(entity_type, len(type_ranks))
+        # Extra processes only pay off over several texts
+        n_process = self.n_process if len(texts) > 1 else 1
+        docs = self.nlp.pipe(texts, batch_size=self.batch_size, n_process=n_process)
+
+        results = []
+        for text, doc in zip(texts, docs):
+            hits: List[Tuple[str, str, int, int]] = []
+            for ent in doc.ents:
+                entity_type = self.labels.get(ent.label_, ent.label_)
+                if entity_type in type_ranks:
+                    hits.append((entity_type, ent.ent_id_ or f'spacy:{ent.label_}', ent.start_char, ent.end_char))
+            # Rule-file regexes need no tokens: matching without any only runs those
+            hits.extend(self.extractor.matcher.match(text, [], selected_types))
+            # Grouped by type in selection order, as the rule matcher orders its hits
+            hits.sort(key=lambda hit: type_ranks[hit[0]])
+            results.append(self.extractor._candidates_from_hits(text, hits, selected_types))
+        return results
+
+
+ENTITY_BACKENDS = {'rules': RuleBackend, 'spacy': SpacyBackend}
+
+
+def create_backend(name: str, extractor) -> EntityBackend:
+    if name not in ENTITY_BACKENDS:
+        raise ValueError(f"Unknown entity backend: {name}; available: {', '.join(ENTITY_BACKENDS)}")
+    return ENTITY_BACKENDS[name](extractor)
@@ -0,0 +1,215 @@
+import os
+import json
+import atexit
+import signal
+import threading
+from multiprocessing.pool import Pool
+from typing import List, Dict, Tuple, Optional, Collection
+from healthcare_metrics import stage
+from healthcare_corpus import corpus_reader, shift_to_file_offsets
+from healthcare_rules import DEFAULT_CONFIG_PATH, rule_set_loader
+from healthcare_results import CompactResult, EntityColumns, EventColumns
+
+# One pool per rules file, sized by default_workers() when first needed
+_pools: Dict[str, Pool] = {}
+_pools_lock = threading.Lock()
+
+# The parts of an extraction result a caller can ask for; 'context' is the context
+# string of every event
+RESULT_FIELDS = ('entities', 'events', 'statistics', 'context')
+
+
+def default_workers() -> int:
+    configured = os.environ.get('EXTRACTION_WORKERS')
+    if configured:
+        return max(1, int(configured))
+    return os.cpu_count() or 1
+
+
+def extract_document(entity_extractor, event_extractor, text: str,
+                     selected_types: List[str] = None, min_confidence: float = 0.5,
+                     chunk_size: Optional[int] = None, fields: Optional[Collection[str]] = None,
+                     compact: bool = False):
+    # Documents longer than chunk_size go through the chunked extractors, which give
+    # the same results while only working on one window at a time. fields limits the
+    # result to some of RESULT_FIELDS: events are only detected when events or
+    # statistics are wanted, and their context strings only with 'context'; entities
+    # not at all when none of those fields is. With compact set the result is a
+    # CompactResult, whose to_dict(text) gives the dict.
+    fields = RESULT_FIELDS if fields is None else fields
+    want_events = 'events' in fields or 'statistics' in fields
+    context = 'context' in fields
+    chunked = chunk_size and len(text) > chunk_size
+    entities = []
+    if want_events or 'entities' in fields:
+        if chunked:
+            entities = entity_extractor.extract_entities_chunked(text, selected_types, chunk_size)
+        else:
+            entities = entity_extractor.extract_entities(text, selected_types)
+        entities = entity_extractor.filter_entities_by_confidence(entities, min_confidence)
+    events = []
+    if want_events:
+        if chunked:
+            events = event_extractor.extract_events_chunked(text, entities, chunk_size, context=context)
+        else:
+            events = event_extractor.extract_events(text, entities, context)
+    if compact:
+        # Statistics are computed from the columns when the result is converted
+        return CompactResult(EntityColumns.from_entities(text, entities),
+                             EventColumns.from_events(text, events, context), fields)
+
+    result = {}
+    if 'entities' in fields:
+        result['entities'] = entities
+    if 'events' in fields:
+        result['events'] = events
+    if 'statistics' in fields:
+        with stage('statistics'):
+            entity_stats = entity_extractor.get_entity_statistics(entities)
+            event_stats = event_extractor.get_event_statistics(events)
+        result['statistics'] = {
+            'entities': entity_stats,
+            'events': event_stats,
+            'total_entities': len(entities),
+            'total_events': len(events)
+        }
+    return result
+
+
+def select_fields(result: Dict, fields: Optional[Collection[str]] = None) -> Dict:
+    # The part of a full extract_document result that extracting with fields gives
+    if fields is None:
+        return result
+    selected = {key: value for key, value in result.items() if key in fields}
+    if 'events' in selected and 'context' not in fields:
+        selected['events'] = [{key: value for key, value in event.items() if key != 'context'}
+                              for event in selected['events']]
+    return selected
+
+
+def _get_extractors(config_path: str) -> Tuple:
+    # The process-wide rule set for the file; pool workers load it once in the
+    # initializer and pick up rule changes the same way the server does
+    return rule_set_loader(config_path).current().extractors
+
+
+def _init_worker(config_path: str):
+    # Ctrl-C is handled by the parent, which stops the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _get_extractors(config_path)
+
+
+def _run_task(task: Tuple) -> Dict:
+    config_path, kind, payload = task
+    return run_task(_get_extractors(config_path), kind, payload)
+
+
+def run_task(extractors: Tuple, kind: str, payload: Dict) -> Dict:
+    # Failures are reported per document so one bad note never sinks the batch
+    entity_extractor, event_extractor = extractors
+    try:
+        if kind == 'entities':
+            return {'entities': entity_extractor.extract_entities(payload['text'], payload.get('selected_types'))}
+        if kind == 'events':
+            return {'events': event_extractor.extract_events(payload['text'], payload.get('entities'),
+                                                             payload.get('context', True))}
+        if kind == 'document':
+            return extract_document(entity_extractor, event_extractor, payload['text'],
+                                    payload.get('selected_types'), payload.get('min_confidence', 0.5),
+                                    payload.get('chunk_size'), payload.get('fields'), payload.get('compact', False))
+        if kind == 'record':
+            # A finished output line, serialized where it was computed so the parent
+            # process only has to write it out. Records of an indexed corpus arrive as
+            # a byte range and are read from the worker's own map of the file; notes
+            # stored one per file are read here too, so a bad file fails only its record.
+            record_id, text = payload.get('id'), payload.get('text')
+            if 'offset' in payload:
+                corpus = corpus_reader(payload['path'], payload['delimiter'], payload['text_field'],
+                                       payload['id_field'])
+                corpus_id, text = corpus.read(payload['offset'], payload['length'])
+                record_id = corpus_id or record_id
+                input_bytes = payload['length']
+            elif 'file' in payload:
+                with open(payload['file'], 'r', encoding='utf-8') as f:
+                    text = f.read()
+                    input_bytes = os.fstat(f.fileno()).st_size
+            else:
+                input_bytes = len(text.encode('utf-8'))
+            result = extract_document(entity_extractor, event_extractor, text,
+                                      payload.get('selected_types'), payload.get('min_confidence', 0.5),
+                                      payload.get('chunk_size'))
+            if payload.get('file_offsets'):
+                result = shift_to_file_offsets(result, text, payload['offset'])
+            record = {'id': record_id}
+            if payload.get('include_text'):
+                record['text'] = text
+            record.update(result)
+            # Input size in bytes, so progress rates mean the same for every input type
+            return {'record': json.dumps(record), 'input_bytes': input_bytes}
+        if kind == 'entity_chunk':
+            return {'entities': entity_extractor._chunk_candidates(
+                payload['text'], payload['offset'], payload['start'], payload['end'],
+                payload.get('selected_types'))}
+        if kind == 'event_chunk':
+            return {'events': event_extractor._chunk_events(
+                payload['text'], payload['offset'], payload['start'], payload['end'],
+                payload['entities'], payload.get('context', True))}
+        raise ValueError(f'Unknown task type: {kind}')
+    except Exception as e:
+        return {'error': str(e)}
+
+
+def _get_pool(config_path: str) -> Pool:
+    # Request and job threads share the pool; the lock keeps two first callers from
+    # each starting one
+    with _pools_lock:
+        pool = _pools.get(config_path)
+        if pool is None:
+            pool = Pool(default_workers(), initializer=_init_worker, initargs=(config_path,))
+            _pools[config_path] = pool
+        return pool
+
+
+def _take_pools() -> List[Pool]:
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    return pools
+
+
+@atexit.register
+def shutdown_pools():
+    for pool in _take_pools():
+        pool.close()
+        pool.join()
+
+
+def terminate_pools():
+    # For interrupted runs: stops the workers without waiting for queued tasks
+    for pool in _take_pools():
+        pool.terminate()
+        pool.join()
+
+
+def run_batch(kind: str, payloads: List[Dict], config_path: str = DEFAULT_CONFIG_PATH,
+              workers: Optional[int] = None, local_extractors: Tuple = None,
+              offload: bool = False) -> List[Dict]:
+    # Results come back in input order. A single worker or document runs in-process
+    # (on local_extractors when given); anything larger goes to the rules file's pool,
+    # which outlives the call, so each worker loads the rules once. workers only
+    # decides that and how finely the payloads are split: the pool keeps its size.
+    # With offload set even a single document goes to the pool, keeping the
+    # extraction off this process's GIL.
+    if workers is None:
+        workers = default_workers()
+
+    if offload:
+        workers = max(1, workers)
+    elif workers <= 1 or len(payloads) <= 1:
+        extractors = local_extractors or _get_extractors(config_path)
+        return [run_task(extractors, kind, payload) for payload in payloads]
+
+    pool = _get_pool(config_path)
+    chunksize = max(1, len(payloads) // (workers * 4))
+    tasks = [(config_path, kind, payload) for payload in payloads]
+    return pool.map(_run_task, tasks, chunksize)
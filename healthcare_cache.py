@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+
+# Puts between trims of the disk table down to its bound
+DISK_TRIM_INTERVAL = 256
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 1024, max_chars: int = 64 * 1024 * 1024,
+                 db_path: Optional[str] = None, max_disk_entries: int = 100000):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self.db_path = db_path
+        self.max_disk_entries = max_disk_entries
+        # Values are kept as serialized JSON: it bounds memory by size and hands every
+        # caller its own copy, so responses can be modified without touching the cache
+        self._entries: OrderedDict = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._puts = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        if db_path:
+            with self._connect() as db:
+                db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+                # Tables from before the disk side was bounded have no last-use column
+                if 'used' not in [row[1] for row in db.execute('PRAGMA table_info(results)')]:
+                    db.execute('ALTER TABLE results ADD COLUMN used REAL NOT NULL DEFAULT 0')
+                db.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+            self._trim_disk()
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread and process; connections never cross a fork, so
+        # an app preloaded before forking workers is safe
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def _trim_disk(self):
+        # Least recently used rows beyond max_disk_entries are dropped, as in memory
+        with self._connect() as db:
+            deleted = db.execute(
+                'DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used DESC LIMIT -1 OFFSET ?)',
+                (self.max_disk_entries,)).rowcount
+        with self._lock:
+            self.disk_evictions += max(deleted, 0)
+
+    @staticmethod
+    def make_key(text: str, entity_types, min_confidence, domain: str, config_version: str,
+                 fields=None) -> str:
+        # entity_types keeps its order: it decides which type wins ties between equal spans.
+        # Results limited to some fields are stored apart from full ones.
+        parts = [text, entity_types, min_confidence, domain, config_version]
+        if fields is not None:
+            parts.append(sorted(fields))
+        payload = json.dumps(parts)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return json.loads(value)
+
+        if self.db_path:
+            with self._connect() as db:
+                row = db.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    db.execute('UPDATE results SET used = ? WHERE key = ?', (time.time(), key))
+            if row is not None:
+                with self._lock:
+                    self._remember(key, row[0])
+                    self.hits += 1
+                    self.disk_hits += 1
+                return json.loads(row[0])
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, result: Dict):
+        value = json.dumps(result)
+        with self._lock:
+            self._remember(key, value)
+            self._puts += 1
+            trim = self._puts % DISK_TRIM_INTERVAL == 0
+        if self.db_path:
+            with self._connect() as db:
+                db.execute('INSERT OR REPLACE INTO results (key, value, used) VALUES (?, ?, ?)',
+                           (key, value, time.time()))
+            if trim:
+                self._trim_disk()
+
+    def _remember(self, key: str, value: str):
+        if len(value) > self.max_chars:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._size -= len(previous)
+        self._entries[key] = value
+        self._size += len(value)
+        while len(self._entries) > self.max_entries or self._size > self.max_chars:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+        if self.db_path:
+            with self._connect() as db:
+                db.execute('DELETE FROM results')
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'chars': self._size,
+                'max_entries': self.max_entries,
+                'max_chars': self.max_chars,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'disk_evictions': self.disk_evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'persistent': bool(self.db_path),
+                'max_disk_entries': self.max_disk_entries
+            }
@@ -0,0 +1,40 @@
+from typing import List, Callable, Iterable, Iterator, NamedTuple, Optional
+
+CHUNK_SIZE = 64 * 1024
+# Must exceed the widest context either extractor reads around a match (50 chars for
+# confidence, 100 for event context, 150 for event attributes) plus the match itself
+CHUNK_OVERLAP = 512
+
+
+class Chunk(NamedTuple):
+    # Results starting in [start, end) belong to this chunk; they are computed on the
+    # wider [window_start, window_end) slice so every context window is complete
+    start: int
+    end: int
+    window_start: int
+    window_end: int
+
+
+def plan_chunks(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP,
+                align: Optional[Callable[[str, int], int]] = None) -> Iterator[Chunk]:
+    length = len(text)
+    start = 0
+    while start < length:
+        end = min(length, start + chunk_size)
+        window_start = max(0, start - overlap)
+        if align is not None and window_start > 0:
+            window_start = align(text, window_start)
+        yield Chunk(start, end, window_start, min(length, end + overlap))
+        start = end
+
+
+def iter_waves(items: Iterable, size: int) -> Iterator[List]:
+    # Groups chunks so only a few windows are materialized at a time
+    wave = []
+    for item in items:
+        wave.append(item)
+        if len(wave) >= size:
+            yield wave
+            wave = []
+    if wave:
+        yield wave
@@ -0,0 +1,58 @@
+import numpy as np
+from typing import List, Dict, Sequence
+
+BASE_CONFIDENCE = 0.6
+CONTEXT_WINDOW = 50
+CONTEXT_BOOST = 0.1
+
+
+def confidence_table(max_matches: int) -> List[float]:
+    # Score for each number of context words found, accumulated exactly like the
+    # per-entity loop did so every float rounds the same way
+    table = []
+    for matches in range(max_matches + 1):
+        context_boost = 0
+        for _ in range(matches):
+            context_boost += CONTEXT_BOOST
+        table.append(round(min(1.0, BASE_CONFIDENCE + context_boost), 2))
+    return table
+
+
+class ContextWordIndex:
+    # Occurrences of each context word are located once per document; a word is in
+    # an entity's window when its first occurrence at or after the window start
+    # also ends inside the window
+    def __init__(self, text_lower: str):
+        self.text = text_lower
+        self._positions: Dict[str, np.ndarray] = {}
+
+    def positions(self, word: str) -> np.ndarray:
+        positions = self._positions.get(word)
+        if positions is None:
+            found = []
+            pos = self.text.find(word)
+            while pos != -1:
+                found.append(pos)
+                pos = self.text.find(word, pos + 1)
+            positions = self._positions[word] = np.array(found, dtype=np.int64)
+        return positions
+
+    def scores(self, starts: Sequence[int], ends: Sequence[int], context_words: List[str]) -> np.ndarray:
+        window_starts = np.maximum(np.asarray(starts, dtype=np.int64) - CONTEXT_WINDOW, 0)
+        window_ends = np.minimum(np.asarray(ends, dtype=np.int64) + CONTEXT_WINDOW, len(self.text))
+        matches = np.zeros(len(window_starts), dtype=np.int64)
+
+        for word in context_words:
+            word = word.lower()
+            if not word:
+                # The empty string is found in every window
+                matches += 1
+                continue
+            positions = self.positions(word)
+            if not len(positions):
+                continue
+            index = np.searchsorted(positions, window_starts)
+            first = positions[np.minimum(index, len(positions) - 1)]
+            matches += (index < len(positions)) & (first + len(word) <= window_ends)
+
+        return np.array(confidence_table(len(context_words)))[matches]
@@ -0,0 +1,166 @@
+import os
+import json
+import mmap
+import threading
+import numpy as np
+from typing import List, Dict, Tuple, Iterator, Optional
+
+# Bytes scanned per step while building an index, so the scan never holds more
+# than one block of the mapped file in a numpy array
+INDEX_BLOCK_SIZE = 64 * 1024 * 1024
+INDEX_SUFFIX = '.idx.npz'
+# Records at most this long are checked for being whitespace only; longer ones
+# cannot be blank in practice and are kept without decoding them
+BLANK_CHECK_LENGTH = 64
+
+_readers: Dict[Tuple[str, bytes], 'CorpusReader'] = {}
+_readers_lock = threading.Lock()
+
+
+def _find_delimiters(data: mmap.mmap, delimiter: bytes) -> np.ndarray:
+    # Start position of every delimiter in the file
+    size = len(data)
+    if len(delimiter) == 1:
+        target = delimiter[0]
+        found = []
+        for offset in range(0, size, INDEX_BLOCK_SIZE):
+            block = np.frombuffer(data, np.uint8, min(INDEX_BLOCK_SIZE, size - offset), offset)
+            found.append(np.flatnonzero(block == target) + offset)
+        return np.concatenate(found) if found else np.empty(0, np.int64)
+
+    positions = []
+    position = data.find(delimiter)
+    while position != -1:
+        positions.append(position)
+        position = data.find(delimiter, position + len(delimiter))
+    return np.array(positions, np.int64)
+
+
+class CorpusReader:
+    # A large text or NDJSON file split into records by a delimiter, read through a
+    # memory map. The (offset, length) of every record is indexed once and saved next
+    # to the file, so record N can be read without scanning the file again and each
+    # worker only decodes the byte ranges it is given.
+    def __init__(self, path: str, delimiter: bytes = b'\n', text_field: str = 'text', id_field: str = 'id'):
+        self.path = path
+        self.delimiter = delimiter
+        self.text_field = text_field
+        self.id_field = id_field
+        self.is_ndjson = path.endswith(('.ndjson', '.jsonl'))
+        with open(path, 'rb') as f:
+            # mmap cannot map an empty file
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b''
+        self.offsets, self.lengths = self._load_index()
+
+    @property
+    def index_path(self) -> str:
+        return self.path + INDEX_SUFFIX
+
+    def _stamp(self) -> np.ndarray:
+        stat = os.stat(self.path)
+        return np.array([stat.st_size, stat.st_mtime_ns], np.int64)
+
+    def _load_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        stamp = self._stamp()
+        try:
+            with np.load(self.index_path) as saved:
+                if np.array_equal(saved['stamp'], stamp) and saved['delimiter'].tobytes() == self.delimiter:
+                    return saved['offsets'], saved['lengths']
+        except (OSError, KeyError, ValueError):
+            pass
+        offsets, lengths = self.build_index()
+        self._save_index(stamp, offsets, lengths)
+        return offsets, lengths
+
+    def build_index(self) -> Tuple[np.ndarray, np.ndarray]:
+        data = self._data
+        ends = _find_delimiters(data, self.delimiter) if len(data) else np.empty(0, np.int64)
+        starts = np.concatenate(([0], ends + len(self.delimiter))).astype(np.int64)
+        ends = np.concatenate((ends, [len(data)])).astype(np.int64)
+        if self.delimiter == b'\n' and len(data):
+            # CRLF files: the carriage return is not part of the record
+            has_cr = (ends > starts) & (np.frombuffer(data, np.uint8)[np.maximum(ends - 1, 0)] == 13)
+            ends = ends - has_cr
+        lengths = ends - starts
+        # Blank records are skipped, as the line-based readers skip blank lines
+        keep = lengths > 0
+        for i in np.flatnonzero(keep & (lengths <= BLANK_CHECK_LENGTH)).tolist():
+            if not data[starts[i]:ends[i]].strip():
+                keep[i] = False
+        return starts[keep], lengths[keep]
+
+    def _save_index(self, stamp: np.ndarray, offsets: np.ndarray, lengths: np.ndarray):
+        temporary = self.index_path + '.tmp'
+        try:
+            with open(temporary, 'wb') as f:
+                np.savez(f, stamp=stamp, offsets=offsets, lengths=lengths,
+                         delimiter=np.frombuffer(self.delimiter, np.uint8))
+            os.replace(temporary, self.index_path)
+        except OSError:
+            # A read-only directory only costs a rescan next time
+            pass
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def range(self, number: int) -> Tuple[int, int]:
+        return int(self.offsets[number]), int(self.lengths[number])
+
+    def ranges(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Tuple[int, int, int]]:
+        # (record number, offset, length) for records start..stop
+        stop = len(self) if stop is None else min(stop, len(self))
+        for number, offset, length in zip(range(start, stop), self.offsets[start:stop].tolist(),
+                                          self.lengths[start:stop].tolist()):
+            yield number, offset, length
+
+    def read(self, offset: int, length: int) -> Tuple[Optional[str], str]:
+        # (record id, text) of the record stored at the given byte range
+        raw = self._data[offset:offset + length]
+        if not self.is_ndjson:
+            return None, raw.decode('utf-8')
+        record = json.loads(raw)
+        record_id = record.get(self.id_field)
+        return None if record_id is None else str(record_id), record.get(self.text_field) or ''
+
+    def __getitem__(self, number: int) -> Tuple[Optional[str], str]:
+        if number < 0:
+            number += len(self)
+        if not 0 <= number < len(self):
+            raise IndexError('record number out of range')
+        return self.read(*self.range(number))
+
+
+def corpus_reader(path: str, delimiter: bytes = b'\n', text_field: str = 'text',
+                  id_field: str = 'id') -> CorpusReader:
+    # One reader per file and process; pool workers open their own map of the file
+    reader = _readers.get((path, delimiter))
+    if reader is None or (reader.text_field, reader.id_field) != (text_field, id_field):
+        with _readers_lock:
+            reader = _readers[(path, delimiter)] = CorpusReader(path, delimiter, text_field, id_field)
+    return reader
+
+
+def to_file_offsets(text: str, record_offset: int, positions: List[int]) -> List[int]:
+    # Character positions in a record's text as byte positions in the file
+    if text.isascii():
+        return [record_offset + position for position in positions]
+    # Encode the text once, piece by piece between consecutive positions
+    byte_offsets = {}
+    previous, byte_offset = 0, record_offset
+    for position in sorted(set(positions)):
+        byte_offset += len(text[previous:position].encode('utf-8'))
+        byte_offsets[position] = byte_offset
+        previous = position
+    return [byte_offsets[position] for position in positions]
+
+
+def shift_to_file_offsets(result: Dict, text: str, record_offset: int) -> Dict:
+    items = result['entities'] + result['events']
+    starts = to_file_offsets(text, record_offset, [item['start'] for item in items])
+    ends = to_file_offsets(text, record_offset, [item['end'] for item in items])
+    result['entities'] = [dict(item, start=start, end=end)
+                          for item, start, end in zip(result['entities'], starts, ends)]
+    shifted = len(result['entities'])
+    result['events'] = [dict(item, start=start, end=end)
+                        for item, start, end in zip(result['events'], starts[shifted:], ends[shifted:])]
+    return result
@@ -0,0 +1,122 @@
+import re
+import calendar
+from datetime import date, timedelta
+from typing import List, Dict, Tuple, Optional
+
+MONTHS = {name.lower(): number for number, name in enumerate(calendar.month_name) if name}
+_MONTH = '(' + '|'.join(calendar.month_name[1:]) + ')'
+
+# The absolute date forms the event extractor recognizes, plus ISO dates, with the
+# parts captured so they can be turned into calendar dates. Numeric dates are read
+# month first, as in the notes the rules were written for. All forms are found in
+# one scan of the text.
+DATE_FORMS = [
+    ('iso', r'(\d{4})-(\d{1,2})-(\d{1,2})'),
+    ('numeric', r'(\d{1,2})[/-](\d{1,2})[/-](\d{4}|\d{2})'),
+    ('day_month', r'(\d{1,2})\s+' + _MONTH + r'\s+(\d{4}|\d{2})'),
+    ('month_day', _MONTH + r'\s+(\d{1,2}),?\s+(\d{4}|\d{2})'),
+    ('relative', r'(yesterday|today|tomorrow|(?:last|next)\s+(?:week|month|year))')
+]
+DATE_PATTERN = re.compile(r'\b(?:' + '|'.join(f'(?P<{kind}>{form})' for kind, form in DATE_FORMS) + r')\b',
+                          re.IGNORECASE)
+DATE_PATTERN_PARTS = {kind: re.compile(form).groups for kind, form in DATE_FORMS}
+DIGIT = re.compile(r'\d')
+
+# Characters read on each side of an event for its date, as for its context string
+EVENT_DATE_WINDOW = 100
+
+RELATIVE_DAYS = {'yesterday': -1, 'today': 0, 'tomorrow': 1, 'last week': -7, 'next week': 7}
+
+
+def _year(value: str) -> int:
+    year = int(value)
+    if len(value) == 2:
+        year += 2000 if year < 50 else 1900
+    return year
+
+
+def _shift_months(reference: date, months: int) -> date:
+    month = reference.month - 1 + months
+    year = reference.year + month // 12
+    month = month % 12 + 1
+    return date(year, month, min(reference.day, calendar.monthrange(year, month)[1]))
+
+
+def _to_date(kind: str, groups: Tuple[str, ...], reference: Optional[date]) -> Optional[date]:
+    if kind == 'iso':
+        return date(int(groups[0]), int(groups[1]), int(groups[2]))
+    if kind == 'numeric':
+        return date(_year(groups[2]), int(groups[0]), int(groups[1]))
+    if kind == 'day_month':
+        return date(_year(groups[2]), MONTHS[groups[1].lower()], int(groups[0]))
+    if kind == 'month_day':
+        return date(_year(groups[2]), MONTHS[groups[0].lower()], int(groups[1]))
+    # Relative dates only mean something against the date the note was written
+    if reference is None:
+        return None
+    phrase = ' '.join(groups[0].lower().split())
+    if phrase in RELATIVE_DAYS:
+        return reference + timedelta(days=RELATIVE_DAYS[phrase])
+    months = 1 if phrase.endswith('month') else 12
+    return _shift_months(reference, months if phrase.startswith('next') else -months)
+
+
+def parse_dates(text: str, reference: Optional[date] = None) -> List[Tuple[int, int, date]]:
+    # (start, end, date) of every date in text that names a real calendar day
+    if reference is None and not DIGIT.search(text):
+        return []
+    dates = []
+    for match in DATE_PATTERN.finditer(text):
+        kind = match.lastgroup
+        groups = match.groups()
+        # The captured parts of the form that matched follow its own group
+        first = DATE_PATTERN.groupindex[kind]
+        parts = groups[first:first + DATE_PATTERN_PARTS[kind]]
+        try:
+            value = _to_date(kind, parts, reference)
+        except ValueError:
+            continue
+        if value is not None:
+            dates.append((match.start(), match.end(), value))
+    return dates
+
+
+def parse_date(value: str) -> Optional[date]:
+    # A single date given by a user, e.g. a query bound
+    dates = parse_dates(value.strip())
+    return dates[0][2] if dates else None
+
+
+def _trigger_offset(context: str, trigger: str, expected: int) -> int:
+    # Where an event's trigger lies in its context: the occurrence nearest the offset
+    # it was cut at, not the first one. Stripping the context only moves it left.
+    best = None
+    position = context.find(trigger) if trigger else -1
+    while position != -1:
+        if best is None or abs(position - expected) < abs(best - expected):
+            best = position
+        position = context.find(trigger, position + 1)
+    return min(expected, len(context)) if best is None else best
+
+
+def event_date(event: Dict, reference: Optional[date] = None,
+               text: Optional[str] = None) -> Optional[Tuple[date, str]]:
+    # The date closest to an event's trigger, with the text it was read from. Dates are
+    # read from the document around the event's own span when text is given, else from
+    # the event's context string; an event with neither has no date.
+    trigger = event.get('trigger', '')
+    if text is not None:
+        window_start = max(0, event['start'] - EVENT_DATE_WINDOW)
+        window = text[window_start:event['end'] + EVENT_DATE_WINDOW]
+        trigger_start = event['start'] - window_start
+    else:
+        window = event.get('context')
+        if not window:
+            return None
+        trigger_start = _trigger_offset(window, trigger, min(event.get('start', 0), EVENT_DATE_WINDOW))
+    trigger_end = trigger_start + len(trigger)
+    dates = parse_dates(window, reference)
+    if not dates:
+        return None
+    start, end, value = min(dates, key=lambda item: max(item[0] - trigger_end, trigger_start - item[1], 0))
+    return value, window[start:end]
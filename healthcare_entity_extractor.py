@@ -1,73 +1,177 @@
-import re
 import json
+import numpy as np
+from bisect import bisect_right
 from typing import List, Dict, Tuple
 from healthcare_tokenizer import HealthcareTokenizer
+from healthcare_pattern_matcher import EntityPatternMatcher
+from healthcare_span_index import EntitySpanIndex
+from healthcare_batch import run_batch
+from healthcare_chunking import CHUNK_SIZE, CHUNK_OVERLAP, plan_chunks, iter_waves
+from healthcare_metrics import stage, count
+from healthcare_confidence import ContextWordIndex
+from healthcare_segments import SegmentCache, segment_bounds, segment_key
+from healthcare_backends import create_backend
 
 class HealthcareEntityExtractor:
-    def __init__(self, config_path: str = 'config/extraction_rules.json'):
-        with open(config_path, 'r') as f:
-            self.config = json.load(f)
+    def __init__(self, config_path: str = 'config/extraction_rules.json', config: Dict = None,
+                 segment_cache: SegmentCache = None, backend: str = 'rules'):
+        self.config_path = config_path
+        # With a segment cache, candidates of segments seen before are reused
+        self.segment_cache = segment_cache
+        # A rule set that has already parsed the file passes its config in
+        if config is None:
+            with open(config_path, 'r') as f:
+                config = json.load(f)
+        self.config = config
         
-        self.tokenizer = HealthcareTokenizer(config_path)
+        self.tokenizer = HealthcareTokenizer(config_path, config)
         self.entity_types = self.config['healthcare_entities']
+        self.matcher = EntityPatternMatcher(self.entity_types)
+        # What finds the candidates: the rules themselves, or a spaCy pipeline
+        self.backend = create_backend(backend, self)
     
     def extract_entities(self, text: str, selected_types: List[str] = None) -> List[Dict]:
+        if self.segment_cache is not None:
+            entities = self._segment_candidates(text, 0, len(text), selected_types)
+        else:
+            entities = self.backend.collect(text, selected_types)
+        return self._resolve_overlaps(entities)
+    
+    def _resolve_overlaps(self, entities: List[Dict]) -> List[Dict]:
+        with stage('overlap_removal'):
+            entities = self._remove_overlapping_entities(entities)
+            entities.sort(key=lambda x: x['start'])
+        count('entities', len(entities))
+
+        return entities
+    
+    def extract_entities_chunked(self, text: str, selected_types: List[str] = None,
+                                 chunk_size: int = CHUNK_SIZE, workers: int = 1) -> List[Dict]:
+        # Same output as extract_entities, computed one overlapping window at a time.
+        # Each chunk reports the candidates starting in its own range, and the overlap
+        # sweep carries its last kept span from one chunk to the next.
+        entities = []
+        last_span = (0, 0)
+        chunks = plan_chunks(text, chunk_size, align=self.tokenizer.unit_boundary_before)
+        for wave in iter_waves(chunks, max(1, workers) * 2):
+            payloads = [{
+                'text': text[chunk.window_start:chunk.window_end],
+                'offset': chunk.window_start,
+                'start': chunk.start,
+                'end': chunk.end,
+                'selected_types': selected_types
+            } for chunk in wave]
+            for result in run_batch('entity_chunk', payloads, self.config_path, workers, (self, None)):
+                if 'error' in result:
+                    raise RuntimeError(result['error'])
+                kept = EntitySpanIndex(result['entities']).non_overlapping(last_span)
+                last_span = EntitySpanIndex.last_span(kept, last_span)
+                entities.extend(kept)
+
+        entities.sort(key=lambda x: x['start'])
+        return entities
+    
+    def _chunk_candidates(self, text: str, offset: int, start: int, end: int,
+                          selected_types: List[str] = None) -> List[Dict]:
+        if self.segment_cache is not None:
+            candidates = self._segment_candidates(text, start - offset, end - offset, selected_types)
+            for entity in candidates:
+                entity['start'] += offset
+                entity['end'] += offset
+            return candidates
+        candidates = []
+        for entity in self.backend.collect(text, selected_types):
+            entity['start'] += offset
+            entity['end'] += offset
+            if start <= entity['start'] < end:
+                candidates.append(entity)
+        return candidates
+    
+    def _segment_candidates(self, text: str, start: int, end: int,
+                            selected_types: List[str] = None) -> List[Dict]:
+        # Candidates starting in [start, end) of text, segment by segment. A segment's
+        # candidates only depend on CHUNK_OVERLAP characters around it (what makes
+        # chunked extraction exact), so they are cached under the text of that window
+        # and reused wherever the same window recurs, e.g. in templated notes.
+        if selected_types is None:
+            selected_types = list(self.entity_types.keys())
+        types = tuple(selected_types)
+
+        def window(segment_start, segment_end):
+            window_start = max(0, segment_start - CHUNK_OVERLAP)
+            if window_start > 0:
+                window_start = self.tokenizer.unit_boundary_before(text, window_start)
+            return window_start, min(len(text), segment_end + CHUNK_OVERLAP)
+
+        def key(segment_start, segment_end):
+            window_start, window_end = window(segment_start, segment_end)
+            return segment_key(text[window_start:window_end], 'entities', self.backend.name, types,
+                               segment_start - window_start, segment_end - window_start)
+
+        def compute(bounds):
+            window_start, window_end = window(bounds[0], bounds[-1])
+            segments = [[] for _ in range(len(bounds) - 1)]
+            for entity in self.backend.collect(text[window_start:window_end], selected_types):
+                entity_start = entity['start'] + window_start
+                if bounds[0] <= entity_start < bounds[-1]:
+                    segment = bisect_right(bounds, entity_start) - 1
+                    segments[segment].append((
+                        entity_start - bounds[segment], entity['end'] + window_start - bounds[segment],
+                        entity['type'], entity['confidence'], entity['pattern_matched']))
+            return segments
+
+        bounds = segment_bounds(text, start, end)
+        candidates = []
+        for segment_start, segment in zip(bounds, self.segment_cache.cached(bounds, key, compute)):
+            for relative_start, relative_end, entity_type, confidence, pattern in segment:
+                entity_start, entity_end = segment_start + relative_start, segment_start + relative_end
+                candidates.append({
+                    'text': text[entity_start:entity_end],
+                    'start': entity_start,
+                    'end': entity_end,
+                    'type': entity_type,
+                    'confidence': confidence,
+                    'pattern_matched': pattern
+                })
+        return candidates
+    
+    def _collect_candidates(self, text: str, selected_types: List[str] = None) -> List[Dict]:
         if selected_types is None:
             selected_types = list(self.entity_types.keys())
 
-        # Use custom tokenization for domain-specific terminology
-        tokens = self.tokenizer.custom_tokenize(text)
+        # Use custom tokenization for domain-specific terminology; spans come
+        # straight from the tokenizer so the text is never re-searched. Types matched
+        # by text patterns alone need no tokens.
         token_spans = []
-        offset = 0
-        for token in tokens:
-            # Find token in text starting from offset
-            match = re.search(re.escape(token), text[offset:], re.IGNORECASE)
-            if match:
-                start = offset + match.start()
-                end = offset + match.end()
-                token_spans.append((token, start, end))
-                offset = end
-            else:
-                # Fallback: skip if not found
-                continue
+        if self.matcher.needs_tokens(selected_types):
+            with stage('tokenize'):
+                token_spans = [
+                    (normalized, start, end)
+                    for _, normalized, start, end in self.tokenizer.tokenize_with_spans(text)
+                ]
+        count('tokens', len(token_spans))
 
+        with stage('pattern_match'):
+            hits = self.matcher.match(text, token_spans, selected_types)
+        return self._candidates_from_hits(text, hits, selected_types)
+    
+    def _candidates_from_hits(self, text: str, hits: List[Tuple[str, str, int, int]],
+                              selected_types: List[str]) -> List[Dict]:
+        # Scores (type, pattern, start, end) hits into entity dicts and adds the dosages
         entities = []
-        text_lower = text.lower()
 
-
-        for entity_type in selected_types:
-            if entity_type not in self.entity_types:
-                continue
-            patterns = self.entity_types[entity_type]['patterns']
-            context_words = self.entity_types[entity_type].get('context_words', [])
-            for pattern in patterns:
-                # If the pattern looks like a regex (contains \d, +, *, etc.), use re.finditer
-                if re.search(r'\\d|\\w|\+|\*|\[|\]|\(|\)|\{|\}|\^|\$|\.|\?', pattern):
-                    for match in re.finditer(pattern, text, re.IGNORECASE):
-                        start, end = match.span()
-                        entity_text = text[start:end]
-                        confidence = self._calculate_confidence(text_lower, start, end, context_words)
-                        entities.append({
-                            'text': entity_text,
-                            'start': start,
-                            'end': end,
-                            'type': entity_type,
-                            'confidence': confidence,
-                            'pattern_matched': pattern
-                        })
-                else:
-                    for token, start, end in token_spans:
-                        if re.fullmatch(pattern, token, re.IGNORECASE):
-                            entity_text = text[start:end]
-                            confidence = self._calculate_confidence(text_lower, start, end, context_words)
-                            entities.append({
-                                'text': entity_text,
-                                'start': start,
-                                'end': end,
-                                'type': entity_type,
-                                'confidence': confidence,
-                                'pattern_matched': pattern
-                            })
+        with stage('confidence'):
+            confidences = self._calculate_confidences(text.lower(), hits)
+            for (entity_type, pattern, start, end), confidence in zip(hits, confidences):
+                entity_text = text[start:end]
+                entities.append({
+                    'text': entity_text,
+                    'start': start,
+                    'end': end,
+                    'type': entity_type,
+                    'confidence': confidence,
+                    'pattern_matched': pattern
+                })
 
         # Extract dosages and add as MEDICATION entities
         dosages = self.tokenizer.extract_dosage_info(text)
@@ -82,42 +186,42 @@ class HealthcareEntityExtractor:
             }
             entities.append(dosage_entity)
 
-        entities = self._remove_overlapping_entities(entities)
-        entities.sort(key=lambda x: x['start'])
-
+        count('entity_candidates', len(entities))
         return entities
     
+    def extract_batch(self, texts: List[str], selected_types: List[str] = None,
+                      workers: int = None) -> List[Dict]:
+        # One {'entities': [...]} or {'error': ...} per text, in input order
+        if self.backend.batched:
+            # The backend batches and parallelizes on its own (spaCy's nlp.pipe)
+            try:
+                batches = self.backend.collect_batch(texts, selected_types)
+            except Exception as e:
+                return [{'error': str(e)} for _ in texts]
+            return [{'entities': self._resolve_overlaps(candidates)} for candidates in batches]
+        payloads = [{'text': text, 'selected_types': selected_types} for text in texts]
+        return run_batch('entities', payloads, self.config_path, workers, (self, None))
+    
+    def _calculate_confidences(self, text: str, hits: List[Tuple[str, str, int, int]]) -> List[float]:
+        # Scores all candidates of a type in one batch against the shared word index
+        context_index = ContextWordIndex(text)
+        type_codes: Dict[str, int] = {}
+        codes = np.fromiter((type_codes.setdefault(hit[0], len(type_codes)) for hit in hits), np.int64, len(hits))
+        starts = np.fromiter((hit[2] for hit in hits), np.int64, len(hits))
+        ends = np.fromiter((hit[3] for hit in hits), np.int64, len(hits))
+
+        confidences = np.zeros(len(hits))
+        for entity_type, code in type_codes.items():
+            context_words = self.entity_types[entity_type].get('context_words', [])
+            members = codes == code
+            confidences[members] = context_index.scores(starts[members], ends[members], context_words)
+        return confidences.tolist()
+    
     def _calculate_confidence(self, text: str, start: int, end: int, context_words: List[str]) -> float:
-        base_confidence = 0.6
-        
-        context_window = 50
-        context_start = max(0, start - context_window)
-        context_end = min(len(text), end + context_window)
-        context = text[context_start:context_end]
-        
-        context_boost = 0
-        for word in context_words:
-            if word.lower() in context:
-                context_boost += 0.1
-        
-        final_confidence = min(1.0, base_confidence + context_boost)
-        return round(final_confidence, 2)
+        return float(ContextWordIndex(text).scores([start], [end], context_words)[0])
     
     def _remove_overlapping_entities(self, entities: List[Dict]) -> List[Dict]:
-        entities.sort(key=lambda x: (x['start'], -(x['end'] - x['start'])))
-        
-        filtered = []
-        for entity in entities:
-            overlapping = False
-            for existing in filtered:
-                if (entity['start'] < existing['end'] and entity['end'] > existing['start']):
-                    overlapping = True
-                    break
-            
-            if not overlapping:
-                filtered.append(entity)
-        
-        return filtered
+        return EntitySpanIndex(entities).non_overlapping()
     
     def get_entity_statistics(self, entities: List[Dict]) -> Dict:
         stats = {}
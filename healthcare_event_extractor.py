@@ -1,14 +1,37 @@
 import re
 import json
-from typing import List, Dict, Tuple
-from datetime import datetime
+from typing import List, Dict
+from datetime import date
+from bisect import bisect_left, bisect_right
+from healthcare_span_index import EntitySpanIndex, PatternSpanIndex
+from healthcare_batch import run_batch
+from healthcare_chunking import CHUNK_SIZE, CHUNK_OVERLAP, plan_chunks, iter_waves
+from healthcare_pattern_matcher import MultiPatternScanner
+from healthcare_metrics import stage, count
+from healthcare_dates import event_date
+from healthcare_segments import SegmentCache, segment_bounds, segment_key
+
+RELATED_ENTITY_PROXIMITY = 200
 
 class HealthcareEventExtractor:
-    def __init__(self, config_path: str = 'config/extraction_rules.json'):
-        with open(config_path, 'r') as f:
-            self.config = json.load(f)
+    def __init__(self, config_path: str = 'config/extraction_rules.json', config: Dict = None,
+                 segment_cache: SegmentCache = None):
+        self.config_path = config_path
+        # With a segment cache, events of segments seen before are reused
+        self.segment_cache = segment_cache
+        if config is None:
+            with open(config_path, 'r') as f:
+                config = json.load(f)
+        self.config = config
         
         self.event_types = self.config['healthcare_events']
+        # Every trigger of every event type, found in one pass over the text
+        self.triggers = [
+            (event_type, trigger)
+            for event_type, event_config in self.event_types.items()
+            for trigger in event_config['triggers']
+        ]
+        self.trigger_scanner = MultiPatternScanner([r'\b' + trigger + r'\b' for _, trigger in self.triggers])
         
         self.date_patterns = [
             r'\d{1,2}[/-]\d{1,2}[/-]\d{2,4}',
@@ -23,23 +46,44 @@ class HealthcareEventExtractor:
             r'\d{1,2}:\d{2}\s*(am|pm|AM|PM)?',
             r'morning|afternoon|evening|night'
         ]
+        
+        self.location_patterns = [
+            r'\b\w+\s+hospital\b',
+            r'\b\w+\s+medical\s+center\b',
+            r'\b\w+\s+clinic\b',
+            r'\bemergency\s+room\b',
+            r'\ber\b',
+            r'\bicu\b',
+            r'\bintensive\s+care\s+unit\b'
+        ]
+        
+        self.compiled_date_patterns = [re.compile(p, re.IGNORECASE) for p in self.date_patterns]
+        self.compiled_time_patterns = [re.compile(p, re.IGNORECASE) for p in self.time_patterns]
+        self.compiled_location_patterns = [re.compile(p, re.IGNORECASE) for p in self.location_patterns]
     
-    def extract_events(self, text: str, entities: List[Dict] = None) -> List[Dict]:
+    def extract_events(self, text: str, entities: List[Dict] = None, context: bool = True) -> List[Dict]:
+        # Without context, events carry no 'context' string
+        if self.segment_cache is not None:
+            return self._segment_events(text, 0, len(text), entities or [], context)
+        return self._detect_events(text, entities, context)
+    
+    def _detect_events(self, text: str, entities: List[Dict] = None, context: bool = True) -> List[Dict]:
         events = []
         text_lower = text.lower()
         
         if entities is None:
             entities = []
+        entity_index = EntitySpanIndex(entities)
+        attribute_spans = self._attribute_spans(text)
         
-        for event_type, event_config in self.event_types.items():
-            triggers = event_config['triggers']
-            attributes = event_config['attributes']
-            
-            for trigger in triggers:
-                matches = list(re.finditer(r'\b' + trigger + r'\b', text_lower))
+        with stage('event_detection'):
+            trigger_hits = self.trigger_scanner.scan(text_lower)
+        
+        with stage('event_attributes'):
+            for (event_type, trigger), matches in zip(self.triggers, trigger_hits):
+                attributes = self.event_types[event_type]['attributes']
                 
-                for match in matches:
-                    start, end = match.span()
+                for start, end in matches:
                     event_text = text[start:end]
                     
                     event = {
@@ -48,71 +92,205 @@ class HealthcareEventExtractor:
                         'start': start,
                         'end': end,
                         'attributes': {},
-                        'confidence': 0.7,
-                        'context': self._extract_context(text, start, end)
+                        'confidence': 0.7
                     }
+                    if context:
+                        event['context'] = self._extract_context(text, start, end)
                     
                     event['attributes'] = self._extract_event_attributes(
-                        text, start, end, attributes, entities
+                        text, start, end, attributes, entity_index, attribute_spans
                     )
                     
                     events.append(event)
         
         events.sort(key=lambda x: x['start'])
+        count('events', len(events))
         return events
     
+    def extract_events_chunked(self, text: str, entities: List[Dict] = None,
+                               chunk_size: int = CHUNK_SIZE, workers: int = 1, context: bool = True) -> List[Dict]:
+        # Same output as extract_events, computed one overlapping window at a time.
+        # Each window only receives the entities that can fall within proximity of
+        # an event starting in its chunk, shifted into window coordinates.
+        if entities is None:
+            entities = []
+        order = sorted(range(len(entities)), key=lambda i: entities[i]['start'])
+        starts = [entities[i]['start'] for i in order]
+        longest = max((entity['end'] - entity['start'] for entity in entities), default=0)
+        proximity = RELATED_ENTITY_PROXIMITY
+
+        events = []
+        for wave in iter_waves(plan_chunks(text, chunk_size), max(1, workers) * 2):
+            payloads = []
+            for chunk in wave:
+                lo = bisect_left(starts, chunk.start - proximity - longest)
+                hi = bisect_right(starts, chunk.window_end + proximity)
+                nearby = sorted(i for i in order[lo:hi] if entities[i]['end'] >= chunk.start - proximity)
+                payloads.append({
+                    'text': text[chunk.window_start:chunk.window_end],
+                    'offset': chunk.window_start,
+                    'start': chunk.start,
+                    'end': chunk.end,
+                    'entities': [
+                        dict(entities[i], start=entities[i]['start'] - chunk.window_start,
+                             end=entities[i]['end'] - chunk.window_start)
+                        for i in nearby
+                    ],
+                    'context': context
+                })
+            for result in run_batch('event_chunk', payloads, self.config_path, workers, (None, self)):
+                if 'error' in result:
+                    raise RuntimeError(result['error'])
+                events.extend(result['events'])
+        return events
+    
+    def _chunk_events(self, text: str, offset: int, start: int, end: int,
+                      entities: List[Dict], context: bool = True) -> List[Dict]:
+        if self.segment_cache is not None:
+            events = self._segment_events(text, start - offset, end - offset, entities, context)
+            for event in events:
+                event['start'] += offset
+                event['end'] += offset
+            return events
+        events = []
+        for event in self._detect_events(text, entities, context):
+            event['start'] += offset
+            event['end'] += offset
+            if start <= event['start'] < end:
+                events.append(event)
+        return events
+    
+    def _segment_events(self, text: str, start: int, end: int, entities: List[Dict],
+                        context: bool = True) -> List[Dict]:
+        # Events starting in [start, end) of text, segment by segment. A segment's events
+        # depend on the CHUNK_OVERLAP characters around it and on the entities within
+        # RELATED_ENTITY_PROXIMITY of its triggers, so both go into its cache key.
+        order = sorted(range(len(entities)), key=lambda i: entities[i]['start'])
+        starts = [entities[i]['start'] for i in order]
+        longest = max((entity['end'] - entity['start'] for entity in entities), default=0)
+        proximity = RELATED_ENTITY_PROXIMITY
+
+        def window(segment_start, segment_end):
+            return max(0, segment_start - CHUNK_OVERLAP), min(len(text), segment_end + CHUNK_OVERLAP)
+
+        def nearby(segment_start, window_end):
+            # Same selection as extract_events_chunked, in entity list order
+            lo = bisect_left(starts, segment_start - proximity - longest)
+            hi = bisect_right(starts, window_end + proximity)
+            return [entities[i] for i in sorted(i for i in order[lo:hi]
+                                                if entities[i]['end'] >= segment_start - proximity)]
+
+        def key(segment_start, segment_end):
+            window_start, window_end = window(segment_start, segment_end)
+            related = [(entity['start'] - window_start, entity['end'] - window_start, entity['type'], entity['text'])
+                       for entity in nearby(segment_start, window_end)]
+            return segment_key(text[window_start:window_end], 'events',
+                               segment_start - window_start, segment_end - window_start, related)
+
+        def compute(bounds):
+            window_start, window_end = window(bounds[0], bounds[-1])
+            related = [dict(entity, start=entity['start'] - window_start, end=entity['end'] - window_start)
+                       for entity in nearby(bounds[0], window_end)]
+            segments = [[] for _ in range(len(bounds) - 1)]
+            for event in self._detect_events(text[window_start:window_end], related, context=False):
+                event_start = event['start'] + window_start
+                if bounds[0] <= event_start < bounds[-1]:
+                    segment = bisect_right(bounds, event_start) - 1
+                    segments[segment].append((
+                        event_start - bounds[segment], event['end'] + window_start - bounds[segment],
+                        event['type'], event['attributes'], event['confidence']))
+            return segments
+
+        bounds = segment_bounds(text, start, end)
+        events = []
+        for segment_start, segment in zip(bounds, self.segment_cache.cached(bounds, key, compute)):
+            for relative_start, relative_end, event_type, attributes, confidence in segment:
+                event_start, event_end = segment_start + relative_start, segment_start + relative_end
+                event = {
+                    'type': event_type,
+                    'trigger': text[event_start:event_end],
+                    'start': event_start,
+                    'end': event_end,
+                    'attributes': {name: list(values) for name, values in attributes.items()},
+                    'confidence': confidence
+                }
+                if context:
+                    event['context'] = self._extract_context(text, event_start, event_end)
+                events.append(event)
+        return events
+    
+    def extract_batch(self, texts: List[str], entities: List[List[Dict]] = None,
+                      workers: int = None) -> List[Dict]:
+        # One {'events': [...]} or {'error': ...} per text, in input order;
+        # entities, when given, holds one entity list per text
+        if entities is None:
+            entities = [None] * len(texts)
+        payloads = [{'text': text, 'entities': doc_entities} for text, doc_entities in zip(texts, entities)]
+        return run_batch('events', payloads, self.config_path, workers, (None, self))
+    
     def _extract_context(self, text: str, start: int, end: int, window: int = 100) -> str:
         context_start = max(0, start - window)
         context_end = min(len(text), end + window)
         return text[context_start:context_end].strip()
     
+    def _attribute_spans(self, text: str) -> Dict[str, PatternSpanIndex]:
+        # Dates, times and locations are matched once per document; each event then
+        # reads the matches inside its own window
+        return {
+            'date': PatternSpanIndex(self.compiled_date_patterns, text),
+            'time': PatternSpanIndex(self.compiled_time_patterns, text),
+            'location': PatternSpanIndex(self.compiled_location_patterns, text)
+        }
+    
     def _extract_event_attributes(self, text: str, start: int, end: int, 
-                                attributes: List[str], entities: List[Dict]) -> Dict:
+                                attributes: List[str], entity_index: EntitySpanIndex,
+                                attribute_spans: Dict[str, PatternSpanIndex] = None) -> Dict:
         extracted_attributes = {}
+        if attribute_spans is None:
+            attribute_spans = self._attribute_spans(text)
         
         context_window = 150
         context_start = max(0, start - context_window)
         context_end = min(len(text), end + context_window)
-        context = text[context_start:context_end]
         
         for attr in attributes:
             if attr == 'date':
-                date_info = self._extract_dates(context)
+                date_info = attribute_spans['date'].values_within(context_start, context_end)
                 if date_info:
                     extracted_attributes['date'] = date_info
             
             elif attr == 'time':
-                time_info = self._extract_times(context)
+                time_info = attribute_spans['time'].values_within(context_start, context_end)
                 if time_info:
                     extracted_attributes['time'] = time_info
             
             elif attr == 'patient':
-                patient_info = self._find_related_entities(entities, 'PATIENT', start, end)
+                patient_info = self._find_related_entities(entity_index, 'PATIENT', start, end)
                 if patient_info:
                     extracted_attributes['patient'] = patient_info
             
             elif attr == 'medication':
-                med_info = self._find_related_entities(entities, 'MEDICATION', start, end)
+                med_info = self._find_related_entities(entity_index, 'MEDICATION', start, end)
                 if med_info:
                     extracted_attributes['medication'] = med_info
             
             elif attr == 'disease':
-                disease_info = self._find_related_entities(entities, 'DISEASE', start, end)
+                disease_info = self._find_related_entities(entity_index, 'DISEASE', start, end)
                 if disease_info:
                     extracted_attributes['disease'] = disease_info
             
             elif attr == 'treatment' or attr == 'procedure':
-                treatment_info = self._find_related_entities(entities, 'TREATMENT', start, end)
+                treatment_info = self._find_related_entities(entity_index, 'TREATMENT', start, end)
                 if treatment_info:
                     extracted_attributes[attr] = treatment_info
             
             elif attr == 'dosage':
-                dosage_info = self._find_related_entities(entities, 'DOSAGE', start, end)
+                dosage_info = self._find_related_entities(entity_index, 'DOSAGE', start, end)
                 if dosage_info:
                     extracted_attributes['dosage'] = dosage_info
             
             elif attr == 'hospital' or attr == 'location':
-                location_info = self._extract_locations(context)
+                location_info = attribute_spans['location'].values_within(context_start, context_end)
                 if location_info:
                     extracted_attributes[attr] = location_info
         
@@ -120,49 +298,30 @@ class HealthcareEventExtractor:
     
     def _extract_dates(self, text: str) -> List[str]:
         dates = []
-        for pattern in self.date_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            dates.extend(matches)
+        for pattern in self.compiled_date_patterns:
+            dates.extend(pattern.findall(text))
         return dates
     
     def _extract_times(self, text: str) -> List[str]:
         times = []
-        for pattern in self.time_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            times.extend(matches)
+        for pattern in self.compiled_time_patterns:
+            times.extend(pattern.findall(text))
         return times
     
-    def _find_related_entities(self, entities: List[Dict], entity_type: str, 
-                             event_start: int, event_end: int, proximity: int = 200) -> List[str]:
-        related = []
-        for entity in entities:
-            if entity['type'] == entity_type:
-                distance = min(
-                    abs(entity['start'] - event_end),
-                    abs(entity['end'] - event_start)
-                )
-                if distance <= proximity:
-                    related.append(entity['text'])
-        return related
+    def _find_related_entities(self, entity_index: EntitySpanIndex, entity_type: str, 
+                             event_start: int, event_end: int, proximity: int = RELATED_ENTITY_PROXIMITY) -> List[str]:
+        return [entity['text'] for entity in entity_index.near(entity_type, event_start, event_end, proximity)]
     
     def _extract_locations(self, text: str) -> List[str]:
-        location_patterns = [
-            r'\b\w+\s+hospital\b',
-            r'\b\w+\s+medical\s+center\b',
-            r'\b\w+\s+clinic\b',
-            r'\bemergency\s+room\b',
-            r'\ber\b',
-            r'\bicu\b',
-            r'\bintensive\s+care\s+unit\b'
-        ]
-        
         locations = []
-        for pattern in location_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            locations.extend(matches)
+        for pattern in self.compiled_location_patterns:
+            locations.extend(pattern.findall(text))
         return locations
     
-    def get_event_timeline(self, events: List[Dict]) -> List[Dict]:
+    def get_event_timeline(self, events: List[Dict], text: str = None) -> List[Dict]:
+        # Events with a date attribute, in calendar order of the date nearest each event
+        # (read from text around the event when given, else from its context); events
+        # whose date cannot be read go last in the order found
         timeline = []
         for event in events:
             if 'date' in event['attributes']:
@@ -172,8 +331,9 @@ class HealthcareEventExtractor:
                     'type': event['type']
                 })
         
-        timeline.sort(key=lambda x: x.get('date', ''))
-        return timeline
+        dated = [event_date(entry['event'], text=text) for entry in timeline]
+        order = sorted(range(len(timeline)), key=lambda i: (dated[i] is None, dated[i][0] if dated[i] else date.min))
+        return [timeline[i] for i in order]
     
     def get_event_statistics(self, events: List[Dict]) -> Dict:
         stats = {}
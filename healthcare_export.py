@@ -0,0 +1,191 @@
+import io
+import csv
+import json
+from datetime import datetime
+from typing import List, Dict, Tuple, Iterator, Iterable, Optional
+
+# Pieces of output are gathered into blocks of about this many characters before
+# they are handed to the response, so a large export is neither one huge string
+# nor thousands of tiny writes
+EXPORT_BLOCK_SIZE = 64 * 1024
+PARQUET_ROW_GROUP_SIZE = 50000
+
+CSV_HEADER = ['Type', 'Category', 'Text', 'Start', 'End', 'Confidence', 'Attributes']
+
+EXPORT_FORMATS = {
+    'json': ('application/json', 'json'),
+    'csv': ('text/csv', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet')
+}
+
+# (document index or None, entities, events)
+ExportDocument = Tuple[Optional[int], List[Dict], List[Dict]]
+
+
+def export_documents(result: Dict) -> List[ExportDocument]:
+    # A single extraction result, or a batch result holding one per document
+    if 'results' in result:
+        return [
+            (document.get('index', index), document.get('entities', []), document.get('events', []))
+            for index, document in enumerate(result['results'])
+        ]
+    return [(None, result.get('entities', []), result.get('events', []))]
+
+
+def _blocks(pieces: Iterable[str]) -> Iterator[bytes]:
+    block = []
+    size = 0
+    for piece in pieces:
+        block.append(piece)
+        size += len(piece)
+        if size >= EXPORT_BLOCK_SIZE:
+            yield ''.join(block).encode('utf-8')
+            block = []
+            size = 0
+    if block:
+        yield ''.join(block).encode('utf-8')
+
+
+def _tagged(items: List[Dict], document: Optional[int]) -> Iterator[Dict]:
+    for item in items:
+        yield item if document is None else dict(item, document=document)
+
+
+def export_rows(documents: List[ExportDocument]) -> Iterator[Tuple]:
+    # (document, kind, category, text, start, end, confidence, attributes) per entity and event
+    for document, entities, events in documents:
+        for entity in entities:
+            yield (document, 'Entity', entity.get('type', ''), entity.get('text', ''), entity.get('start', ''),
+                   entity.get('end', ''), entity.get('confidence', ''), '')
+        for event in events:
+            yield (document, 'Event', event.get('type', ''), event.get('trigger', ''), event.get('start', ''),
+                   event.get('end', ''), event.get('confidence', ''), json.dumps(event.get('attributes', {})))
+
+
+def iter_json(documents: List[ExportDocument]) -> Iterator[bytes]:
+    # Byte for byte what json.dump(..., indent=2) wrote for the whole export, built
+    # one entity or event at a time
+    def pieces():
+        yield '{'
+        for position, key in enumerate(('entities', 'events')):
+            yield (',' if position else '') + f'\n  "{key}": ['
+            empty = True
+            for document, entities, events in documents:
+                for item in _tagged(entities if key == 'entities' else events, document):
+                    # JSON strings never hold a raw newline, so every newline is structure
+                    yield ('' if empty else ',') + '\n    ' + json.dumps(item, indent=2).replace('\n', '\n    ')
+                    empty = False
+            yield ']' if empty else '\n  ]'
+        yield f',\n  "exported_at": {json.dumps(datetime.now().isoformat())}\n}}'
+
+    return _blocks(pieces())
+
+
+def iter_csv(documents: List[ExportDocument]) -> Iterator[bytes]:
+    # Batch results get a trailing Document column
+    with_document = any(document is not None for document, _, _ in documents)
+
+    def lines():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(CSV_HEADER + ['Document'] if with_document else CSV_HEADER)
+        for row in export_rows(documents):
+            writer.writerow(row[1:] + row[:1] if with_document else row[1:])
+            if buffer.tell() >= EXPORT_BLOCK_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return _blocks(lines())
+
+
+def iter_ndjson(documents: List[ExportDocument]) -> Iterator[bytes]:
+    # One compact JSON object per line, entities first, each tagged with its kind
+    def lines():
+        for document, entities, events in documents:
+            for kind, items in (('entity', entities), ('event', events)):
+                for item in _tagged(items, document):
+                    yield json.dumps(dict(item, kind=kind), separators=(',', ':')) + '\n'
+
+    return _blocks(lines())
+
+
+class _ChunkSink(io.RawIOBase):
+    # Write target that keeps only what was written since it was last drained
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_parquet(documents: List[ExportDocument]) -> Iterator[bytes]:
+    # Rows are written one row group at a time and each group is sent as soon as it
+    # is encoded. Requires pyarrow, the engine pandas itself uses for Parquet; the
+    # import happens before any output so a missing engine is reported up front.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('document', pa.int64()), ('kind', pa.string()), ('type', pa.string()), ('text', pa.string()),
+        ('start', pa.int64()), ('end', pa.int64()), ('confidence', pa.float64()), ('attributes', pa.string())
+    ])
+
+    def row_groups():
+        group = {name: [] for name in schema.names}
+        for document, kind, category, text, start, end, confidence, attributes in export_rows(documents):
+            group['document'].append(document)
+            group['kind'].append(kind.lower())
+            group['type'].append(category)
+            group['text'].append(text)
+            group['start'].append(None if start == '' else start)
+            group['end'].append(None if end == '' else end)
+            group['confidence'].append(None if confidence == '' else confidence)
+            group['attributes'].append(attributes or None)
+            if len(group['kind']) >= PARQUET_ROW_GROUP_SIZE:
+                yield group
+                group = {name: [] for name in schema.names}
+        if group['kind']:
+            yield group
+
+    def chunks():
+        sink = _ChunkSink()
+        writer = pq.ParquetWriter(sink, schema)
+        try:
+            for group in row_groups():
+                writer.write_table(pa.Table.from_pydict(group, schema=schema))
+                yield sink.drain()
+        finally:
+            writer.close()
+        yield sink.drain()
+
+    return chunks()
+
+
+def iter_export(format_type: str, documents: List[ExportDocument]) -> Iterator[bytes]:
+    if format_type == 'json':
+        return iter_json(documents)
+    if format_type == 'csv':
+        return iter_csv(documents)
+    if format_type == 'ndjson':
+        return iter_ndjson(documents)
+    if format_type == 'parquet':
+        return iter_parquet(documents)
+    raise ValueError(f'Unsupported export format: {format_type}')
@@ -0,0 +1,247 @@
+import threading
+from itertools import compress
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import List, Dict, Tuple, Optional
+from healthcare_chunking import CHUNK_SIZE, CHUNK_OVERLAP, plan_chunks
+from healthcare_span_index import EntitySpanIndex
+from healthcare_event_extractor import RELATED_ENTITY_PROXIMITY
+
+
+class DocumentState:
+    # Everything needed to update a document's result after an edit: the text, every
+    # entity candidate in sweep order with a flag for those overlap removal kept, the
+    # entities that passed the confidence filter, and the events
+    __slots__ = ('text', 'selected_types', 'min_confidence', 'rules_version',
+                 'candidates', 'candidate_starts', 'kept_flags', 'entities', 'events')
+
+    def __init__(self, text: str, selected_types: List[str], min_confidence: float, rules_version: str,
+                 candidates: List[Dict], kept_flags: bytearray, entities: List[Dict], events: List[Dict]):
+        self.text = text
+        self.selected_types = selected_types
+        self.min_confidence = min_confidence
+        self.rules_version = rules_version
+        self.candidates = candidates
+        self.candidate_starts = [candidate['start'] for candidate in candidates]
+        self.kept_flags = kept_flags
+        self.entities = entities
+        self.events = events
+
+    def matches(self, selected_types: List[str], min_confidence: float, rules_version: str) -> bool:
+        return (self.selected_types, self.min_confidence, self.rules_version) == \
+            (selected_types, min_confidence, rules_version)
+
+
+def apply_edits(text: str, edits: List[Dict]) -> Tuple[str, int, int, int]:
+    # Edits are {'start', 'end', 'text'} replacements in the coordinates of the old
+    # text and must not overlap. Returns the new text and the changed region as
+    # (start, end in the old text, end in the new text).
+    if not edits:
+        return text, 0, 0, 0
+    spans = sorted(((int(edit['start']), int(edit['end']), edit.get('text', '')) for edit in edits),
+                   key=lambda span: span[:2])
+    pieces = []
+    position = 0
+    for start, end, inserted in spans:
+        if not position <= start <= end <= len(text):
+            raise ValueError('Edits must lie within the text and must not overlap')
+        pieces.append(text[position:start])
+        pieces.append(inserted)
+        position = end
+    pieces.append(text[position:])
+    new_text = ''.join(pieces)
+    start, old_end = spans[0][0], spans[-1][1]
+    return new_text, start, old_end, old_end + len(new_text) - len(text)
+
+
+def changed_region(old: str, new: str) -> Tuple[int, int, int]:
+    # The smallest region outside of which both texts are equal, as
+    # (start, end in old, end in new). Slices are compared by bisection, so the
+    # characters are compared in C rather than one at a time.
+    limit = min(len(old), len(new))
+    lo, hi = 0, limit
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[:mid] == new[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    prefix = lo
+    lo, hi = 0, limit - prefix
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if old[len(old) - mid:] == new[len(new) - mid:]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return prefix, len(old) - lo, len(new) - lo
+
+
+def _shifted(items: List[Dict], shift: int) -> List[Dict]:
+    if not shift:
+        return list(items)
+    return [dict(item, start=item['start'] + shift, end=item['end'] + shift) for item in items]
+
+
+class IncrementalExtractor:
+    # Re-extracts only the part of a document an edit can affect. Candidates are
+    # local: those starting at a position depend on at most CHUNK_OVERLAP characters
+    # on either side (the same property chunked extraction relies on), so candidates
+    # far enough from the edit are reused with shifted offsets. Overlap removal is
+    # resumed until it agrees with the previous result again, and events are redone
+    # around both the edited text and every entity that changed.
+    def __init__(self, entity_extractor, event_extractor, chunk_size: int = CHUNK_SIZE,
+                 margin: int = CHUNK_OVERLAP):
+        self.entity_extractor = entity_extractor
+        self.event_extractor = event_extractor
+        self.chunk_size = chunk_size
+        self.margin = margin
+
+    def _candidates(self, text: str, start: int, end: int, selected_types: List[str]) -> List[Dict]:
+        # Candidates starting in [start, end), in sweep order
+        window_start = max(0, start - self.margin)
+        if window_start > 0:
+            window_start = self.entity_extractor.tokenizer.unit_boundary_before(text, window_start)
+        window_end = min(len(text), end + self.margin)
+        candidates = self.entity_extractor._chunk_candidates(text[window_start:window_end], window_start,
+                                                             start, end, selected_types)
+        return [candidates[i] for i in EntitySpanIndex(candidates).ordered]
+
+    def _events(self, text: str, start: int, end: int, entities: List[Dict]) -> List[Dict]:
+        # Events starting in [start, end), given the document's filtered entities
+        window_start = max(0, start - self.margin)
+        window_end = min(len(text), end + self.margin)
+        proximity = RELATED_ENTITY_PROXIMITY
+        longest = max((entity['end'] - entity['start'] for entity in entities), default=0)
+        starts = [entity['start'] for entity in entities]
+        lo = bisect_left(starts, start - proximity - longest)
+        hi = bisect_left(starts, window_end + proximity + 1)
+        nearby = [
+            dict(entity, start=entity['start'] - window_start, end=entity['end'] - window_start)
+            for entity in entities[lo:hi] if entity['end'] >= start - proximity
+        ]
+        return self.event_extractor._chunk_events(text[window_start:window_end], window_start, start, end, nearby)
+
+    def extract(self, text: str, selected_types: List[str], min_confidence: float,
+                rules_version: str) -> DocumentState:
+        candidates = []
+        for chunk in plan_chunks(text, self.chunk_size, self.margin,
+                                 align=self.entity_extractor.tokenizer.unit_boundary_before):
+            candidates.extend(self.entity_extractor._chunk_candidates(
+                text[chunk.window_start:chunk.window_end], chunk.window_start, chunk.start, chunk.end,
+                selected_types))
+        candidates = [candidates[i] for i in EntitySpanIndex(candidates).ordered]
+        kept = EntitySpanIndex(candidates).non_overlapping()
+        kept_ids = {id(entity) for entity in kept}
+        kept_flags = bytearray(id(candidate) in kept_ids for candidate in candidates)
+        entities = self.entity_extractor.filter_entities_by_confidence(kept, min_confidence)
+        if len(text) > self.chunk_size:
+            events = self.event_extractor.extract_events_chunked(text, entities, self.chunk_size)
+        else:
+            events = self.event_extractor.extract_events(text, entities)
+        return DocumentState(text, selected_types, min_confidence, rules_version, candidates, kept_flags,
+                             entities, events)
+
+    def update(self, state: DocumentState, text: str, start: int, old_end: int, new_end: int) -> DocumentState:
+        # text is state.text with [start, old_end) replaced by text[start:new_end]
+        margin = self.margin
+        shift = new_end - old_end
+
+        # Candidates starting in [lo, hi) are found again. hi is pushed out until the
+        # token boundary a window starting there would align to lies clear of the edit.
+        lo = max(0, start - margin)
+        hi = new_end + 3 * margin
+        while hi < len(text) and \
+                self.entity_extractor.tokenizer.unit_boundary_before(text, hi - margin) < new_end + margin:
+            hi += margin
+        hi = min(hi, len(text))
+        old_starts = state.candidate_starts
+        head = bisect_left(old_starts, lo)
+        tail = bisect_left(old_starts, hi - shift)
+        fresh = self._candidates(text, lo, hi, state.selected_types)
+        candidates = state.candidates[:head] + fresh + _shifted(state.candidates[tail:], shift)
+
+        # Overlap removal resumes at lo from the last span kept before it, with the
+        # rule of EntitySpanIndex.non_overlapping. Past hi both sweeps see the same
+        # candidates, so once they keep the same span they agree on everything after.
+        kept_flags = state.kept_flags[:head]
+        last_start, last_end = 0, 0
+        for i in range(head - 1, -1, -1):
+            candidate = candidates[i]
+            if kept_flags[i] and candidate['end'] > candidate['start']:
+                last_start, last_end = candidate['start'], candidate['end']
+                break
+        tail_offset = tail - head - len(fresh)
+        changed_end = len(text)
+        for i in range(head, len(candidates)):
+            candidate = candidates[i]
+            keep = not (candidate['start'] < last_end and candidate['end'] > last_start)
+            kept_flags.append(keep)
+            if keep and candidate['end'] > candidate['start']:
+                last_start, last_end = candidate['start'], candidate['end']
+                if i >= head + len(fresh) and state.kept_flags[i + tail_offset]:
+                    kept_flags += state.kept_flags[i + tail_offset + 1:]
+                    changed_end = candidate['start']
+                    break
+        # Entities that may differ from the previous result all end before changed_end
+        changed_end = max(hi, changed_end)
+        entities = self.entity_extractor.filter_entities_by_confidence(
+            list(compress(candidates, kept_flags)), state.min_confidence)
+
+        # Events near the edit or near any entity that changed are detected again
+        event_lo = max(0, lo - margin)
+        event_hi = min(len(text), changed_end + margin)
+        old_starts = [event['start'] for event in state.events]
+        events = (state.events[:bisect_left(old_starts, event_lo)] +
+                  self._events(text, event_lo, event_hi, entities) +
+                  _shifted(state.events[bisect_left(old_starts, event_hi - shift):], shift))
+        return DocumentState(text, state.selected_types, state.min_confidence, state.rules_version,
+                             candidates, kept_flags, entities, events)
+
+    def result(self, state: DocumentState) -> Dict:
+        # Same shape as extract_document's result
+        return {
+            'entities': state.entities,
+            'events': state.events,
+            'statistics': {
+                'entities': self.entity_extractor.get_entity_statistics(state.entities),
+                'events': self.event_extractor.get_event_statistics(state.events),
+                'total_entities': len(state.entities),
+                'total_events': len(state.events)
+            }
+        }
+
+
+class DocumentStateStore:
+    # Least recently used document states, bounded by count and total text size.
+    # States are kept in memory as they are: a process only updates documents it
+    # extracted itself.
+    def __init__(self, max_entries: int = 256, max_chars: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._states: OrderedDict = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[DocumentState]:
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                self._states.move_to_end(key)
+            return state
+
+    def put(self, key: str, state: DocumentState):
+        with self._lock:
+            previous = self._states.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous.text)
+            self._states[key] = state
+            self._size += len(state.text)
+            while len(self._states) > self.max_entries or (self._size > self.max_chars and len(self._states) > 1):
+                _, evicted = self._states.popitem(last=False)
+                self._size -= len(evicted.text)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'entries': len(self._states), 'chars': self._size,
+                    'max_entries': self.max_entries, 'max_chars': self.max_chars}
@@ -0,0 +1,297 @@
+import os
+import time
+import sqlite3
+import threading
+from datetime import date
+from typing import List, Dict, Tuple, Iterable, Optional
+from healthcare_dates import event_date
+
+# Documents written per transaction when loading many at once
+INDEX_BATCH_SIZE = 1000
+SEARCH_LIMIT = 50
+TIMELINE_LIMIT = 200
+
+
+def normalize_text(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+
+class DocumentIndex:
+    # On-disk index of extraction results, answering corpus-wide questions without
+    # extracting again. Entity texts are normalized and kept once in a term table;
+    # the entity table is a posting list of (term, document, offsets), and events are
+    # stored with the date nearest their trigger as a day ordinal, so "MEDICATION
+    # warfarin near a DISCHARGE in March" is a few index range scans.
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        # Term ids only ever get added, so a per-process cache stays valid
+        self._term_ids: Dict[Tuple[str, str], int] = {}
+        with self._connect() as db:
+            db.executescript('''
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    key TEXT NOT NULL UNIQUE,
+                    indexed_at REAL NOT NULL,
+                    entity_count INTEGER NOT NULL,
+                    event_count INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS terms (
+                    id INTEGER PRIMARY KEY,
+                    type TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    UNIQUE (type, text)
+                );
+                CREATE INDEX IF NOT EXISTS terms_text ON terms (text);
+                CREATE TABLE IF NOT EXISTS entities (
+                    term_id INTEGER NOT NULL,
+                    doc_id INTEGER NOT NULL,
+                    start INTEGER NOT NULL,
+                    end INTEGER NOT NULL,
+                    confidence REAL
+                );
+                CREATE INDEX IF NOT EXISTS entities_term ON entities (term_id, doc_id, start);
+                CREATE INDEX IF NOT EXISTS entities_doc ON entities (doc_id);
+                CREATE TABLE IF NOT EXISTS events (
+                    doc_id INTEGER NOT NULL,
+                    type TEXT NOT NULL,
+                    trigger TEXT NOT NULL,
+                    start INTEGER NOT NULL,
+                    end INTEGER NOT NULL,
+                    date INTEGER,
+                    date_text TEXT,
+                    confidence REAL
+                );
+                CREATE INDEX IF NOT EXISTS events_doc ON events (doc_id, start);
+                CREATE INDEX IF NOT EXISTS events_type_date ON events (type, date, doc_id);
+                CREATE INDEX IF NOT EXISTS events_date ON events (date);
+            ''')
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread and process; connections never cross a fork
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            # Keeps the statistics PRAGMA optimize gathers cheap on large indexes
+            db.execute('PRAGMA analysis_limit=1000')
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def _term_id(self, db: sqlite3.Connection, entity_type: str, text: str) -> int:
+        key = (entity_type, text)
+        term_id = self._term_ids.get(key)
+        if term_id is None:
+            db.execute('INSERT OR IGNORE INTO terms (type, text) VALUES (?, ?)', key)
+            term_id = db.execute('SELECT id FROM terms WHERE type = ? AND text = ?', key).fetchone()[0]
+            self._term_ids[key] = term_id
+        return term_id
+
+    def add(self, key: str, result: Dict, reference: Optional[date] = None):
+        self.add_many([(key, result, reference)])
+
+    def add_many(self, documents: Iterable[Tuple[str, Dict, Optional[date]]]) -> int:
+        # (key, extraction result, date the note was written or None) per document.
+        # A document indexed again replaces its earlier postings.
+        count = 0
+        batch = []
+        for document in documents:
+            batch.append(document)
+            if len(batch) >= INDEX_BATCH_SIZE:
+                count += self._write(batch)
+                batch = []
+        if batch:
+            count += self._write(batch)
+        # Refreshes the planner statistics once the tables have grown enough to need it
+        self._connect().execute('PRAGMA optimize')
+        return count
+
+    def _write(self, documents: List[Tuple[str, Dict, Optional[date]]]) -> int:
+        try:
+            self._insert(documents)
+        except Exception:
+            # Terms created by a rolled back transaction no longer exist
+            self._term_ids.clear()
+            raise
+        return len(documents)
+
+    def _insert(self, documents: List[Tuple[str, Dict, Optional[date]]]):
+        with self._connect() as db:
+            for key, result, reference in documents:
+                entities = result.get('entities', [])
+                events = result.get('events')
+                # Event dates are read from the context strings; a result extracted without
+                # them would be indexed with every date missing
+                if events is None or any('context' not in event for event in events):
+                    raise ValueError(f'Result for {key} has no events with context; '
+                                     f'extract it with the events and context fields to index it')
+                self._delete(db, key)
+                doc_id = db.execute(
+                    'INSERT INTO documents (key, indexed_at, entity_count, event_count) VALUES (?, ?, ?, ?)',
+                    (key, time.time(), len(entities), len(events))).lastrowid
+
+                db.executemany('INSERT INTO entities (term_id, doc_id, start, end, confidence) '
+                               'VALUES (?, ?, ?, ?, ?)', [
+                    (self._term_id(db, entity['type'], normalize_text(entity['text'])), doc_id,
+                     entity['start'], entity['end'], entity.get('confidence'))
+                    for entity in entities
+                ])
+                event_rows = []
+                for event in events:
+                    dated = event_date(event, reference)
+                    event_rows.append((doc_id, event['type'], event['trigger'], event['start'], event['end'],
+                                       dated[0].toordinal() if dated else None, dated[1] if dated else None,
+                                       event.get('confidence')))
+                db.executemany('INSERT INTO events (doc_id, type, trigger, start, end, date, date_text, confidence) '
+                               'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', event_rows)
+
+    @staticmethod
+    def _delete(db: sqlite3.Connection, key: str) -> bool:
+        row = db.execute('SELECT id FROM documents WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return False
+        db.execute('DELETE FROM entities WHERE doc_id = ?', row)
+        db.execute('DELETE FROM events WHERE doc_id = ?', row)
+        db.execute('DELETE FROM documents WHERE id = ?', row)
+        return True
+
+    def remove(self, key: str) -> bool:
+        with self._connect() as db:
+            return self._delete(db, key)
+
+    @staticmethod
+    def _terms(db: sqlite3.Connection, entity_type: Optional[str], entity: Optional[str]) -> Dict[int, Tuple[str, str]]:
+        # Term id -> (type, normalized text) of the terms an entity filter matches
+        conditions, params = [], []
+        if entity_type is not None:
+            conditions.append('type = ?')
+            params.append(entity_type)
+        if entity is not None:
+            conditions.append('text = ?')
+            params.append(normalize_text(entity))
+        rows = db.execute(f'SELECT id, type, text FROM terms WHERE {" AND ".join(conditions)}', params)
+        return {row[0]: (row[1], row[2]) for row in rows}
+
+    @staticmethod
+    def _date_range(conditions: List[str], params: List, column: str,
+                    date_from: Optional[date], date_to: Optional[date]):
+        if date_from is not None:
+            conditions.append(f'{column} >= ?')
+            params.append(date_from.toordinal())
+        if date_to is not None:
+            conditions.append(f'{column} <= ?')
+            params.append(date_to.toordinal())
+
+    def search(self, entity_type: Optional[str] = None, entity: Optional[str] = None,
+               event_type: Optional[str] = None, date_from: Optional[date] = None, date_to: Optional[date] = None,
+               near: Optional[int] = None, after: int = 0, limit: int = SEARCH_LIMIT) -> Dict:
+        # Documents with a matching entity, a matching event, or both - within near
+        # characters of each other when near is given. Pages are taken in document
+        # order: pass the returned next_after to continue.
+        has_entity = entity_type is not None or entity is not None
+        has_event = event_type is not None or date_from is not None or date_to is not None
+        if not has_entity and not has_event:
+            raise ValueError('Give an entity, an entity type, an event type or a date range')
+
+        db = self._connect()
+        tables, conditions, params = [], [], []
+        columns = []
+        if has_entity:
+            terms = self._terms(db, entity_type, entity)
+            if not terms:
+                return {'documents': [], 'next_after': None}
+            tables.append('entities e')
+            conditions.append(f'e.term_id IN ({",".join("?" * len(terms))})')
+            params.extend(terms)
+            columns.append('e.term_id, e.start, e.end, e.confidence')
+        if has_event:
+            if has_entity:
+                join = 'JOIN events v ON v.doc_id = e.doc_id'
+                if near is not None:
+                    join += ' AND v.start <= e.end + ? AND v.end >= e.start - ?'
+                    params[:0] = [near, near]
+                tables.append(join)
+            else:
+                tables.append('events v')
+            if event_type is not None:
+                conditions.append('v.type = ?')
+                params.append(event_type)
+            self._date_range(conditions, params, 'v.date', date_from, date_to)
+            columns.append('v.type, v.trigger, v.start, v.end, v.date, v.date_text')
+        doc_column = 'e.doc_id' if has_entity else 'v.doc_id'
+        source = ' '.join(tables)
+        where = ' AND '.join(conditions) if conditions else '1'
+
+        doc_ids = [row[0] for row in db.execute(
+            f'SELECT DISTINCT {doc_column} FROM {source} WHERE {where} AND {doc_column} > ? '
+            f'ORDER BY {doc_column} LIMIT ?', (*params, after, limit))]
+        if not doc_ids:
+            return {'documents': [], 'next_after': None}
+
+        placeholders = ','.join('?' * len(doc_ids))
+        rows = db.execute(
+            f'SELECT {doc_column}, {", ".join(columns)} FROM {source} '
+            f'WHERE {where} AND {doc_column} IN ({placeholders}) ORDER BY {doc_column}', (*params, *doc_ids))
+        keys = dict(db.execute(f'SELECT id, key FROM documents WHERE id IN ({placeholders})', doc_ids).fetchall())
+
+        documents: Dict[int, Dict] = {}
+        for row in rows:
+            document = documents.setdefault(row[0], {'document': keys[row[0]], 'entities': [], 'events': []})
+            values = row[1:]
+            if has_entity:
+                entity_type, text = terms[values[0]]
+                item = {'type': entity_type, 'text': text, 'start': values[1], 'end': values[2],
+                        'confidence': values[3]}
+                if item not in document['entities']:
+                    document['entities'].append(item)
+                values = values[4:]
+            if has_event:
+                item = {'type': values[0], 'trigger': values[1], 'start': values[2], 'end': values[3],
+                        'date': date.fromordinal(values[4]).isoformat() if values[4] else None,
+                        'date_text': values[5]}
+                if item not in document['events']:
+                    document['events'].append(item)
+        return {
+            'documents': [documents[doc_id] for doc_id in doc_ids],
+            'next_after': doc_ids[-1] if len(doc_ids) == limit else None
+        }
+
+    def timeline(self, document: Optional[str] = None, event_type: Optional[str] = None,
+                 entity_type: Optional[str] = None, entity: Optional[str] = None,
+                 date_from: Optional[date] = None, date_to: Optional[date] = None,
+                 offset: int = 0, limit: int = TIMELINE_LIMIT) -> List[Dict]:
+        # Dated events in calendar order, optionally for one document, one event type,
+        # or the documents mentioning an entity
+        db = self._connect()
+        conditions, params = ['v.date IS NOT NULL'], []
+        if document is not None:
+            conditions.append('d.key = ?')
+            params.append(document)
+        if event_type is not None:
+            conditions.append('v.type = ?')
+            params.append(event_type)
+        self._date_range(conditions, params, 'v.date', date_from, date_to)
+        if entity_type is not None or entity is not None:
+            terms = self._terms(db, entity_type, entity)
+            if not terms:
+                return []
+            conditions.append('EXISTS (SELECT 1 FROM entities e WHERE e.doc_id = v.doc_id AND '
+                              f'e.term_id IN ({",".join("?" * len(terms))}))')
+            params.extend(terms)
+        rows = db.execute(
+            'SELECT d.key, v.type, v.trigger, v.start, v.end, v.date, v.date_text FROM events v '
+            f'JOIN documents d ON d.id = v.doc_id WHERE {" AND ".join(conditions)} '
+            'ORDER BY v.date, v.doc_id, v.start LIMIT ? OFFSET ?', (*params, limit, offset))
+        return [
+            {'date': date.fromordinal(row[5]).isoformat(), 'document': row[0], 'type': row[1], 'trigger': row[2],
+             'start': row[3], 'end': row[4], 'date_text': row[6]}
+            for row in rows
+        ]
+
+    def stats(self) -> Dict:
+        db = self._connect()
+        return {
+            'documents': db.execute('SELECT COUNT(*) FROM documents').fetchone()[0],
+            'terms': db.execute('SELECT COUNT(*) FROM terms').fetchone()[0]
+        }
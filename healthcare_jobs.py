@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Callable, Optional
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Finished jobs are kept this long (seconds) before they are purged
+JOB_RETENTION = 24 * 60 * 60
+
+LOST_JOB_ERROR = 'The process running the job exited before it finished'
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def _process_alive(pid: int) -> bool:
+    if os.name != 'posix':
+        # Signal 0 only probes on POSIX; elsewhere the owner is assumed alive
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobStore:
+    # Job state lives in SQLite so any worker process can answer a status poll,
+    # whichever process is running the job. Each job records the process (pid and
+    # host) running it; a queued or running job whose process has exited is marked
+    # failed when it is next read or purged.
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._host = socket.gethostname()
+        # Unfinished jobs this process created; an unfinished row naming this pid but
+        # missing here was left by an earlier process that had the same pid
+        self._active = set()
+        with self._connect() as db:
+            db.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                done INTEGER NOT NULL DEFAULT 0,
+                total INTEGER NOT NULL DEFAULT 1,
+                result TEXT,
+                error TEXT,
+                pid INTEGER,
+                host TEXT
+            )''')
+            # Tables from before jobs recorded their process have no owner columns
+            columns = [row[1] for row in db.execute('PRAGMA table_info(jobs)')]
+            if 'pid' not in columns:
+                db.execute('ALTER TABLE jobs ADD COLUMN pid INTEGER')
+                db.execute('ALTER TABLE jobs ADD COLUMN host TEXT')
+
+    def _connect(self) -> sqlite3.Connection:
+        # One connection per thread and process; connections never cross a fork
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.db_path, timeout=30)
+            db.execute('PRAGMA journal_mode=WAL')
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def create(self, total: int = 1) -> str:
+        job_id = uuid.uuid4().hex
+        self._active.add(job_id)
+        with self._connect() as db:
+            db.execute('INSERT INTO jobs (id, status, created_at, total, pid, host) VALUES (?, ?, ?, ?, ?, ?)',
+                       (job_id, QUEUED, time.time(), total, os.getpid(), self._host))
+        return job_id
+
+    def update(self, job_id: str, **fields):
+        # A result given as a string is already serialized JSON
+        if 'result' in fields and not isinstance(fields['result'], str):
+            fields['result'] = json.dumps(fields['result'])
+        columns = ', '.join(f'{name} = ?' for name in fields)
+        with self._connect() as db:
+            db.execute(f'UPDATE jobs SET {columns} WHERE id = ?', (*fields.values(), job_id))
+        if fields.get('status') in (DONE, FAILED):
+            self._active.discard(job_id)
+
+    def _lost(self, job_id: str, pid: Optional[int], host: Optional[str]) -> bool:
+        # Jobs of other hosts (or from before owners were recorded) cannot be checked
+        if pid is None or host != self._host:
+            return False
+        if pid == os.getpid():
+            return job_id not in self._active
+        return not _process_alive(pid)
+
+    def _fail_lost(self, job_ids: List[str]):
+        # Only jobs still unfinished: the owner may have finished one meanwhile
+        with self._connect() as db:
+            db.executemany('UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ? AND status IN (?, ?)',
+                           [(FAILED, LOST_JOB_ERROR, time.time(), job_id, QUEUED, RUNNING) for job_id in job_ids])
+
+    def get(self, job_id: str, include_result: bool = True) -> Optional[Dict]:
+        columns = 'id, status, created_at, started_at, finished_at, done, total, error, pid, host'
+        if include_result:
+            columns += ', result'
+        row = self._connect().execute(f'SELECT {columns} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        if row[1] in (QUEUED, RUNNING) and self._lost(job_id, row[8], row[9]):
+            self._fail_lost([job_id])
+            return self.get(job_id, include_result)
+        job = {
+            'job_id': row[0],
+            'status': row[1],
+            'created_at': row[2],
+            'started_at': row[3],
+            'finished_at': row[4],
+            'progress': {'done': row[5], 'total': row[6]}
+        }
+        if row[7] is not None:
+            job['error'] = row[7]
+        if include_result and row[10] is not None:
+            job['result'] = json.loads(row[10])
+        return job
+
+    def purge(self, older_than: float = JOB_RETENTION) -> int:
+        # Fails lost jobs too, so they count towards retention like any finished job
+        unfinished = self._connect().execute('SELECT id, pid, host FROM jobs WHERE status IN (?, ?)',
+                                             (QUEUED, RUNNING)).fetchall()
+        lost = [job_id for job_id, pid, host in unfinished if self._lost(job_id, pid, host)]
+        if lost:
+            self._fail_lost(lost)
+        with self._connect() as db:
+            cursor = db.execute('DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?',
+                                (time.time() - older_than,))
+        return cursor.rowcount
+
+
+class JobQueue:
+    # Runs jobs on a few background threads of this process. At most max_pending jobs
+    # may be queued or running at once; beyond that submit raises JobQueueFull so the
+    # caller can push back instead of piling up work.
+    def __init__(self, store: JobStore, workers: int = 2, max_pending: int = 64):
+        self.store = store
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='extraction-job')
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, run: Callable[[Callable[[int], None]], Dict], total: int = 1) -> str:
+        # run receives a callback reporting how many of the total items are done
+        # and returns the job result
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f'Job queue is full ({self.max_pending} jobs pending)')
+            self._pending += 1
+        try:
+            self.store.purge()
+            job_id = self.store.create(total)
+            self._executor.submit(self._run, job_id, run)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return job_id
+
+    def _run(self, job_id: str, run: Callable[[Callable[[int], None]], Dict]):
+        try:
+            self.store.update(job_id, status=RUNNING, started_at=time.time())
+            result = run(lambda done: self.store.update(job_id, done=done))
+            self.store.update(job_id, status=DONE, result=result, finished_at=time.time())
+        except Exception as e:
+            self.store.update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'pending': self._pending, 'max_pending': self.max_pending, 'workers': self.workers}
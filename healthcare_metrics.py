@@ -0,0 +1,137 @@
+import os
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Dict, Tuple, Optional
+
+SECONDS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+# Stage timings of the request being handled, when it asked for a breakdown
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar('request_timings', default=None)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple, label: str):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.label = label
+        # label value -> [bucket counts..., +Inf count, sum]
+        self.series: Dict[str, List[float]] = {}
+
+    def observe(self, label_value: str, value: float):
+        series = self.series.get(label_value)
+        if series is None:
+            series = self.series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        for label_value in sorted(self.series):
+            series = self.series[label_value]
+            labels = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{labels}}} {series[-1]:.6f}')
+            lines.append(f'{self.name}_count{{{labels}}} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.stage_seconds = Histogram('extraction_stage_seconds', 'Wall time spent in each pipeline stage',
+                                       SECONDS_BUCKETS, 'stage')
+        self.stage_items = Histogram('extraction_stage_items', 'Items produced per call by each pipeline stage',
+                                     SIZE_BUCKETS, 'stage')
+        self.document_chars = Histogram('extraction_document_chars', 'Size of documents processed',
+                                        SIZE_BUCKETS, 'endpoint')
+        self.request_seconds = Histogram('extraction_request_seconds', 'Wall time per API request',
+                                         SECONDS_BUCKETS, 'endpoint')
+
+    def observe(self, histogram: Histogram, label_value: str, value: float):
+        with self._lock:
+            histogram.observe(label_value, value)
+
+    def render(self, extra_lines: List[str] = None) -> str:
+        with self._lock:
+            lines = []
+            for histogram in (self.stage_seconds, self.stage_items, self.document_chars, self.request_seconds):
+                lines.extend(histogram.render())
+        lines.extend(extra_lines or [])
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry(os.environ.get('EXTRACTION_METRICS', '1').lower() not in ('0', 'false', 'no', 'off'))
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ('name', 'started')
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.started
+        registry.observe(registry.stage_seconds, self.name, elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[self.name] = timings.get(self.name, 0.0) + elapsed
+        return False
+
+
+def stage(name: str):
+    # Times a block as one pipeline stage; a shared no-op when metrics are disabled
+    # and no request asked for a breakdown
+    if not registry.enabled and _request_timings.get() is None:
+        return _NULL_STAGE
+    return _Stage(name)
+
+
+def count(name: str, items: int):
+    if registry.enabled:
+        registry.observe(registry.stage_items, name, items)
+
+
+def observe_request(endpoint: str, seconds: float, chars: int = None):
+    if registry.enabled:
+        registry.observe(registry.request_seconds, endpoint, seconds)
+        if chars is not None:
+            registry.observe(registry.document_chars, endpoint, chars)
+
+
+@contextmanager
+def collect_timings():
+    # Collects a per-stage breakdown (in milliseconds) of the work done inside the block
+    timings: Dict[str, float] = {}
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+        for name in timings:
+            timings[name] = round(timings[name] * 1000, 3)
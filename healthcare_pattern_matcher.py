@@ -0,0 +1,112 @@
+import re
+from typing import List, Dict, Tuple, Iterable, Optional, Set
+
+# Same heuristic the extractor has always used to tell regex patterns from dictionary terms
+REGEX_HINT = re.compile(r'\\d|\\w|\+|\*|\[|\]|\(|\)|\{|\}|\^|\$|\.|\?')
+REGEX_METACHARACTERS = set('.^$*+?{}[]\\|()')
+
+
+class MultiPatternScanner:
+    # Finds the same matches as calling finditer once per pattern, in a single scan
+    def __init__(self, patterns: List[str], flags: int = 0):
+        self.patterns = patterns
+        self.compiled = [re.compile(pattern, flags) for pattern in patterns]
+
+        # Patterns with their own groups would break the named-group bookkeeping,
+        # so they keep a dedicated finditer pass
+        self.scanned = [i for i, compiled in enumerate(self.compiled) if compiled.groups == 0]
+        self.unscanned = [i for i, compiled in enumerate(self.compiled) if compiled.groups > 0]
+        self.scanner = None
+        if self.scanned:
+            # A zero-width lookahead reports every position where at least one pattern
+            # matches; the named group that fired is the first pattern matching there
+            alternation = '|'.join(f'(?P<p{i}>{patterns[i]})' for i in self.scanned)
+            try:
+                self.scanner = re.compile(f'(?=(?:{alternation}))', flags)
+            except re.error:
+                self.scanned, self.unscanned = [], list(range(len(patterns)))
+
+    def scan(self, text: str, enabled: Optional[Set[int]] = None) -> List[List[Tuple[int, int]]]:
+        # Returns the (start, end) matches of every pattern, indexed like the patterns
+        hits: List[List[Tuple[int, int]]] = [[] for _ in self.patterns]
+
+        if self.scanner is not None:
+            first_slot = {f'p{i}': slot for slot, i in enumerate(self.scanned)}
+            last_end = [-1] * len(self.scanned)
+            for found in self.scanner.finditer(text):
+                pos = found.start()
+                for slot in range(first_slot[found.lastgroup], len(self.scanned)):
+                    i = self.scanned[slot]
+                    # Each pattern only matches again after its previous match ended,
+                    # exactly as its own finditer would
+                    if pos < last_end[slot] or (enabled is not None and i not in enabled):
+                        continue
+                    match = self.compiled[i].match(text, pos)
+                    if match:
+                        hits[i].append((pos, match.end()))
+                        last_end[slot] = match.end()
+
+        for i in self.unscanned:
+            if enabled is None or i in enabled:
+                hits[i] = [match.span() for match in self.compiled[i].finditer(text)]
+        return hits
+
+
+class EntityPatternMatcher:
+    def __init__(self, entity_types: Dict):
+        # Dictionary terms are matched against whole tokens, so a hash lookup on the
+        # normalized token replaces one fullmatch per pattern per token
+        self.literal_terms: Dict[str, List[Tuple[str, int, str]]] = {}
+        self.token_patterns: List[Tuple[str, int, str, re.Pattern]] = []
+        self.text_patterns: List[Tuple[str, int, str]] = []
+
+        for entity_type, entity_config in entity_types.items():
+            for rank, pattern in enumerate(entity_config['patterns']):
+                if REGEX_HINT.search(pattern):
+                    self.text_patterns.append((entity_type, rank, pattern))
+                elif REGEX_METACHARACTERS.isdisjoint(pattern):
+                    self.literal_terms.setdefault(pattern.lower(), []).append((entity_type, rank, pattern))
+                else:
+                    self.token_patterns.append((entity_type, rank, pattern, re.compile(pattern, re.IGNORECASE)))
+
+        self.scanner = MultiPatternScanner([pattern for _, _, pattern in self.text_patterns], re.IGNORECASE)
+        self.token_types = {entry[0] for entries in self.literal_terms.values() for entry in entries} | \
+            {entry[0] for entry in self.token_patterns}
+
+    def needs_tokens(self, selected_types: List[str]) -> bool:
+        # Whether any selected type is matched against tokens, i.e. whether match()
+        # needs token_spans at all
+        return not self.token_types.isdisjoint(selected_types)
+
+    def match(self, text: str, token_spans: Iterable[Tuple[str, int, int]],
+              selected_types: List[str]) -> List[Tuple[str, str, int, int]]:
+        type_ranks = {}
+        for entity_type in selected_types:
+            type_ranks.setdefault(entity_type, len(type_ranks))
+
+        # Hits are bucketed per (type, pattern) so callers see them in the same order
+        # as a loop over selected types and their patterns would produce
+        buckets: Dict[Tuple[int, int], List[Tuple[str, str, int, int]]] = {}
+
+        def add(entity_type, rank, pattern, start, end):
+            key = (type_ranks[entity_type], rank)
+            buckets.setdefault(key, []).append((entity_type, pattern, start, end))
+
+        enabled = {i for i, entry in enumerate(self.text_patterns) if entry[0] in type_ranks}
+        for (entity_type, rank, pattern), spans in zip(self.text_patterns, self.scanner.scan(text, enabled)):
+            for start, end in spans:
+                add(entity_type, rank, pattern, start, end)
+
+        token_patterns = [entry for entry in self.token_patterns if entry[0] in type_ranks]
+        for token, start, end in token_spans:
+            for entity_type, rank, pattern in self.literal_terms.get(token.lower(), ()):
+                if entity_type in type_ranks:
+                    add(entity_type, rank, pattern, start, end)
+            for entity_type, rank, pattern, compiled in token_patterns:
+                if compiled.fullmatch(token):
+                    add(entity_type, rank, pattern, start, end)
+
+        hits = []
+        for key in sorted(buckets):
+            hits.extend(buckets[key])
+        return hits
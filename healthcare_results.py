@@ -0,0 +1,194 @@
+import json
+import numpy as np
+from typing import List, Dict, Iterator, Sequence, Callable, Collection
+
+# Must match the context window of the event extractor
+EVENT_CONTEXT_WINDOW = 100
+
+
+def _offset_dtype(length: int):
+    return np.int32 if length < 2 ** 31 else np.int64
+
+
+def _intern(values: Sequence[str]):
+    # Returns the distinct values in first-seen order and the id of every value
+    table: Dict[str, int] = {}
+    ids = np.fromiter((table.setdefault(value, len(table)) for value in values), np.int32, len(values))
+    return list(table), ids
+
+
+def _grouped_statistics(type_names: List[str], type_ids: np.ndarray, labels: List[str], key: str) -> Dict:
+    # Types appear in the order of their first occurrence, as the dict-based statistics do
+    stats = {}
+    if not len(type_ids):
+        return stats
+    _, first = np.unique(type_ids, return_index=True)
+    for type_id in type_ids[np.sort(first)].tolist():
+        members = np.flatnonzero(type_ids == type_id).tolist()
+        stats[type_names[type_id]] = {'count': len(members), key: [labels[i] for i in members]}
+    return stats
+
+
+class EntityColumns:
+    # Struct-of-arrays form of an entity list. The entity text is never stored: it is
+    # sliced from the source document when the entities are converted back to dicts.
+    __slots__ = ('type_names', 'type_ids', 'starts', 'ends', 'confidences', 'patterns', 'pattern_ids')
+
+    def __init__(self, type_names: List[str], type_ids: np.ndarray, starts: np.ndarray, ends: np.ndarray,
+                 confidences: np.ndarray, patterns: List[str], pattern_ids: np.ndarray):
+        self.type_names = type_names
+        self.type_ids = type_ids
+        self.starts = starts
+        self.ends = ends
+        self.confidences = confidences
+        self.patterns = patterns
+        self.pattern_ids = pattern_ids
+
+    @classmethod
+    def from_entities(cls, source: str, entities: List[Dict]) -> 'EntityColumns':
+        offset_dtype = _offset_dtype(len(source))
+        type_names, type_ids = _intern([entity['type'] for entity in entities])
+        patterns, pattern_ids = _intern([entity['pattern_matched'] for entity in entities])
+        return cls(
+            type_names, type_ids,
+            np.fromiter((entity['start'] for entity in entities), offset_dtype, len(entities)),
+            np.fromiter((entity['end'] for entity in entities), offset_dtype, len(entities)),
+            np.fromiter((entity['confidence'] for entity in entities), np.float64, len(entities)),
+            patterns, pattern_ids
+        )
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def texts(self, source: str) -> List[str]:
+        return [source[start:end] for start, end in zip(self.starts.tolist(), self.ends.tolist())]
+
+    def to_dicts(self, source: str) -> List[Dict]:
+        # Same keys, order and values as the extractor's entity dicts
+        return [
+            {'text': text, 'start': start, 'end': end, 'type': self.type_names[type_id],
+             'confidence': confidence, 'pattern_matched': self.patterns[pattern_id]}
+            for text, start, end, type_id, confidence, pattern_id in zip(
+                self.texts(source), self.starts.tolist(), self.ends.tolist(), self.type_ids.tolist(),
+                self.confidences.tolist(), self.pattern_ids.tolist())
+        ]
+
+    def type_counts(self) -> Dict[str, int]:
+        counts = np.bincount(self.type_ids, minlength=len(self.type_names)).tolist()
+        return {name: count for name, count in zip(self.type_names, counts) if count}
+
+    def statistics(self, source: str) -> Dict:
+        return _grouped_statistics(self.type_names, self.type_ids, self.texts(source), 'entities')
+
+
+class EventColumns:
+    # Struct-of-arrays form of an event list. Trigger and context are sliced from the
+    # source document on conversion; only the attribute dicts are kept per event.
+    # context says whether the events carried context strings.
+    __slots__ = ('type_names', 'type_ids', 'starts', 'ends', 'confidences', 'attributes', 'context')
+
+    def __init__(self, type_names: List[str], type_ids: np.ndarray, starts: np.ndarray, ends: np.ndarray,
+                 confidences: np.ndarray, attributes: List[Dict], context: bool = True):
+        self.type_names = type_names
+        self.type_ids = type_ids
+        self.starts = starts
+        self.ends = ends
+        self.confidences = confidences
+        self.attributes = attributes
+        self.context = context
+
+    @classmethod
+    def from_events(cls, source: str, events: List[Dict], context: bool = True) -> 'EventColumns':
+        offset_dtype = _offset_dtype(len(source))
+        type_names, type_ids = _intern([event['type'] for event in events])
+        return cls(
+            type_names, type_ids,
+            np.fromiter((event['start'] for event in events), offset_dtype, len(events)),
+            np.fromiter((event['end'] for event in events), offset_dtype, len(events)),
+            np.fromiter((event['confidence'] for event in events), np.float64, len(events)),
+            [event['attributes'] for event in events], context
+        )
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def triggers(self, source: str) -> List[str]:
+        return [source[start:end] for start, end in zip(self.starts.tolist(), self.ends.tolist())]
+
+    def to_dicts(self, source: str) -> List[Dict]:
+        # Same keys, order and values as the extractor's event dicts
+        events = []
+        for trigger, start, end, type_id, confidence, attributes in zip(
+                self.triggers(source), self.starts.tolist(), self.ends.tolist(), self.type_ids.tolist(),
+                self.confidences.tolist(), self.attributes):
+            event = {'type': self.type_names[type_id], 'trigger': trigger, 'start': start, 'end': end,
+                     'attributes': attributes, 'confidence': confidence}
+            if self.context:
+                event['context'] = source[max(0, start - EVENT_CONTEXT_WINDOW):end + EVENT_CONTEXT_WINDOW].strip()
+            events.append(event)
+        return events
+
+    def type_counts(self) -> Dict[str, int]:
+        counts = np.bincount(self.type_ids, minlength=len(self.type_names)).tolist()
+        return {name: count for name, count in zip(self.type_names, counts) if count}
+
+    def statistics(self, source: str) -> Dict:
+        return _grouped_statistics(self.type_names, self.type_ids, self.triggers(source), 'events')
+
+
+class CompactResult:
+    # An extract_document result held as columns, without the document text it refers
+    # to: batch and job results are kept in this form until they are serialized, one
+    # document at a time. Keys set on it (index, id) are added to the converted dict.
+    __slots__ = ('entities', 'events', 'fields', 'extra')
+
+    def __init__(self, entities: EntityColumns, events: EventColumns, fields: Collection[str]):
+        self.entities = entities
+        self.events = events
+        self.fields = tuple(fields)
+        self.extra: Dict = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.extra or key in self.fields
+
+    def __setitem__(self, key: str, value):
+        self.extra[key] = value
+
+    def to_dict(self, source: str) -> Dict:
+        # The dict-based result extract_document gives for the same document
+        result = {}
+        if 'entities' in self.fields:
+            result['entities'] = self.entities.to_dicts(source)
+        if 'events' in self.fields:
+            result['events'] = self.events.to_dicts(source)
+        if 'statistics' in self.fields:
+            result['statistics'] = {
+                'entities': self.entities.statistics(source),
+                'events': self.events.statistics(source),
+                'total_entities': len(self.entities),
+                'total_events': len(self.events)
+            }
+        result.update(self.extra)
+        return result
+
+
+def expand_result(result, source: str) -> Dict:
+    return result.to_dict(source) if isinstance(result, CompactResult) else result
+
+
+def dump_batch(batch: Dict, texts: List[str], dumps: Callable[[object], str] = json.dumps) -> Iterator[str]:
+    # Serializes a batch response ({'results': [...], ...} with results in input order,
+    # each carrying its 'index') in pieces, converting one compact result at a time so
+    # the whole batch never exists as dicts. Keys come sorted, as jsonify writes them.
+    yield '{'
+    for number, key in enumerate(sorted(batch)):
+        yield (', ' if number else '') + dumps(key) + ': '
+        if key != 'results':
+            yield dumps(batch[key])
+            continue
+        yield '['
+        for position, result in enumerate(batch['results']):
+            source = texts[result.extra['index']] if isinstance(result, CompactResult) else None
+            yield (', ' if position else '') + dumps(expand_result(result, source))
+        yield ']'
+    yield '}\n'
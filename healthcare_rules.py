@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import List, Dict, Tuple, Optional
+
+DEFAULT_CONFIG_PATH = 'config/extraction_rules.json'
+# Seconds between checks of the rules file for changes
+RELOAD_CHECK_INTERVAL = float(os.environ.get('RULES_RELOAD_INTERVAL', 1.0))
+
+_loaders: Dict[str, 'RuleSetLoader'] = {}
+_loaders_lock = threading.Lock()
+
+
+class RuleSet:
+    # One parsed and compiled snapshot of a rules file. It is never modified after
+    # construction, so a request keeps the rules it started with across a reload.
+    def __init__(self, config_path: str, config: Dict, version: str):
+        from healthcare_entity_extractor import HealthcareEntityExtractor
+        from healthcare_event_extractor import HealthcareEventExtractor
+        from healthcare_segments import SegmentCache
+
+        self.config_path = config_path
+        self.config = config
+        self.version = version
+        self.loaded_at = time.time()
+        # Per-segment results for notes that repeat each other in parts (SEGMENT_CACHE_ENTRIES
+        # segments, off when 0). Read at load time so a process can enable it before forking.
+        segment_entries = int(os.environ.get('SEGMENT_CACHE_ENTRIES', 0))
+        self.segment_cache = SegmentCache(segment_entries) if segment_entries > 0 else None
+        # ENTITY_BACKEND=spacy finds entities with a spaCy pipeline (see healthcare_backends)
+        backend = os.environ.get('ENTITY_BACKEND', 'rules')
+        self.entity_extractor = HealthcareEntityExtractor(config_path, config, self.segment_cache, backend)
+        self.event_extractor = HealthcareEventExtractor(config_path, config, self.segment_cache)
+        if backend != 'rules':
+            # Results, cached or checkpointed, are only reused with the same backend
+            self.version = f'{version}+{self.entity_extractor.backend.name}'
+        self.domains = [key[:-len('_entities')] for key in config if key.endswith('_entities')]
+
+    @classmethod
+    def load(cls, config_path: str) -> 'RuleSet':
+        with open(config_path, 'rb') as f:
+            raw = f.read()
+        return cls(config_path, json.loads(raw), hashlib.sha256(raw).hexdigest()[:16])
+
+    @property
+    def extractors(self) -> Tuple:
+        return self.entity_extractor, self.event_extractor
+
+    def entity_types(self, domain: str) -> List[str]:
+        return list(self.config.get(f'{domain}_entities', {}).keys())
+
+
+class RuleSetLoader:
+    def __init__(self, config_path: str = DEFAULT_CONFIG_PATH, check_interval: float = RELOAD_CHECK_INTERVAL):
+        self.config_path = config_path
+        self.check_interval = check_interval
+        self._reload_lock = threading.Lock()
+        self._stamp = self._file_stamp()
+        self._rule_set = RuleSet.load(config_path)
+        self._checked_at = time.monotonic()
+        self.reloads = 0
+        self.last_error: Optional[str] = None
+
+    def _file_stamp(self) -> Tuple[int, int]:
+        stat = os.stat(self.config_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def current(self) -> RuleSet:
+        # At most one thread checks the file and rebuilds the rules; every other
+        # request keeps using the current rule set in the meantime
+        now = time.monotonic()
+        if now - self._checked_at >= self.check_interval and self._reload_lock.acquire(blocking=False):
+            try:
+                self._checked_at = now
+                self._reload_if_changed()
+            finally:
+                self._reload_lock.release()
+        return self._rule_set
+
+    def reload(self) -> RuleSet:
+        with self._reload_lock:
+            self._checked_at = time.monotonic()
+            self._reload_if_changed()
+        return self._rule_set
+
+    def _reload_if_changed(self):
+        try:
+            stamp = self._file_stamp()
+            if stamp == self._stamp:
+                return
+            rule_set = RuleSet.load(self.config_path)
+        except Exception as e:
+            # A missing, half-written or invalid file (bad JSON, a regex that does not
+            # compile, ...) leaves the previous rules in service
+            self.last_error = str(e)
+            return
+        self._stamp = stamp
+        self.last_error = None
+        if rule_set.version != self._rule_set.version:
+            # Swapping the reference is atomic; requests already running hold the old one
+            self._rule_set = rule_set
+            self.reloads += 1
+
+    def status(self) -> Dict:
+        rule_set = self._rule_set
+        return {
+            'config_path': self.config_path,
+            'version': rule_set.version,
+            'loaded_at': rule_set.loaded_at,
+            'reloads': self.reloads,
+            'last_error': self.last_error
+        }
+
+
+def rule_set_loader(config_path: str = DEFAULT_CONFIG_PATH) -> RuleSetLoader:
+    # One loader per rules file and process
+    loader = _loaders.get(config_path)
+    if loader is None:
+        with _loaders_lock:
+            loader = _loaders.get(config_path)
+            if loader is None:
+                loader = _loaders[config_path] = RuleSetLoader(config_path)
+    return loader
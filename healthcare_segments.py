@@ -0,0 +1,107 @@
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Callable, Optional
+
+# Segments end at a line break or at a sentence end followed by whitespace, so a line
+# or sentence repeated across notes is cut the same way wherever it appears. Pieces
+# shorter than SEGMENT_MIN_SIZE are merged with the next to keep the per-segment
+# overhead down; the cuts fall back into step after a merge.
+SEGMENT_BOUNDARY = re.compile(r'\n|[.!?](?=\s)')
+SEGMENT_MIN_SIZE = 200
+# Longer segments are still extracted segment by segment but never stored
+SEGMENT_MAX_SIZE = 16 * 1024
+
+
+def segment_bounds(text: str, start: int = 0, end: Optional[int] = None) -> List[int]:
+    # [start, cut, cut, ..., end] for the segments of text[start:end]
+    end = len(text) if end is None else end
+    bounds = [start]
+    for match in SEGMENT_BOUNDARY.finditer(text, start, end):
+        if match.end() - bounds[-1] >= SEGMENT_MIN_SIZE:
+            bounds.append(match.end())
+    if bounds[-1] < end:
+        if len(bounds) > 1 and end - bounds[-1] < SEGMENT_MIN_SIZE:
+            bounds[-1] = end
+        else:
+            bounds.append(end)
+    return bounds
+
+
+def segment_key(window: str, *parts) -> bytes:
+    # Digest of everything a segment's results depend on: the text of the window they
+    # were computed on, plus where the segment lies in it and any other inputs
+    digest = hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=16)
+    digest.update(window.encode('utf-8'))
+    return digest.digest()
+
+
+class SegmentCache:
+    # Extraction results of single segments, keyed by segment_key, with the least
+    # recently used evicted first. One cache belongs to one rule set, so a rules
+    # change starts from an empty cache.
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: bytes) -> Optional[List]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: bytes, value: List):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def cached(self, bounds: List[int], key: Callable[[int, int], bytes],
+               compute: Callable[[List[int]], List[List]]) -> List[List]:
+        # Results of every segment between consecutive bounds. key(start, end) names a
+        # segment's results; compute(run_bounds) extracts a run of consecutive segments
+        # that missed in one go and returns their results in order.
+        count = len(bounds) - 1
+        keys = [key(bounds[i], bounds[i + 1]) for i in range(count)]
+        results = [self.get(segment) for segment in keys]
+        i = 0
+        while i < count:
+            if results[i] is not None:
+                i += 1
+                continue
+            j = i
+            while j < count and results[j] is None:
+                j += 1
+            for k, value in enumerate(compute(bounds[i:j + 1]), i):
+                results[k] = value
+                if bounds[k + 1] - bounds[k] <= SEGMENT_MAX_SIZE:
+                    self.put(keys[k], value)
+            i = j
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
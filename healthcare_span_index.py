@@ -0,0 +1,97 @@
+import re
+from bisect import bisect_left, bisect_right
+from typing import List, Dict, Tuple
+
+
+class EntitySpanIndex:
+    def __init__(self, entities: List[Dict]):
+        self.entities = entities
+        # Stable sort, so spans with the same start and length keep their input order
+        self.ordered = sorted(range(len(entities)),
+                              key=lambda i: (entities[i]['start'], -(entities[i]['end'] - entities[i]['start'])))
+        self._by_type: Dict[str, Tuple[List[int], List[int], List[int], List[int]]] = {}
+
+    def non_overlapping(self, after: Tuple[int, int] = (0, 0)) -> List[Dict]:
+        # Sweep in (start, -length) order: a span can only collide with the last
+        # non-empty span kept, because kept spans never overlap each other.
+        # after carries that span over from a previous sweep of earlier text.
+        kept = []
+        last_start, last_end = after
+        for i in self.ordered:
+            entity = self.entities[i]
+            if entity['start'] < last_end and entity['end'] > last_start:
+                continue
+            kept.append(entity)
+            if entity['end'] > entity['start']:
+                last_start, last_end = entity['start'], entity['end']
+        return kept
+
+    @staticmethod
+    def last_span(kept: List[Dict], after: Tuple[int, int] = (0, 0)) -> Tuple[int, int]:
+        for entity in reversed(kept):
+            if entity['end'] > entity['start']:
+                return entity['start'], entity['end']
+        return after
+
+    def _type_arrays(self, entity_type: str) -> Tuple[List[int], List[int], List[int], List[int]]:
+        arrays = self._by_type.get(entity_type)
+        if arrays is None:
+            members = [i for i, entity in enumerate(self.entities) if entity['type'] == entity_type]
+            by_start = sorted(members, key=lambda i: self.entities[i]['start'])
+            by_end = sorted(members, key=lambda i: self.entities[i]['end'])
+            arrays = (
+                [self.entities[i]['start'] for i in by_start], by_start,
+                [self.entities[i]['end'] for i in by_end], by_end
+            )
+            self._by_type[entity_type] = arrays
+        return arrays
+
+    def near(self, entity_type: str, start: int, end: int, proximity: int) -> List[Dict]:
+        # An entity is near a span when its start lies within proximity of the span's
+        # end or its end lies within proximity of the span's start; results keep the
+        # order of the entity list the index was built from
+        starts, by_start, ends, by_end = self._type_arrays(entity_type)
+        hits = set(by_start[bisect_left(starts, end - proximity):bisect_right(starts, end + proximity)])
+        hits.update(by_end[bisect_left(ends, start - proximity):bisect_right(ends, start + proximity)])
+        return [self.entities[i] for i in sorted(hits)]
+
+
+class PatternSpanIndex:
+    # Every match of a list of patterns over one document, kept as sorted span arrays
+    # so the matches inside any window come from two bisects per pattern. The text is
+    # scanned on the first lookup, so documents that never ask pay nothing.
+    def __init__(self, patterns: List[re.Pattern], text: str):
+        self.patterns = patterns
+        self.text = text
+        self._spans = None
+
+    def _scan(self) -> List[Tuple[List[int], List[int], List]]:
+        spans = []
+        for pattern in self.patterns:
+            starts, ends, values = [], [], []
+            for match in pattern.finditer(self.text):
+                starts.append(match.start())
+                ends.append(match.end())
+                values.append(findall_value(pattern, match))
+            spans.append((starts, ends, values))
+        return spans
+
+    def values_within(self, start: int, end: int) -> List:
+        # Same values, in the same order, as findall with each pattern over text[start:end],
+        # except that only whole matches count: a match cut by the window edge is skipped
+        if self._spans is None:
+            self._spans = self._scan()
+        values = []
+        for starts, ends, pattern_values in self._spans:
+            # Matches of one pattern never overlap, so starts and ends are both sorted
+            values.extend(pattern_values[bisect_left(starts, start):bisect_right(ends, end)])
+        return values
+
+
+def findall_value(pattern: re.Pattern, match: re.Match):
+    # What re.findall reports for a match: the whole match, the only group, or all groups
+    if pattern.groups == 0:
+        return match.group()
+    if pattern.groups == 1:
+        return match.groups('')[0]
+    return match.groups('')
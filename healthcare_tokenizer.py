@@ -1,23 +1,45 @@
 import re
 import json
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterator
+from healthcare_metrics import stage
+
+TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+LAST_TOKEN_PATTERN = re.compile(r'(?:\w+|[^\w\s])\s*$')
+TOKEN_START_PATTERN = re.compile(r'(?<=\s)\S')
+
+# Used when a rules file has no healthcare_tokenizer section
+DEFAULT_ABBREVIATIONS = {
+    'mg': 'milligrams',
+    'ml': 'milliliters',
+    'bp': 'blood pressure',
+    'hr': 'heart rate',
+    'temp': 'temperature',
+    'wbc': 'white blood cell',
+    'rbc': 'red blood cell',
+    'ecg': 'electrocardiogram',
+    'mri': 'magnetic resonance imaging',
+    'ct': 'computed tomography'
+}
+
+DEFAULT_COMPOUNDS = [
+    'heart disease', 'blood pressure', 'chest pain', 'shortness of breath',
+    'abdominal pain', 'back pain', 'joint pain', 'ct scan', 'blood test',
+    'heart rate', 'white blood cell', 'red blood cell'
+]
 
 class HealthcareTokenizer:
-    def __init__(self, config_path: str = 'config/extraction_rules.json'):
-        with open(config_path, 'r') as f:
-            self.config = json.load(f)
+    def __init__(self, config_path: str = 'config/extraction_rules.json', config: Dict = None):
+        if config is None:
+            with open(config_path, 'r') as f:
+                config = json.load(f)
+        self.config = config
         
-        self.medical_abbreviations = {
-            'mg': 'milligrams',
-            'ml': 'milliliters',
-            'bp': 'blood pressure',
-            'hr': 'heart rate',
-            'temp': 'temperature',
-            'wbc': 'white blood cell',
-            'rbc': 'red blood cell',
-            'ecg': 'electrocardiogram',
-            'mri': 'magnetic resonance imaging',
-            'ct': 'computed tomography'
+        tokenizer_config = self.config.get('healthcare_tokenizer', {})
+        self.medical_abbreviations = tokenizer_config.get('abbreviations', DEFAULT_ABBREVIATIONS)
+        # Expansions are split into words once, so expanding a token is a single dict lookup
+        self.abbreviation_words = {
+            abbreviation.lower(): tuple(TOKEN_PATTERN.findall(expansion.lower()))
+            for abbreviation, expansion in self.medical_abbreviations.items()
         }
         
         self.dose_patterns = [
@@ -29,56 +51,103 @@ class HealthcareTokenizer:
             r'twice\s+daily',
             r'once\s+daily'
         ]
+        
+        self.medical_compounds = tokenizer_config.get('compounds', DEFAULT_COMPOUNDS)
+        # Compounds are keyed on their word n-grams; lengths are tried shortest first,
+        # the same bigram-before-trigram preference the tokenizer has always applied
+        compound_ngrams = (tuple(TOKEN_PATTERN.findall(compound.lower())) for compound in self.medical_compounds)
+        self.compound_ngrams = {ngram for ngram in compound_ngrams if len(ngram) > 1}
+        self.compound_lengths = sorted({len(ngram) for ngram in self.compound_ngrams})
+        self.max_compound_length = max(self.compound_lengths, default=1)
+        # Words that can be followed by another word of the same compound
+        self.compound_inner_words = {word for ngram in self.compound_ngrams for word in ngram[:-1]}
     
     def custom_tokenize(self, text: str) -> List[str]:
-        text = text.lower()
-        
-        for abbr, full in self.medical_abbreviations.items():
-            text = re.sub(r'\b' + abbr + r'\b', full, text)
-        
-        tokens = re.findall(r'\b\w+\b|[^\w\s]', text)
-        
-        enhanced_tokens = []
-        i = 0
-        while i < len(tokens):
-            current_token = tokens[i]
-            
-            if i < len(tokens) - 1:
-                bigram = current_token + ' ' + tokens[i + 1]
-                if self._is_medical_compound(bigram):
-                    enhanced_tokens.append(bigram)
-                    i += 2
-                    continue
-            
-            if i < len(tokens) - 2:
-                trigram = current_token + ' ' + tokens[i + 1] + ' ' + tokens[i + 2]
-                if self._is_medical_compound(trigram):
-                    enhanced_tokens.append(trigram)
-                    i += 3
-                    continue
-            
-            enhanced_tokens.append(current_token)
-            i += 1
+        with stage('tokenize'):
+            return [normalized for _, normalized, _, _ in self.tokenize_with_spans(text)]
+    
+    def tokenize_with_spans(self, text: str) -> Iterator[Tuple[str, str, int, int]]:
+        # Yields (token, normalized, start, end) where token is the original text
+        # covered by [start, end) and normalized is what custom_tokenize returns
+        pending = []
+        window = self.max_compound_length
+        for item in self._normalized_tokens(text):
+            pending.append(item)
+            if len(pending) == window:
+                yield self._merge_compound(text, pending, window)
+        while pending:
+            yield self._merge_compound(text, pending, len(pending))
+    
+    def _normalized_tokens(self, text: str) -> Iterator[Tuple[str, int, int]]:
+        for match in TOKEN_PATTERN.finditer(text):
+            start, end = match.span()
+            token = match.group().lower()
+            expansion = self.abbreviation_words.get(token)
+            if expansion is None:
+                yield token, start, end
+            else:
+                # Every word of an expanded abbreviation points back at the abbreviation
+                for part in expansion:
+                    yield part, start, end
+    
+    def _merge_compound(self, text: str, pending: List[Tuple[str, int, int]],
+                        available: int) -> Tuple[str, str, int, int]:
+        # Greedy shortest-compound-first rule over a window of buffered tokens
+        size = 1
+        for length in self.compound_lengths:
+            if length > available:
+                break
+            if tuple(part for part, _, _ in pending[:length]) in self.compound_ngrams:
+                size = length
+                break
         
-        return enhanced_tokens
+        merged = pending[:size]
+        del pending[:size]
+        normalized = ' '.join(part for part, _, _ in merged)
+        start, end = merged[0][1], merged[-1][2]
+        return text[start:end], normalized, start, end
     
     def _is_medical_compound(self, phrase: str) -> bool:
-        medical_compounds = [
-            'heart disease', 'blood pressure', 'chest pain', 'shortness of breath',
-            'abdominal pain', 'back pain', 'joint pain', 'ct scan', 'blood test',
-            'heart rate', 'white blood cell', 'red blood cell'
-        ]
-        return phrase in medical_compounds
+        return tuple(phrase.split(' ')) in self.compound_ngrams
+    
+    def unit_boundary_before(self, text: str, pos: int) -> int:
+        # Largest offset <= pos where a token starts and no compound can span the
+        # boundary, i.e. the previous token does not continue into a compound.
+        # Tokenizing from such an offset gives the same tokens as tokenizing the
+        # whole text, which is what makes chunked extraction exact.
+        # A boundary is nearly always a few characters back, so the first block is small
+        block = 64
+        hi = min(pos, len(text))
+        while hi > 0:
+            lo = max(0, hi - block)
+            for match in reversed(list(TOKEN_START_PATTERN.finditer(text, lo, hi + 1))):
+                if self._ends_compound_free(text, match.start()):
+                    return match.start()
+            hi = lo
+            block = 1024
+        return 0
+    
+    def _ends_compound_free(self, text: str, pos: int) -> bool:
+        lo = max(0, pos - 128)
+        previous = LAST_TOKEN_PATTERN.search(text, lo, pos)
+        if previous is None or (previous.start() == lo and lo > 0):
+            return False
+        token = previous.group().rstrip().lower()
+        expansion = self.abbreviation_words.get(token)
+        if expansion:
+            token = expansion[-1]
+        return token not in self.compound_inner_words
     
     def extract_dosage_info(self, text: str) -> List[Dict]:
         dosages = []
-        for pattern in self.dose_patterns:
-            matches = re.finditer(pattern, text, re.IGNORECASE)
-            for match in matches:
-                dosages.append({
-                    'text': match.group(),
-                    'start': match.start(),
-                    'end': match.end(),
-                    'type': 'DOSAGE'
-                })
+        with stage('dosage'):
+            for pattern in self.dose_patterns:
+                matches = re.finditer(pattern, text, re.IGNORECASE)
+                for match in matches:
+                    dosages.append({
+                        'text': match.group(),
+                        'start': match.start(),
+                        'end': match.end(),
+                        'type': 'DOSAGE'
+                    })
         return dosages
\ No newline at end of file
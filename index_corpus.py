@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Loads bulk extraction results into the search index
+
+Reads the NDJSON shards written by extract_corpus.py and adds every note's entities
+and events to the index behind /api/search and /api/timeline, so a whole corpus can
+be queried without extracting it again. Notes already in the index are replaced.
+
+Usage: python3 index_corpus.py results/
+       python3 index_corpus.py results/part-00003.ndjson --index instance/index.db
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from typing import List, Dict, Tuple, Iterator, Optional
+from datetime import date
+
+from healthcare_index import DocumentIndex
+
+DEFAULT_INDEX_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'index.db')
+
+
+def list_shards(source: str) -> List[str]:
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, 'part-*.ndjson')))
+    return sorted(glob.glob(source, recursive=True))
+
+
+def iter_results(shards: List[str]) -> Iterator[Tuple[str, Dict, Optional[date]]]:
+    for shard in shards:
+        with open(shard, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if 'error' in record:
+                    continue
+                yield str(record['id']), record, None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Load extract_corpus.py results into the search index')
+    parser.add_argument('input', help='extract_corpus.py output directory, or shard files (glob pattern)')
+    parser.add_argument('--index', default=os.environ.get('SEARCH_INDEX_DB', DEFAULT_INDEX_DB),
+                        help='index database (default: SEARCH_INDEX_DB or instance/index.db)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    shards = list_shards(args.input)
+    if not shards:
+        print(f'Error: no result shards found in {args.input}', file=sys.stderr)
+        return 1
+    os.makedirs(os.path.dirname(os.path.abspath(args.index)), exist_ok=True)
+    index = DocumentIndex(args.index)
+    started = time.perf_counter()
+    indexed = index.add_many(iter_results(shards))
+    elapsed = time.perf_counter() - started
+    stats = index.stats()
+    print(f'✓ {indexed:,} notes from {len(shards)} shard(s) indexed in {elapsed:.1f}s '
+          f'({stats["documents"]:,} documents in {args.index})', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,12 +3,18 @@
 Healthcare NER and Event Extraction System
 Run script for the web application
 
-Usage: python3 run_application.py
+Usage: python3 run_application.py                 # install requirements, start the debug server
+       python3 run_application.py --production    # preloaded multi-process server, no install step
+       python3 run_application.py --production --workers 4 --threads 8 --port 8000
 """
 
 import sys
 import os
+import gc
+import signal
+import argparse
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 
 def check_python_version():
     """Check if Python version is compatible"""
@@ -33,7 +39,7 @@ def test_imports():
     """Test if all modules can be imported"""
     try:
         from healthcare_entity_extractor import HealthcareEntityExtractor
-        from event_extractor import HealthcareEventExtractor
+        from healthcare_event_extractor import HealthcareEventExtractor
         from healthcare_tokenizer import HealthcareTokenizer
         import flask
         print("✓ All modules imported successfully")
@@ -42,19 +48,22 @@ def test_imports():
         print(f"✗ Import error: {e}")
         return False
 
-def run_flask_app():
+def print_banner(host, port, mode):
+    print("\n" + "="*50)
+    print("Healthcare NER & Event Extraction System")
+    print("="*50)
+    print(f"Starting Flask application ({mode})...")
+    print(f"Access the application at: http://{'localhost' if host == '0.0.0.0' else host}:{port}")
+    print("Press Ctrl+C to stop the server")
+    print("="*50 + "\n")
+
+def run_flask_app(host='0.0.0.0', port=5000):
     """Run the Flask application"""
     try:
-        print("\n" + "="*50)
-        print("Healthcare NER & Event Extraction System")
-        print("="*50)
-        print("Starting Flask application...")
-        print("Access the application at: http://localhost:5000")
-        print("Press Ctrl+C to stop the server")
-        print("="*50 + "\n")
+        print_banner(host, port, 'debug server')
         
         from app import app
-        app.run(debug=True, host='0.0.0.0', port=5000)
+        app.run(debug=True, host=host, port=port)
     except ImportError as e:
         print(f"✗ Failed to import Flask app: {e}")
         return False
@@ -62,8 +71,147 @@ def run_flask_app():
         print(f"✗ Failed to start Flask app: {e}")
         return False
 
+def preload_app():
+    """Import the app, and with it the compiled rules, before any worker is forked"""
+    from app import app
+    # Objects that exist now are moved out of the collector's reach, so collections in
+    # the workers never write to them and their pages stay shared copy-on-write
+    gc.collect()
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+    return app
+
+def run_gunicorn(host, port, workers, threads):
+    """Serve with gunicorn, loading the app in the master before it forks"""
+    from gunicorn.app.base import BaseApplication
+
+    class PreloadedApplication(BaseApplication):
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    options = {
+        'bind': f'{host}:{port}',
+        'workers': workers,
+        'threads': threads,
+        'preload_app': True,
+        'worker_class': 'gthread' if threads > 1 else 'sync'
+    }
+    PreloadedApplication(preload_app(), options).run()
+
+def create_pooled_server(host, port, application, threads):
+    from werkzeug.serving import BaseWSGIServer
+
+    class PooledWSGIServer(BaseWSGIServer):
+        # Serves requests on a fixed number of threads; the pool is started in
+        # serve_forever so every forked worker gets its own threads
+        def serve_forever(self, poll_interval=0.5):
+            self.executor = ThreadPoolExecutor(threads)
+            try:
+                super().serve_forever(poll_interval)
+            finally:
+                self.executor.shutdown(wait=True)
+
+        def process_request(self, request, client_address):
+            self.executor.submit(self._handle_request, request, client_address)
+
+        def _handle_request(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    return PooledWSGIServer(host, port, application)
+
+def run_prefork(host, port, workers, threads):
+    """Built-in multi-process server: the listening socket and the app are created once,
+    then shared by forked workers that each serve requests on a thread pool"""
+    server = create_pooled_server(host, port, preload_app(), threads)
+    if workers <= 1 or not hasattr(os, 'fork'):
+        server.serve_forever()
+        return
+
+    # Idle workers must not block in accept() while another one takes the connection
+    server.socket.setblocking(False)
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            # SIGTERM stops accepting and lets in-flight requests finish; Ctrl+C is
+            # handled by the master, which forwards it as SIGTERM
+            signal.signal(signal.SIGTERM, signal.default_int_handler)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        if not stopping:
+            stopping = True
+            for pid in children:
+                os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    print(f"✓ Serving with {workers} workers x {threads} threads (master pid {os.getpid()})")
+
+    while children:
+        try:
+            pid, _ = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            # Replace a worker that died unexpectedly
+            spawn()
+    server.server_close()
+
+def run_production_server(host, port, workers, threads):
+    """Run the application with preloaded extractors on several worker processes"""
+    try:
+        import gunicorn
+        server = 'gunicorn'
+    except ImportError:
+        server = 'built-in prefork server'
+    print_banner(host, port, f'{server}, {workers} workers x {threads} threads')
+    if server == 'gunicorn':
+        run_gunicorn(host, port, workers, threads)
+    else:
+        run_prefork(host, port, workers, threads)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run the Healthcare NER web application')
+    parser.add_argument('--production', action='store_true',
+                        help='serve with preloaded extractors on several processes (implies --skip-install)')
+    parser.add_argument('--skip-install', action='store_true', help='do not pip install requirements')
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 5000)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('SERVER_WORKERS', os.cpu_count() or 1)),
+                        help='worker processes in production mode')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('SERVER_THREADS', 4)),
+                        help='request threads per worker in production mode')
+    return parser.parse_args()
+
 def main():
     """Main execution function"""
+    args = parse_args()
     print("Healthcare NER System - Setup and Launch")
     print("-" * 40)
     
@@ -72,7 +220,7 @@ def main():
         return 1
     
     # Install requirements
-    if not install_requirements():
+    if not (args.production or args.skip_install) and not install_requirements():
         return 1
     
     # Test imports
@@ -80,7 +228,10 @@ def main():
         return 1
     
     # Run the application
-    run_flask_app()
+    if args.production:
+        run_production_server(args.host, args.port, max(1, args.workers), max(1, args.threads))
+    else:
+        run_flask_app(args.host, args.port)
     return 0
 
 if __name__ == "__main__":
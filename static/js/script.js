@@ -163,19 +163,7 @@ async function extractEntitiesAndEvents() {
                 hideLoading();
                 return;
             }
-            const response = await fetch('/api/extract', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    text: text,
-                    entity_types: selectedEntityTypes,
-                    min_confidence: minConfidence,
-                    domain: domain
-                })
-            });
-            const data = await response.json();
+            const data = await extractText(text, selectedEntityTypes, minConfidence, domain);
             displayResults(data);
         } else {
             const fileInput = document.getElementById('file-input');
@@ -204,6 +192,57 @@ async function extractEntitiesAndEvents() {
     }
 }
 
+// A new note goes to /api/extract, which answers repeated submissions from the
+// result cache. Re-submitting an edited note sends only the changed region of the
+// text, and the server re-extracts just the part of the note the edit can affect
+async function extractText(text, entityTypes, minConfidence, domain) {
+    const requestExtraction = (url, body) => fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(Object.assign({
+            entity_types: entityTypes,
+            min_confidence: minConfidence,
+            domain: domain
+        }, body))
+    });
+
+    const previous = currentResults;
+    if (!previous || !previous.result_id || !previous.processed_text) {
+        const response = await requestExtraction('/api/extract', { text: text });
+        return response.json();
+    }
+    // Edit offsets count code points on the server; with characters outside the
+    // BMP the server works out the change from the whole text instead
+    const astral = /[\uD800-\uDFFF]/;
+    let response = await requestExtraction('/api/extract/incremental',
+        astral.test(text) || astral.test(previous.processed_text)
+            ? { result_id: previous.result_id, text: text }
+            : { result_id: previous.result_id, edits: [textEdit(previous.processed_text, text)] }
+    );
+    if (response.status === 404) {
+        // No incremental state for the previous note yet (it came from /api/extract)
+        // or it has expired: extract in full, keeping state for the next edit
+        response = await requestExtraction('/api/extract/incremental', { text: text });
+    }
+    return response.json();
+}
+
+function textEdit(oldText, newText) {
+    // The single replacement turning oldText into newText
+    let start = 0;
+    const limit = Math.min(oldText.length, newText.length);
+    while (start < limit && oldText[start] === newText[start]) {
+        start++;
+    }
+    let suffix = 0;
+    while (suffix < limit - start && oldText[oldText.length - 1 - suffix] === newText[newText.length - 1 - suffix]) {
+        suffix++;
+    }
+    return { start: start, end: oldText.length - suffix, text: newText.slice(start, newText.length - suffix) };
+}
+
 function displayResults(data) {
     currentResults = data;
     
@@ -433,16 +472,25 @@ async function exportResults(format) {
     }
     
     try {
-        const response = await fetch(`/api/export/${format}`, {
+        const requestExport = (body) => fetch(`/api/export/${format}`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({
+            body: JSON.stringify(body)
+        });
+        
+        // Results the server still has cached are exported by id; otherwise they are sent back
+        let response = null;
+        if (currentResults.result_id) {
+            response = await requestExport({ result_id: currentResults.result_id });
+        }
+        if (!response || response.status === 404) {
+            response = await requestExport({
                 entities: currentResults.entities,
                 events: currentResults.events
-            })
-        });
+            });
+        }
         
         if (response.ok) {
             const blob = await response.blob();